@@ -8,6 +8,7 @@ const Specification = require('../models/specefication');
 const User = require('../models/User');
 const { spawn } = require('child_process');
 const path = require('path');
+const readline = require('readline');
 
 // =============================================================================
 // BASIC PRODUCT OPERATIONS
@@ -363,34 +364,45 @@ const searchByBarcodes = async (req, res) => {
     if (notFoundBarcodes.length > 0) {
       console.log(`Fetching ${notFoundBarcodes.length} barcodes using Python script...`);
 
-      try {
-        const fetchedData = await runPythonScript(notFoundBarcodes);
-
-        // Step 4: Process and save newly fetched products
-        if (fetchedData && Array.isArray(fetchedData)) {
-          for (const productData of fetchedData) {
-            if (productData && productData.Barcode) {
-              try {
-                const savedProduct = await saveProductToDatabase(productData);
-                if (savedProduct) {
-                  newlyFetchedProducts.push(savedProduct);
-                }
-              } catch (saveError) {
-                console.error(`Error saving product ${productData.Barcode}:`, saveError);
-                finalNotFound.push(productData.Barcode);
-              }
+      // Save each product as soon as Python resolves it. Saves are chained
+      // because generateUniqueProductId relies on the previous insert.
+      let saveChain = Promise.resolve();
+      const saveFetchedProduct = (productData) => {
+        saveChain = saveChain.then(async () => {
+          try {
+            const savedProduct = await saveProductToDatabase(productData);
+            if (savedProduct) {
+              newlyFetchedProducts.push(savedProduct);
             }
+          } catch (saveError) {
+            console.error(`Error saving product ${productData.Barcode}:`, saveError);
           }
-        }
+        });
+      };
 
-        // Determine which barcodes still couldn't be found
-        const savedBarcodes = newlyFetchedProducts.map(p => p.Barcode);
-        finalNotFound = notFoundBarcodes.filter(barcode => !savedBarcodes.includes(barcode));
+      // Repeated barcodes come back once per position; each product is saved once
+      const queuedBarcodes = new Set();
 
+      try {
+        // Step 4: Process and save newly fetched products
+        await runPythonScript(notFoundBarcodes, (record) => {
+          if (record.status === 'found' && record.product && record.product.Barcode) {
+            if (queuedBarcodes.has(record.product.Barcode)) return;
+            queuedBarcodes.add(record.product.Barcode);
+            saveFetchedProduct(record.product);
+          } else if (record.status !== 'found') {
+            console.log(`Barcode ${record.barcode} not fetched (${record.status}): ${record.reason || ''}`);
+          }
+        });
       } catch (pythonError) {
+        // Products streamed before the failure are still saved below
         console.error('Error running Python script:', pythonError);
-        finalNotFound = notFoundBarcodes;
       }
+      await saveChain;
+
+      // Determine which barcodes still couldn't be found
+      const savedBarcodes = newlyFetchedProducts.map(p => p.Barcode);
+      finalNotFound = notFoundBarcodes.filter(barcode => !savedBarcodes.includes(barcode));
     }
 
     // Step 5: Combine existing and newly fetched products
@@ -425,70 +437,139 @@ const searchByBarcodes = async (req, res) => {
 // PYTHON SCRIPT INTEGRATION HELPERS
 // =============================================================================
 
+// Long-lived Python processor (barcode_api_processor.py --serve). One process is
+// shared by all requests so interpreter startup, API clients and AI service
+// health are kept between fetches.
+const PYTHON_REQUEST_TIMEOUT_MS = 60000;
+// Python stops working on a request before the controller gives up on it, so
+// everything finished in time is returned and the rest is reported as pending
+const PYTHON_DEADLINE_MS = PYTHON_REQUEST_TIMEOUT_MS - 10000;
+let processorDaemon = null;
+let nextDaemonRequestId = 1;
+const pendingDaemonRequests = new Map();
+
 /**
- * Execute Python script for barcode processing
- * @param {Array} barcodes - Array of barcode strings
- * @returns {Promise<Array>} - Array of product data objects
+ * Reject every in-flight request, e.g. after the daemon exits
+ * @param {Error} error - Error passed to each pending request
  */
-const runPythonScript = (barcodes) => {
-  return new Promise((resolve, reject) => {
-    const scriptPath = path.join(__dirname, '../utils/barcode_api_processor.py');
+const failPendingDaemonRequests = (error) => {
+  for (const pending of pendingDaemonRequests.values()) {
+    clearTimeout(pending.timer);
+    pending.reject(error);
+  }
+  pendingDaemonRequests.clear();
+};
 
-    console.log(`Executing Python script: ${scriptPath}`);
-    console.log(`Input barcodes:`, barcodes);
+/**
+ * Start the Python processor daemon if it is not already running
+ * @returns {ChildProcess} - Running daemon process
+ */
+const getProcessorDaemon = () => {
+  if (processorDaemon) return processorDaemon;
 
-    const pythonProcess = spawn('python3', [scriptPath], {
-      stdio: ['pipe', 'pipe', 'pipe'],
-      env: { ...process.env } // Pass environment variables to Python
-    });
+  const scriptPath = path.join(__dirname, '../utils/barcode_api_processor.py');
+  console.log(`Starting Python processor daemon: ${scriptPath}`);
 
-    // Send barcodes as JSON to stdin
-    const inputData = JSON.stringify(barcodes);
-    pythonProcess.stdin.write(inputData);
-    pythonProcess.stdin.end();
+  const daemon = spawn('python3', [scriptPath, '--serve'], {
+    stdio: ['pipe', 'pipe', 'pipe'],
+    env: { ...process.env } // Pass environment variables to Python
+  });
 
-    let stdout = '';
-    let stderr = '';
+  // Every stdout line is one JSON response tagged with the request id
+  readline.createInterface({ input: daemon.stdout }).on('line', (line) => {
+    let message;
+    try {
+      message = JSON.parse(line);
+    } catch (parseError) {
+      console.error('Error parsing Python daemon output:', line);
+      return;
+    }
 
-    pythonProcess.stdout.on('data', (data) => {
-      stdout += data.toString();
-    });
+    const pending = pendingDaemonRequests.get(message.id);
+    if (!pending) return; // Request already timed out
 
-    pythonProcess.stderr.on('data', (data) => {
-      stderr += data.toString();
-      // Don't log all stderr as error since Python uses it for info logs too
-    });
+    // Streamed requests get one line per barcode before the final "done" line
+    if (message.result) {
+      if (message.result.status === 'found') pending.products.push(message.result.product);
+      if (pending.onResult) pending.onResult(message.result);
+      return;
+    }
 
-    pythonProcess.on('close', (code) => {
-      console.log(`Python script exited with code: ${code}`);
-
-      if (code === 0) {
-        try {
-          const results = JSON.parse(stdout);
-          console.log(`Python script returned ${results.length} products`);
-          resolve(results);
-        } catch (parseError) {
-          console.error('Error parsing Python script output:', parseError);
-          console.error('Raw output:', stdout);
-          reject(new Error('Failed to parse Python script output'));
-        }
-      } else {
-        console.error(`Python script failed with code ${code}`);
-        console.error('Error output:', stderr);
-        reject(new Error(`Python script exited with code ${code}. Error: ${stderr}`));
-      }
-    });
+    pendingDaemonRequests.delete(message.id);
+    clearTimeout(pending.timer);
+    if (message.error) {
+      pending.reject(new Error(`Python processor error: ${message.error}`));
+    } else {
+      pending.resolve(message.done ? pending.products : message.results);
+    }
+  });
+
+  daemon.stderr.on('data', (data) => {
+    // Python uses stderr for its info logs, only surface them when debugging
+    if (process.env.LOG_LEVEL === 'debug') process.stderr.write(data);
+  });
+
+  daemon.on('exit', (code, signal) => {
+    console.error(`Python processor daemon exited with code ${code} (signal ${signal})`);
+    if (processorDaemon === daemon) processorDaemon = null;
+    failPendingDaemonRequests(new Error(`Python processor exited with code ${code}`));
+  });
 
-    pythonProcess.on('error', (error) => {
-      console.error('Failed to start Python process:', error);
-      reject(error);
+  daemon.on('error', (error) => {
+    console.error('Failed to start Python processor daemon:', error);
+    if (processorDaemon === daemon) processorDaemon = null;
+    failPendingDaemonRequests(error);
+  });
+
+  // Writing to a daemon that just died fails with EPIPE; without a handler the
+  // 'error' event would crash the server. Drop the daemon so the next request
+  // starts a fresh one.
+  daemon.stdin.on('error', (error) => {
+    console.error('Error writing to Python processor daemon:', error);
+    if (processorDaemon === daemon) processorDaemon = null;
+    failPendingDaemonRequests(new Error(`Python processor unavailable: ${error.message}`));
+    daemon.kill();
+  });
+
+  processorDaemon = daemon;
+  return daemon;
+};
+
+/**
+ * Execute Python script for barcode processing
+ * @param {Array} barcodes - Array of barcode strings
+ * @param {Function} [onResult] - Called with each barcode's outcome record as soon as it is resolved
+ * @returns {Promise<Array>} - Array of product data objects
+ */
+const runPythonScript = (barcodes, onResult) => {
+  return new Promise((resolve, reject) => {
+    const daemon = getProcessorDaemon();
+    const id = nextDaemonRequestId++;
+
+    console.log(`Sending ${barcodes.length} barcodes to Python processor (request ${id})`);
+
+    const timer = setTimeout(() => {
+      pendingDaemonRequests.delete(id);
+      reject(new Error(`Python processor timeout (${PYTHON_REQUEST_TIMEOUT_MS / 1000}s)`));
+    }, PYTHON_REQUEST_TIMEOUT_MS);
+
+    pendingDaemonRequests.set(id, {
+      timer,
+      reject,
+      onResult,
+      products: [],
+      resolve: (results) => {
+        console.log(`Python processor returned ${results.length} products (request ${id})`);
+        resolve(results);
+      }
     });
 
-    // Add timeout for long-running processes
-    setTimeout(() => {
-      pythonProcess.kill('SIGTERM');
-      reject(new Error('Python script execution timeout (60s)'));
-    }, 60000);
+    daemon.stdin.write(JSON.stringify({
+      id,
+      barcodes,
+      stream: Boolean(onResult),
+      deadline: PYTHON_DEADLINE_MS / 1000
+    }) + '\n');
   });
 };
 
@@ -1,15 +1,26 @@
 #!/usr/bin/env python3
-import requests
+import aiohttp
+import argparse
+import asyncio
+import contextvars
+import copy
+import hashlib
 import json
 import re
 import time
 import logging
 import os
 import sys
-import pickle
+import sqlite3
 import tempfile
-from datetime import datetime
-from typing import Dict, List, Optional, Tuple
+import threading
+from abc import ABC, abstractmethod
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
 from dotenv import load_dotenv
 
 # Setup logging
@@ -23,8 +34,8 @@ logger = logging.getLogger('barcode_api_processor')
 # Constants (copied from your original constants.py)
 LOG_LEVEL = logging.INFO
 LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-DEFAULT_API_REQUEST_DELAY = 1.0
 DEFAULT_MAX_RETRIES = 5
+DEFAULT_MAX_WORKERS = 1
 OPENFOODFACTS_BASE_URL = "https://world.openfoodfacts.org/api/v0/product/"
 GOOGLE_SEARCH_API_URL = "https://www.googleapis.com/customsearch/v1"
 DIGITEYES_API_URL = "https://www.digiteyes.net/barcode/search.php"
@@ -33,6 +44,22 @@ OPENAI_API_URL = "https://api.openai.com/v1/chat/completions"
 DEEPSEEK_API_URL = "https://api.deepseek.com/v1/chat/completions"
 
 VALID_BARCODE_LENGTHS = [8, 12, 13, 14]
+# EAN-8, UPC-A, EAN-13 and GTIN-14 all map onto a zero-padded GTIN-14 for de-duplication and caching
+GTIN_LENGTH = 14
+
+# Product lookup providers in priority order, with the failure reason recorded for each
+LOOKUP_PROVIDERS = ["openfoodfacts", "google", "digiteyes"]
+LOOKUP_FAILURE_REASONS = {
+    "openfoodfacts": "Not found in OpenFoodFacts",
+    "google": "Not found in Google Search",
+    "digiteyes": "Not found in DigiTeyes"
+}
+# sequential: one provider after another (cheapest on quota)
+# race: query all providers at once and take the highest-priority answer
+# hedged: query OpenFoodFacts first, start the paid providers if it has not answered within LOOKUP_HEDGE_DELAY
+LOOKUP_STRATEGIES = ["sequential", "race", "hedged"]
+DEFAULT_LOOKUP_STRATEGY = "sequential"
+DEFAULT_LOOKUP_HEDGE_DELAY = 1.5
 GEMINI_MODEL = "gemini-1.5-flash-latest"
 OPENAI_MODEL = "gpt-3.5-turbo"
 DEEPSEEK_MODEL = "deepseek-chat"
@@ -101,16 +128,142 @@ SUBCATEGORY_MAP = {
     'juice': 'Beverages'
 }
 
-INDIA_COMPANY_CODES = {
-    '890': 'India',
-    '891': 'India', 
-    '892': 'India',
-    '893': 'India',
-    '894': 'India',
-    '895': 'India'
-}
+# GS1 prefix ranges (first three digits of the GTIN-13) and the member organisation that issued
+# them, which is where the brand owner registered rather than strictly where the product is made.
+# Prefixes marked "origin": False are not a country (restricted numbers, coupons, ISBN, ...) and
+# give no country of origin; prefixes marked "lookup": False never identify a product
+GS1_PREFIX_RANGES = [
+    ("000", "019", {"country": "USA & Canada"}),
+    ("020", "029", {"country": "Restricted distribution", "origin": False}),
+    ("030", "039", {"country": "USA"}),
+    ("040", "049", {"country": "Restricted distribution", "origin": False}),
+    ("050", "059", {"country": "Coupons", "origin": False, "lookup": False}),
+    ("060", "139", {"country": "USA & Canada"}),
+    ("200", "299", {"country": "Restricted distribution", "origin": False}),
+    ("300", "379", {"country": "France & Monaco"}),
+    ("380", "380", {"country": "Bulgaria"}),
+    ("383", "383", {"country": "Slovenia"}),
+    ("385", "385", {"country": "Croatia"}),
+    ("387", "387", {"country": "Bosnia and Herzegovina"}),
+    ("389", "389", {"country": "Montenegro"}),
+    ("390", "390", {"country": "Kosovo"}),
+    ("400", "440", {"country": "Germany"}),
+    ("450", "459", {"country": "Japan"}),
+    ("460", "469", {"country": "Russia"}),
+    ("470", "470", {"country": "Kyrgyzstan"}),
+    ("471", "471", {"country": "Taiwan"}),
+    ("474", "474", {"country": "Estonia"}),
+    ("475", "475", {"country": "Latvia"}),
+    ("476", "476", {"country": "Azerbaijan"}),
+    ("477", "477", {"country": "Lithuania"}),
+    ("478", "478", {"country": "Uzbekistan"}),
+    ("479", "479", {"country": "Sri Lanka"}),
+    ("480", "480", {"country": "Philippines"}),
+    ("481", "481", {"country": "Belarus"}),
+    ("482", "482", {"country": "Ukraine"}),
+    ("483", "483", {"country": "Turkmenistan"}),
+    ("484", "484", {"country": "Moldova"}),
+    ("485", "485", {"country": "Armenia"}),
+    ("486", "486", {"country": "Georgia"}),
+    ("487", "487", {"country": "Kazakhstan"}),
+    ("488", "488", {"country": "Tajikistan"}),
+    ("489", "489", {"country": "Hong Kong"}),
+    ("490", "499", {"country": "Japan"}),
+    ("500", "509", {"country": "United Kingdom"}),
+    ("520", "521", {"country": "Greece"}),
+    ("528", "528", {"country": "Lebanon"}),
+    ("529", "529", {"country": "Cyprus"}),
+    ("530", "530", {"country": "Albania"}),
+    ("531", "531", {"country": "North Macedonia"}),
+    ("535", "535", {"country": "Malta"}),
+    ("539", "539", {"country": "Ireland"}),
+    ("540", "549", {"country": "Belgium & Luxembourg"}),
+    ("560", "560", {"country": "Portugal"}),
+    ("569", "569", {"country": "Iceland"}),
+    ("570", "579", {"country": "Denmark"}),
+    ("590", "590", {"country": "Poland"}),
+    ("594", "594", {"country": "Romania"}),
+    ("599", "599", {"country": "Hungary"}),
+    ("600", "601", {"country": "South Africa"}),
+    ("603", "603", {"country": "Ghana"}),
+    ("604", "604", {"country": "Senegal"}),
+    ("608", "608", {"country": "Bahrain"}),
+    ("609", "609", {"country": "Mauritius"}),
+    ("611", "611", {"country": "Morocco"}),
+    ("613", "613", {"country": "Algeria"}),
+    ("615", "615", {"country": "Nigeria"}),
+    ("616", "616", {"country": "Kenya"}),
+    ("618", "618", {"country": "Ivory Coast"}),
+    ("619", "619", {"country": "Tunisia"}),
+    ("620", "620", {"country": "Tanzania"}),
+    ("621", "621", {"country": "Syria"}),
+    ("622", "622", {"country": "Egypt"}),
+    ("623", "623", {"country": "Brunei"}),
+    ("624", "624", {"country": "Libya"}),
+    ("625", "625", {"country": "Jordan"}),
+    ("626", "626", {"country": "Iran"}),
+    ("627", "627", {"country": "Kuwait"}),
+    ("628", "628", {"country": "Saudi Arabia"}),
+    ("629", "629", {"country": "United Arab Emirates"}),
+    ("640", "649", {"country": "Finland"}),
+    ("690", "699", {"country": "China"}),
+    ("700", "709", {"country": "Norway"}),
+    ("729", "729", {"country": "Israel"}),
+    ("730", "739", {"country": "Sweden"}),
+    ("740", "740", {"country": "Guatemala"}),
+    ("741", "741", {"country": "El Salvador"}),
+    ("742", "742", {"country": "Honduras"}),
+    ("743", "743", {"country": "Nicaragua"}),
+    ("744", "744", {"country": "Costa Rica"}),
+    ("745", "745", {"country": "Panama"}),
+    ("746", "746", {"country": "Dominican Republic"}),
+    ("750", "750", {"country": "Mexico"}),
+    ("754", "755", {"country": "Canada"}),
+    ("759", "759", {"country": "Venezuela"}),
+    ("760", "769", {"country": "Switzerland"}),
+    ("770", "771", {"country": "Colombia"}),
+    ("773", "773", {"country": "Uruguay"}),
+    ("775", "775", {"country": "Peru"}),
+    ("777", "777", {"country": "Bolivia"}),
+    ("778", "779", {"country": "Argentina"}),
+    ("780", "780", {"country": "Chile"}),
+    ("784", "784", {"country": "Paraguay"}),
+    ("786", "786", {"country": "Ecuador"}),
+    ("789", "790", {"country": "Brazil"}),
+    ("800", "839", {"country": "Italy"}),
+    ("840", "849", {"country": "Spain"}),
+    ("850", "850", {"country": "Cuba"}),
+    ("858", "858", {"country": "Slovakia"}),
+    ("859", "859", {"country": "Czech Republic"}),
+    ("860", "860", {"country": "Serbia"}),
+    ("865", "865", {"country": "Mongolia"}),
+    ("867", "867", {"country": "North Korea"}),
+    ("868", "869", {"country": "Turkey"}),
+    ("870", "879", {"country": "Netherlands"}),
+    ("880", "880", {"country": "South Korea"}),
+    ("884", "884", {"country": "Cambodia"}),
+    ("885", "885", {"country": "Thailand"}),
+    ("888", "888", {"country": "Singapore"}),
+    ("890", "890", {"country": "India"}),
+    ("893", "893", {"country": "Vietnam"}),
+    ("896", "896", {"country": "Pakistan"}),
+    ("899", "899", {"country": "Indonesia"}),
+    ("900", "919", {"country": "Austria"}),
+    ("930", "939", {"country": "Australia"}),
+    ("940", "949", {"country": "New Zealand"}),
+    ("950", "950", {"country": "GS1 Global Office", "origin": False}),
+    ("955", "955", {"country": "Malaysia"}),
+    ("958", "958", {"country": "Macau"}),
+    ("960", "969", {"country": "GS1 Global Office (GTIN-8)", "origin": False}),
+    ("977", "977", {"country": "Serial publications (ISSN)", "origin": False}),
+    ("978", "979", {"country": "Books (ISBN)", "origin": False}),
+    ("980", "980", {"country": "Refund receipts", "origin": False, "lookup": False}),
+    ("981", "984", {"country": "Coupons", "origin": False, "lookup": False}),
+    ("990", "999", {"country": "Coupons", "origin": False, "lookup": False})
+]
 
-BARCODE_CATEGORY_PATTERNS = {
+# Known company prefixes (leading GTIN-13 digits) with the category their products fall in
+GS1_COMPANY_PREFIX_HINTS = {
     "2102163": {"category": "Household", "subcategory": "Cleaning"},
     "2102127": {"category": "Household", "subcategory": "Kitchen"},
     "2102160": {"category": "Food", "subcategory": "Oils"},
@@ -119,72 +272,1587 @@ BARCODE_CATEGORY_PATTERNS = {
     # Add more patterns as needed
 }
 
-QUANTITY_PATTERNS = [
-    r'(\d+(?:\.\d+)?)\s*g\b',
-    r'(\d+(?:\.\d+)?)\s*gm\b', 
-    r'(\d+(?:\.\d+)?)\s*gram\b',
-    r'(\d+(?:\.\d+)?)\s*kg\b',
-    r'(\d+(?:\.\d+)?)\s*ml\b',
-    r'(\d+(?:\.\d+)?)\s*l\b',
-    r'(\d+(?:\.\d+)?)\s*liter\b',
-    r'(\d+(?:\.\d+)?)\s*pc\b',
-    r'(\d+(?:\.\d+)?)\s*piece\b',
-    r'(\d+(?:\.\d+)?)\s*pack\b',
-    r'(\d+)\s*x\s*(\d+(?:\.\d+)?)\s*(g|gm|ml|l|kg)',  # For "2 x 500g" format
-    r'(\d+(?:\.\d+)?)\s*Gm\b',  # Capital Gm
-]
+# Unit spellings recognised after a number, mapped to the canonical unit. Listed in
+# priority order: when a text mentions several quantities the earliest unit here wins
+QUANTITY_UNIT_ALIASES = {
+    'g': 'g', 'gm': 'g', 'gms': 'g', 'gram': 'g', 'grams': 'g',
+    'kg': 'kg', 'kgs': 'kg',
+    'ml': 'ml',
+    'l': 'l', 'ltr': 'l', 'liter': 'l', 'liters': 'l', 'litre': 'l', 'litres': 'l',
+    'pc': 'pc', 'pcs': 'pc', 'piece': 'pc', 'pieces': 'pc',
+    'pack': 'pc', 'packs': 'pc'
+}
+# Units allowed in multi-pack quantities such as "2 x 500g"
+MULTIPACK_UNITS = ['g', 'gm', 'gms', 'kg', 'ml', 'l', 'ltr']
+
+AI_SERVICES = ["gemini", "openai", "deepseek"]
+DEFAULT_AI_REQUEST_TIMEOUT = 30
+
+# AI routing. latency: try the backend with the best recent record first, scored over the last
+# AI_ROUTER_WINDOW calls as avg latency + failure rate * AI_ROUTER_FAILURE_PENALTY (seconds lost
+# falling through to the next backend) + AI_ROUTER_COST_WEIGHT * avg cost (seconds per USD).
+# A backend not used for AI_ROUTER_PROBE_INTERVAL seconds is tried first once so its numbers
+# stay fresh. priority: always Gemini, OpenAI, DeepSeek.
+AI_ROUTING_STRATEGIES = ["latency", "priority"]
+DEFAULT_AI_ROUTING = "latency"
+DEFAULT_AI_ROUTER_WINDOW = 20
+DEFAULT_AI_ROUTER_PROBE_INTERVAL = 60.0
+DEFAULT_AI_ROUTER_COST_WEIGHT = 1000.0
+AI_ROUTER_FAILURE_PENALTY = 10.0
+
+# Hedged AI requests (AI_HEDGING=true): if the first backend has not answered within the
+# AI_HEDGE_PERCENTILE of its recent latencies (clamped to AI_HEDGE_MIN_DELAY, or
+# DEFAULT_AI_HEDGE_DELAY until AI_HEDGE_MIN_SAMPLES calls are known) the same prompt also goes
+# to the next backend and the first valid answer wins. AI_HEDGE_BUDGET caps the extra requests
+# as a fraction of all AI requests.
+DEFAULT_AI_HEDGE_PERCENTILE = 0.95
+DEFAULT_AI_HEDGE_DELAY = 8.0
+DEFAULT_AI_HEDGE_MIN_DELAY = 1.0
+DEFAULT_AI_HEDGE_BUDGET = 0.1
+AI_HEDGE_MIN_SAMPLES = 5
+# USD per million prompt / completion tokens, used for the router's cost term
+AI_BACKEND_PRICING = {
+    "gemini": (0.075, 0.30),
+    "openai": (0.50, 1.50),
+    "deepseek": (0.27, 1.10)
+}
+
+# Circuit breaker settings for AI services. After AI_CIRCUIT_FAILURE_THRESHOLD consecutive
+# failures a service is skipped for a cool-down that doubles on every trip (up to the max);
+# auth/quota errors open it straight away for the hard cool-down. Once the cool-down
+# expires a single probe request decides whether it closes again.
+DEFAULT_AI_CIRCUIT_FAILURE_THRESHOLD = 3
+DEFAULT_AI_CIRCUIT_COOLDOWN = 30.0
+DEFAULT_AI_CIRCUIT_MAX_COOLDOWN = 1800.0
+DEFAULT_AI_CIRCUIT_HARD_COOLDOWN = 3600.0
+
+# Static instructions go in the system message (systemInstruction for Gemini) so every request
+# shares the same prefix, which OpenAI and DeepSeek cache automatically; the per-product user
+# message only carries the barcode and the compacted lookup data
+AI_SYSTEM_PROMPT = """You are a product data specialist who extracts and formats product information.
+Given a barcode and lookup data, return only a JSON object with these keys:
+"Product Name", "Brand", "Description" (detailed), "Category" (one of Food & Beverages, Personal Care, \
+Household, Health & Medicine, Baby Care, Beauty, Other), "Subcategory", "ProductLine" (brand + subcategory), \
+"Quantity" (number), "Unit" (g/ml/kg/l/pc), "Features" (4 short strings), "Specification" (object with \
+"Brand", "Weight/Volume", "Country of Origin", "Barcode Type", "Ingredients", "Nutrition Facts").
+Use the accurate product name and brand, a realistic quantity and unit, and features relevant to the category."""
+
+AI_BATCH_SYSTEM_PROMPT = AI_SYSTEM_PROMPT + """
+You will get several products. Return {"products": [...]} with one such object per barcode, \
+each with an extra "Barcode" key copied exactly from the input."""
+
+AI_ENHANCEMENT_PROMPT_TEMPLATE = "Barcode: {barcode}\nData: {context}"
+AI_BATCH_ENHANCEMENT_PROMPT_TEMPLATE = "Products ({count}): {context}"
+
+# Prompt compaction: lookup fields that mean nothing to the model (the image URLs are copied
+# onto the record after enhancement), the rough chars-per-token ratio used for budgeting, and
+# the order in which long text fields are shortened when a product's context is over budget
+AI_PROMPT_EXCLUDED_FIELDS = ('image_url', 'ingredient_image', 'source_url', 'source')
+AI_PROMPT_CHARS_PER_TOKEN = 4
+DEFAULT_AI_PROMPT_TOKEN_BUDGET = 300
+AI_PROMPT_TRUNCATE_FIELDS = ('ingredients', 'description', 'snippet')
+AI_PROMPT_MIN_FIELD_CHARS = 80
+
+# JSON schema of an enhanced product, matching the keys listed in AI_SYSTEM_PROMPT. Sent to each
+# provider's structured-output mode and used to validate replies; optional fields may be null
+AI_PRODUCT_SCHEMA = {
+    "title": "product",
+    "type": "object",
+    "properties": {
+        "Product Name": {"type": "string"},
+        "Brand": {"type": "string"},
+        "Description": {"type": "string"},
+        "Category": {"type": "string"},
+        "Subcategory": {"type": "string"},
+        "ProductLine": {"type": "string"},
+        "Quantity": {"type": "number"},
+        "Unit": {"type": "string"},
+        "Features": {"type": "array", "items": {"type": "string"}},
+        "Specification": {
+            "type": "object",
+            "properties": {
+                "Brand": {"type": "string"},
+                "Weight/Volume": {"type": "string"},
+                "Country of Origin": {"type": "string"},
+                "Barcode Type": {"type": "string"},
+                "Ingredients": {"type": "string"},
+                "Nutrition Facts": {"type": "string"}
+            },
+            "required": []
+        }
+    },
+    "required": ["Product Name", "Brand", "Description", "Category"]
+}
+AI_BATCH_SCHEMA = {
+    "title": "product_batch",
+    "type": "object",
+    "properties": {
+        "products": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {"Barcode": {"type": "string"}, **AI_PRODUCT_SCHEMA["properties"]},
+                "required": ["Barcode"] + AI_PRODUCT_SCHEMA["required"]
+            }
+        }
+    },
+    "required": ["products"]
+}
+# Batched replies are checked per entry, so one bad product does not discard the whole batch
+AI_BATCH_ENVELOPE_SCHEMA = {"type": "object", "properties": {"products": {"type": "array"}}, "required": ["products"]}
+JSON_SCHEMA_TYPES = {
+    "object": dict, "array": list, "string": str, "number": (int, float),
+    "integer": int, "boolean": bool, "null": type(None)
+}
+# OpenAI models that accept response_format json_schema; older chat models only get json_object
+OPENAI_JSON_SCHEMA_MODEL_PREFIXES = ("gpt-4o", "gpt-4.1", "gpt-5", "o1", "o3", "o4")
 
-AI_SERVICE_DEFAULT_STATUS = {
-    "gemini": {"working": True, "failures": 0},
-    "openai": {"working": True, "failures": 0},
-    "deepseek": {"working": True, "failures": 0}
+# Number of products packed into one batched AI enhancement request (1 disables batching)
+DEFAULT_AI_BATCH_SIZE = 1
+AI_BATCH_MAX_OUTPUT_TOKENS = 8000
+
+# Tolerant JSON parsing of LLM replies: bare words mapped to JSON literals, and the
+# decoder used for both the fast path and repaired text (strict=False allows raw newlines in strings)
+JSON_BARE_LITERALS = {
+    'true': 'true', 'false': 'false', 'null': 'null',
+    'True': 'true', 'False': 'false', 'None': 'null'
+}
+# Opening quote -> closing quote of the strings the repair scanner reads (typographic quotes included)
+JSON_QUOTE_PAIRS = {'"': '"', "'": "'", '\u201c': '\u201d'}
+# Extent of an unquoted key (up to the colon), and the characters that end an unquoted value
+# (a separator, line end or quoted string, i.e. the next key after a missing comma:
+# {"Quantity": 500 "Unit": "g"}); see _bare_value_end()
+JSON_BARE_KEY_PATTERN = re.compile(r'[^:,}\n]*')
+JSON_BARE_VALUE_TERMINATORS = ',}]\n"'
+# A quote inside a string only closes it when followed by one of these (or by a line end / the end
+# of the reply); otherwise it is kept as text, e.g. "The "best" butter" or 'Haldiram's'
+JSON_STRING_TERMINATORS = ',:}]"\'\u201c\n'
+JSON_NUMBER_PATTERN = re.compile(r'-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+-]?\d+)?')
+JSON_DECODER = json.JSONDecoder(strict=False)
+
+# Per-provider request budgets: sustained requests per second and burst size.
+# Override with <PROVIDER>_RATE_LIMIT / <PROVIDER>_BURST, e.g. GOOGLE_RATE_LIMIT=0.5
+PROVIDER_RATE_LIMITS = {
+    "openfoodfacts": {"rate": 10.0, "burst": 10},
+    "google": {"rate": 1.0, "burst": 1},
+    "digiteyes": {"rate": 1.0, "burst": 2},
+    "gemini": {"rate": 0.25, "burst": 2},
+    "openai": {"rate": 1.0, "burst": 3},
+    "deepseek": {"rate": 1.0, "burst": 3}
 }
+# Pooled async HTTP sessions, one per upstream provider, with up to HTTP_POOL_SIZE connections each
+# (requests beyond that wait for a free one). Transport retries only cover idempotent GETs on
+# connection errors and 5xx responses; 429s go through the rate limiter
+DEFAULT_HTTP_POOL_SIZE = 10
+DEFAULT_HTTP_RETRIES = 2
+DEFAULT_HTTP_RETRY_BACKOFF = 0.5
+HTTP_RETRY_STATUS_CODES = (500, 502, 503, 504)
+
+# Persistent lookup cache (SQLite). TTLs are in seconds; negative entries record "not found" answers
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'barcode_processor')
+CACHE_DB_FILENAME = 'barcode_cache.sqlite3'
+DEFAULT_CACHE_TTL = 30 * 24 * 3600
+DEFAULT_CACHE_NEGATIVE_TTL = 24 * 3600
+DEFAULT_CACHE_MAX_ENTRIES = 100000
+CACHE_EVICTION_CHECK_INTERVAL = 100
+# Cache provider key for the final, AI-enhanced product record
+CACHE_RESULT_PROVIDER = "result"
+
+# Enhancement cache: AI results reused across pack-size variants of one product, keyed on the
+# brand plus the product name with quantities ("70g", "4 x 70g", "pack of 4") and pack words
+# stripped. Bare numbers stay in the key, so "Stage 1"/"Stage 2" and "S23"/"S24" never share. With
+# ENHANCEMENT_CACHE_SIMILARITY > 0 a same-brand name whose character-trigram Jaccard similarity
+# reaches that threshold also counts (flavour variants). Only the fields below are reused;
+# name, brand, description and quantity always come from the product itself.
+CACHE_ENHANCEMENT_PROVIDER = "enhancement"
+DEFAULT_ENHANCEMENT_CACHE_SIMILARITY = 0.0
+ENHANCEMENT_SHINGLE_SIZE = 3
+ENHANCEMENT_MIN_NAME_WORDS = 2
+ENHANCEMENT_NAME_STOPWORDS = {'pack', 'of', 'combo', 'pouch', 'bottle', 'jar', 'box', 'x'}
+ENHANCEMENT_REUSED_FIELDS = ['Category', 'Subcategory', 'Features', 'Specification']
+# Specification entries that describe the barcode or pack rather than the product line
+ENHANCEMENT_PRODUCT_SPECIFICATION_FIELDS = ['Brand', 'Country of Origin', 'Barcode Type', 'Weight/Volume', 'Net Quantity']
+ENHANCEMENT_QUANTITY_PATTERN = re.compile(
+    r'\b(?:\d+(?:\.\d+)?\s*(?:x\s*\d+(?:\.\d+)?\s*)?(?:'
+    + '|'.join(re.escape(alias) for alias in sorted(QUANTITY_UNIT_ALIASES, key=len, reverse=True))
+    + r')|pack\s+of\s+\d+)\b'
+)
+
+# Local OpenFoodFacts copy built by import_openfoodfacts_dump.py (set OPENFOODFACTS_LOCAL_DB to use it).
+# Only the fields the processor reads are kept; last_modified_t drives incremental updates
+OPENFOODFACTS_LOCAL_FIELDS = ['product_name', 'brands', 'generic_name', 'ingredients_text', 'image_url', 'quantity']
+
+# Resumable bulk jobs: checkpoint journal and assembled output, written next to each other in output_dir
+JOB_JOURNAL_SUFFIX = '.journal.ndjson'
+JOB_OUTPUT_SUFFIX = '.results.json'
+# Outcomes that are not retried when a job is resumed (pending and error barcodes are)
+JOB_FINAL_STATUSES = ('found', 'not_found', 'invalid')
+
+# Wait used on HTTP 429 when the provider sends no Retry-After header (multiplied by attempt number)
+DEFAULT_RATE_LIMIT_BACKOFF = 5.0
+
+# Deadlines (seconds). A batch deadline bounds a whole request, a barcode deadline each barcode;
+# set defaults with BATCH_DEADLINE / BARCODE_DEADLINE. Barcodes left unfinished are reported as "pending"
+DEADLINE_MIN_TIMEOUT = 0.1
+DEADLINE_GRACE = 0.5
+# AI enhancement is skipped in favour of local formatting when less time than this is left
+AI_MIN_TIME_LEFT = 2.0
+
+# Stage latency histograms (seconds) and the metric name prefix used for Prometheus export
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+METRICS_PREFIX = "barcode_processor"
+METRICS_FORMATS = ["json", "prometheus"]
+
+# Process requests the --serve daemon works on at the same time (override with DAEMON_CONCURRENCY)
+DEFAULT_DAEMON_CONCURRENCY = 4
+
+# Per-barcode state, carried by the asyncio task working on a barcode and inherited by the tasks it
+# starts: the stage timings dict, the deadline (time.monotonic()) and whether the provider lookup
+# in progress failed rather than found nothing
+_BARCODE_TIMINGS = contextvars.ContextVar('barcode_timings', default=None)
+_BARCODE_DEADLINE = contextvars.ContextVar('barcode_deadline', default=None)
+_LOOKUP_FAILED = contextvars.ContextVar('lookup_failed', default=False)
+
+# Marks the end of a record stream handed from the processor's event loop to a caller
+_RECORDS_END = object()
+
+
+class ProcessorMetrics:
+    """
+    Thread-safe stage latency histograms and event counters.
+    
+    Stages are timed with observe()/timer(); counters are keyed by name and one label,
+    the provider by default (e.g. "rate_limited", provider "google"). Exported as a
+    JSON snapshot or Prometheus text.
+    """
+    
+    def __init__(self, buckets: Tuple[float, ...] = METRICS_LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._stages = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+    
+    def observe(self, stage: str, seconds: float):
+        with self._lock:
+            entry = self._stages.get(stage)
+            if entry is None:
+                entry = self._stages[stage] = {"count": 0, "sum": 0.0, "max": 0.0, "buckets": [0] * len(self.buckets)}
+            entry["count"] += 1
+            entry["sum"] += seconds
+            entry["max"] = max(entry["max"], seconds)
+            for position, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    entry["buckets"][position] += 1
+                    break
+    
+    @contextmanager
+    def timer(self, stage: str):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.monotonic() - started)
+    
+    def increment(self, name: str, value: str = "all", amount: int = 1, label: str = "provider"):
+        with self._lock:
+            key = (name, label, value)
+            self._counters[key] = self._counters.get(key, 0) + amount
+    
+    def snapshot(self) -> Dict:
+        """Metrics as plain JSON: per-stage count/avg/max in milliseconds and counters by provider."""
+        with self._lock:
+            stages = {
+                stage: {
+                    "count": entry["count"],
+                    "total_ms": round(entry["sum"] * 1000, 1),
+                    "avg_ms": round(entry["sum"] * 1000 / entry["count"], 1),
+                    "max_ms": round(entry["max"] * 1000, 1)
+                }
+                for stage, entry in sorted(self._stages.items())
+            }
+            counters = {}
+            for (name, _, value), count in sorted(self._counters.items()):
+                counters.setdefault(name, {})[value] = count
+        return {"stages": stages, "counters": counters}
+    
+    def to_prometheus(self, prefix: str = METRICS_PREFIX) -> str:
+        """Metrics in the Prometheus text exposition format."""
+        lines = [
+            f"# HELP {prefix}_stage_seconds Time spent in each processing stage",
+            f"# TYPE {prefix}_stage_seconds histogram"
+        ]
+        with self._lock:
+            for stage, entry in sorted(self._stages.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, entry["buckets"]):
+                    cumulative += count
+                    lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {entry["count"]}')
+                lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {entry["sum"]:.6f}')
+                lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {entry["count"]}')
+            
+            names = sorted({name for name, _, _ in self._counters})
+            for name in names:
+                lines.append(f"# TYPE {prefix}_{name}_total counter")
+                for (counter, label, value), count in sorted(self._counters.items()):
+                    if counter == name:
+                        lines.append(f'{prefix}_{name}_total{{{label}="{value}"}} {count}')
+        return "\n".join(lines) + "\n"
+    
+    def export(self, fmt: str = "json"):
+        return self.to_prometheus() if fmt == "prometheus" else self.snapshot()
+
+
+class ProductTextClassifier:
+    """
+    Single-pass category, subcategory and quantity matcher for local product formatting.
+    
+    All keywords and quantity patterns are compiled into one regex when the module is
+    imported. Keywords only match on word boundaries (optionally pluralised), so 'tea'
+    no longer matches inside 'steam'.
+    """
+    
+    def __init__(self, category_keywords: Dict[str, List[str]], subcategory_map: Dict[str, str]):
+        # Priority of each keyword: lower index wins, mirroring the dict order of the inputs
+        self.keyword_category = {}
+        for priority, (category, keywords) in enumerate(category_keywords.items()):
+            for keyword in keywords:
+                self.keyword_category.setdefault(keyword, (priority, category))
+        self.keyword_subcategory = {}
+        for priority, (keyword, subcategory) in enumerate(subcategory_map.items()):
+            self.keyword_subcategory.setdefault(keyword, (priority, subcategory))
+        
+        keywords = sorted(set(self.keyword_category) | set(self.keyword_subcategory), key=len, reverse=True)
+        # A multi-word match such as 'soap bar' also counts as a match for 'soap'
+        self.implied_keywords = {
+            keyword: [other for other in keywords
+                      if other != keyword and re.search(r'\b' + re.escape(other) + r'\b', keyword)]
+            for keyword in keywords
+        }
+        self.unit_priority = {alias: position for position, alias in enumerate(QUANTITY_UNIT_ALIASES)}
+        
+        keyword_alternation = '|'.join(re.escape(keyword) for keyword in keywords)
+        unit_alternation = '|'.join(sorted(QUANTITY_UNIT_ALIASES, key=len, reverse=True))
+        multipack_alternation = '|'.join(sorted(MULTIPACK_UNITS, key=len, reverse=True))
+        self.pattern = re.compile(
+            r'(?P<count>\d+)\s*x\s*(?P<size>\d+(?:\.\d+)?)\s*(?P<pack_unit>' + multipack_alternation + r')\b'
+            r'|(?P<amount>\d+(?:\.\d+)?)\s*(?P<unit>' + unit_alternation + r')\b'
+            r'|\b(?=(?P<keyword>' + keyword_alternation + r')(?:e?s)?\b)'
+        )
+    
+    def classify(self, text: str) -> Tuple[str, str, float, str]:
+        """Return (category, subcategory, quantity, unit) for lower-cased product text."""
+        category = (len(self.keyword_category), 'Other')
+        subcategory = (len(self.keyword_subcategory), '')
+        quantity = None  # (priority, position, value, unit)
+        
+        for match in self.pattern.finditer(text):
+            keyword = match.group('keyword')
+            if keyword:
+                for matched in [keyword] + self.implied_keywords[keyword]:
+                    category = min(category, self.keyword_category.get(matched, category))
+                    subcategory = min(subcategory, self.keyword_subcategory.get(matched, subcategory))
+            elif match.group('count'):
+                # Multi-pack quantities are the most specific, take the first one outright
+                if quantity is None or quantity[0] >= 0:
+                    unit = QUANTITY_UNIT_ALIASES[match.group('pack_unit')]
+                    quantity = (-1, match.start(), float(match.group('count')) * float(match.group('size')), unit)
+            else:
+                alias = match.group('unit')
+                candidate = (self.unit_priority[alias], match.start(), float(match.group('amount')),
+                             QUANTITY_UNIT_ALIASES[alias])
+                if quantity is None or candidate[:2] < quantity[:2]:
+                    quantity = candidate
+        
+        value, unit = (quantity[2], quantity[3]) if quantity else (0, '')
+        return category[1], subcategory[1], value, unit
+
+
+PRODUCT_CLASSIFIER = ProductTextClassifier(CATEGORY_KEYWORDS, SUBCATEGORY_MAP)
+
+
+def find_json_start(text: str) -> int:
+    """Index of the JSON object (or list of objects) in a model reply, preferring a ``` code fence."""
+    fence = text.find('```')
+    search_from = fence if fence >= 0 and text.find('{', fence) >= 0 else 0
+    start = text.find('{', search_from)
+    if start < 0:
+        return text.find('[', search_from)
+    bracket = text.rfind('[', search_from, start)
+    if bracket >= 0 and not text[bracket + 1:start].strip():
+        return bracket
+    return start
+
+
+def _closes_string(text: str, i: int) -> bool:
+    """Whether the quote at text[i] ends the string rather than being an unescaped quote inside it."""
+    n = len(text)
+    i += 1
+    while i < n and text[i] in ' \t\r':
+        i += 1
+    return i >= n or text[i] in JSON_STRING_TERMINATORS or text[i:i + 2] in ('//', '/*')
+
+
+def _bare_value_end(text: str, i: int, in_array: bool) -> int:
+    """
+    End of the unquoted value starting at text[i], found in one pass over it.
+    
+    Besides JSON_BARE_VALUE_TERMINATORS, a value ends before a gap followed by a single-quoted
+    string ({'Brand': Amul 'Unit': 'g'}) and, inside an array, before the first gap after a
+    number or literal ([1 2 3]), both being missing commas.
+    """
+    n = len(text)
+    start = i
+    first_gap = True
+    while i < n:
+        c = text[i]
+        if c in JSON_BARE_VALUE_TERMINATORS:
+            return i
+        if c not in ' \t\r':
+            i += 1
+            continue
+        gap = i
+        while i < n and text[i] in ' \t\r':
+            i += 1
+        if i < n and text[i] == "'":
+            return gap
+        if first_gap and in_array:
+            word = text[start:gap]
+            if word in JSON_BARE_LITERALS or JSON_NUMBER_PATTERN.fullmatch(word):
+                return gap
+        first_gap = False
+    return n
+
+
+def _read_quoted(text: str, i: int) -> Tuple[str, int]:
+    """Read a quoted string starting at text[i]; returns (JSON string literal, next index)."""
+    quote = JSON_QUOTE_PAIRS[text[i]]
+    n = len(text)
+    i += 1
+    chunk_start = i
+    parts = []
+    while i < n:
+        c = text[i]
+        if c == '\\' and i + 1 < n:
+            escaped = text[i + 1]
+            parts.append(text[chunk_start:i])
+            # \' is not a JSON escape; everything else is passed through as written
+            parts.append("'" if escaped == "'" else text[i:i + 2])
+            i += 2
+            chunk_start = i
+        elif (c == quote or (c == '"' and quote != "'")) and _closes_string(text, i):
+            break
+        elif c == '"':
+            parts.append(text[chunk_start:i])
+            parts.append('\\"')
+            i += 1
+            chunk_start = i
+        else:
+            i += 1
+    parts.append(text[chunk_start:i])
+    # An unterminated string (truncated reply) is closed at the end of the text
+    return '"' + ''.join(parts) + '"', i + 1
+
+
+def repair_json(text: str, start: int = 0) -> str:
+    """
+    Rewrite model output into strict JSON in one left-to-right pass (linear time).
+    
+    Starting at text[start], the scanner tracks open objects and arrays and fixes what LLMs
+    commonly get wrong: single-quoted and typographic-quoted strings, unescaped quotes inside
+    strings, Python literals, unquoted keys and values, missing or trailing commas, comments, and
+    output truncated mid-object (open strings and containers are closed). Apostrophes inside
+    double-quoted strings are left alone. Anything
+    after the outermost closing bracket is ignored.
+    """
+    out = []
+    stack = []
+    expect = 'value'  # value, key, colon or comma
+    n = len(text)
+    i = start
+    
+    while i < n:
+        c = text[i]
+        if c.isspace():
+            i += 1
+            continue
+        if c == '/' and i + 1 < n and text[i + 1] in '/*':
+            end = text.find('\n' if text[i + 1] == '/' else '*/', i + 2)
+            i = n if end < 0 else end + (1 if text[i + 1] == '/' else 2)
+            continue
+        if c in '}]':
+            if not stack:
+                break
+            if expect == 'colon':
+                out.append(':null')
+            elif expect == 'value' and out[-1] == ':':
+                out.append('null')
+            elif out[-1] == ',':
+                out.pop()
+            out.append('}' if stack.pop() == '{' else ']')
+            i += 1
+            if not stack:
+                break
+            expect = 'comma'
+            continue
+        if c == ',':
+            if expect == 'comma':
+                out.append(',')
+                expect = 'key' if stack[-1] == '{' else 'value'
+            i += 1
+            continue
+        if c == ':':
+            if expect == 'colon':
+                out.append(':')
+                expect = 'value'
+            i += 1
+            continue
+        
+        # Start of a key or value: repair a missing comma or colon first
+        if expect == 'comma':
+            out.append(',')
+            expect = 'key' if stack[-1] == '{' else 'value'
+        elif expect == 'colon':
+            out.append(':')
+            expect = 'value'
+        
+        if c in '{[':
+            if expect == 'key':
+                break  # a container where a key belongs cannot be repaired meaningfully
+            out.append(c)
+            stack.append(c)
+            expect = 'key' if c == '{' else 'value'
+            i += 1
+            continue
+        
+        if c in JSON_QUOTE_PAIRS:
+            token, i = _read_quoted(text, i)
+        else:
+            # Bare word, see JSON_BARE_KEY_PATTERN / _bare_value_end()
+            if expect == 'key':
+                end = JSON_BARE_KEY_PATTERN.match(text, i).end()
+            else:
+                end = _bare_value_end(text, i, bool(stack) and stack[-1] == '[')
+            word = text[i:end].strip()
+            i = end
+            if expect == 'key':
+                token = json.dumps(word)
+            elif word in JSON_BARE_LITERALS:
+                token = JSON_BARE_LITERALS[word]
+            elif JSON_NUMBER_PATTERN.fullmatch(word):
+                token = word
+            else:
+                token = json.dumps(word)
+        out.append(token)
+        if not stack:
+            return token
+        expect = 'colon' if expect == 'key' else 'comma'
+    
+    # Truncated reply: finish the dangling pair and close everything still open
+    if stack:
+        if expect == 'colon':
+            out.append(':null')
+        elif expect == 'value' and out[-1] == ':':
+            out.append('null')
+        elif out[-1] == ',':
+            out.pop()
+        out.extend('}' if opener == '{' else ']' for opener in reversed(stack))
+    return ''.join(out)
+
+
+def parse_llm_json(text: str):
+    """
+    Parse the JSON object in an LLM reply, tolerating prose, code fences and common mistakes.
+    
+    Well-formed JSON is decoded directly where it starts; anything else goes through
+    repair_json() once. Returns None if no JSON can be recovered.
+    """
+    if not text:
+        return None
+    start = find_json_start(text)
+    if start < 0:
+        return None
+    try:
+        return JSON_DECODER.raw_decode(text, start)[0]
+    except json.JSONDecodeError:
+        pass
+    try:
+        return JSON_DECODER.decode(repair_json(text, start))
+    except json.JSONDecodeError:
+        return None
+
+
+def schema_errors(value, schema: Dict, path: str = "$") -> List[str]:
+    """
+    Check a parsed reply against the JSON schema subset used for AI output (type, properties,
+    required, items). Unknown keys are allowed and optional keys may be null. Returns the
+    problems found, empty if the value conforms.
+    """
+    expected = schema.get("type")
+    if expected:
+        python_type = JSON_SCHEMA_TYPES[expected]
+        if not isinstance(value, python_type) or (isinstance(value, bool) and expected != "boolean"):
+            return [f"{path}: expected {expected}, got {type(value).__name__}"]
+
+    errors = []
+    if isinstance(value, dict):
+        required = schema.get("required", [])
+        for key in required:
+            if value.get(key) in (None, ""):
+                errors.append(f"{path}.{key}: missing")
+        for key, subschema in schema.get("properties", {}).items():
+            if value.get(key) is not None:
+                errors.extend(schema_errors(value[key], subschema, f"{path}.{key}"))
+    elif isinstance(value, list) and "items" in schema:
+        for index, item in enumerate(value):
+            errors.extend(schema_errors(item, schema["items"], f"{path}[{index}]"))
+    return errors
+
+
+def coerce_to_schema(value, schema: Dict):
+    """
+    Repair near-misses in a parsed reply in place before validation: numeric strings become
+    numbers ("500" -> 500) and optional keys with an unusable value are dropped, so one stray
+    field does not cost the whole reply. Required keys are left for schema_errors() to judge.
+    """
+    expected = schema.get("type")
+    if expected in ("number", "integer") and isinstance(value, str):
+        match = JSON_NUMBER_PATTERN.match(value.strip())
+        if match:
+            number = float(match.group())
+            return int(number) if number.is_integer() else number
+    if isinstance(value, dict):
+        required = schema.get("required", [])
+        for key, subschema in schema.get("properties", {}).items():
+            if value.get(key) is None:
+                continue
+            value[key] = coerce_to_schema(value[key], subschema)
+            if key not in required and schema_errors(value[key], subschema):
+                del value[key]
+    elif isinstance(value, list) and "items" in schema:
+        return [coerce_to_schema(item, schema["items"]) for item in value]
+    return value
+
+
+def strict_json_schema(schema: Dict) -> Dict:
+    """OpenAI strict variant of a schema: every key required, optional keys nullable, no extra keys."""
+    strict = {key: value for key, value in schema.items() if key not in ("properties", "required", "items")}
+    if "items" in schema:
+        strict["items"] = strict_json_schema(schema["items"])
+    if schema.get("type") == "object":
+        required = schema.get("required", [])
+        properties = {}
+        for key, subschema in schema.get("properties", {}).items():
+            subschema = strict_json_schema(subschema)
+            if key not in required:
+                subschema["type"] = [subschema["type"], "null"]
+            properties[key] = subschema
+        strict.update(properties=properties, required=list(properties), additionalProperties=False)
+    return strict
+
+
+def minified_json(value) -> str:
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False)
+
+
+def compact_prompt_context(product_data: Dict, token_budget: int = DEFAULT_AI_PROMPT_TOKEN_BUDGET) -> Dict:
+    """
+    Lookup data trimmed for an AI prompt: empty values and fields the model does not need are
+    dropped, whitespace is collapsed, and if the minified JSON is still over token_budget the
+    long text fields (ingredients and description first) are cut at a word boundary.
+    """
+    compact = {}
+    for key, value in product_data.items():
+        if key in AI_PROMPT_EXCLUDED_FIELDS or value in (None, '', [], {}):
+            continue
+        compact[key] = ' '.join(value.split()) if isinstance(value, str) else value
+
+    excess = len(minified_json(compact)) - token_budget * AI_PROMPT_CHARS_PER_TOKEN
+    if excess > 0:
+        others = sorted((key for key, value in compact.items()
+                         if isinstance(value, str) and key not in AI_PROMPT_TRUNCATE_FIELDS),
+                        key=lambda key: len(compact[key]), reverse=True)
+        for key in [key for key in AI_PROMPT_TRUNCATE_FIELDS if key in compact] + others:
+            value = compact[key]
+            if excess <= 0:
+                break
+            if not isinstance(value, str) or len(value) <= AI_PROMPT_MIN_FIELD_CHARS:
+                continue
+            keep = max(AI_PROMPT_MIN_FIELD_CHARS, len(value) - excess)
+            truncated = value[:keep].rsplit(' ', 1)[0] + '…'
+            excess -= len(value) - len(truncated)
+            compact[key] = truncated
+    return compact
+
+
+def gemini_response_schema(schema: Dict) -> Dict:
+    """Gemini responseSchema (OpenAPI subset) for a schema: upper-case types, optional keys nullable."""
+    converted = {"type": schema["type"].upper()}
+    if "items" in schema:
+        converted["items"] = gemini_response_schema(schema["items"])
+    if "properties" in schema:
+        required = schema.get("required", [])
+        converted["properties"] = {}
+        for key, subschema in schema["properties"].items():
+            subschema = gemini_response_schema(subschema)
+            if key not in required:
+                subschema["nullable"] = True
+            converted["properties"][key] = subschema
+        if required:
+            converted["required"] = list(required)
+    return converted
+
+
+class CircuitBreaker:
+    """Closed/open/half-open circuit breaker with exponential cool-down and single probe requests."""
+    
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+    
+    def __init__(self, name: str, failure_threshold: int = DEFAULT_AI_CIRCUIT_FAILURE_THRESHOLD,
+                 cooldown: float = DEFAULT_AI_CIRCUIT_COOLDOWN, max_cooldown: float = DEFAULT_AI_CIRCUIT_MAX_COOLDOWN,
+                 hard_cooldown: float = DEFAULT_AI_CIRCUIT_HARD_COOLDOWN):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.hard_cooldown = hard_cooldown
+        self.state = self.CLOSED
+        self.failures = 0
+        self.trips = 0
+        self.current_cooldown = 0.0
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self._lock = threading.Lock()
+    
+    def _cooldown_elapsed(self) -> bool:
+        return time.monotonic() - self.opened_at >= self.current_cooldown
+    
+    def is_available(self) -> bool:
+        """Whether a request would currently be let through (no state change)."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                return self._cooldown_elapsed()
+            return not self.probe_in_flight
+    
+    def allow_request(self) -> bool:
+        """Claim permission for a request; in half-open state only one probe is allowed at a time."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                if not self._cooldown_elapsed():
+                    return False
+                logger.info(f"{self.name} circuit half-open, sending probe request")
+                self.state = self.HALF_OPEN
+            if self.probe_in_flight:
+                return False
+            self.probe_in_flight = True
+            return True
+    
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info(f"{self.name} circuit closed after successful probe")
+            self.state = self.CLOSED
+            self.failures = 0
+            self.trips = 0
+            self.probe_in_flight = False
+    
+    def record_failure(self, hard: bool = False):
+        """Count a failure; hard failures (auth, quota) open the circuit immediately."""
+        with self._lock:
+            self.failures += 1
+            if hard or self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+                self.trips += 1
+                if hard:
+                    self.current_cooldown = self.hard_cooldown
+                else:
+                    self.current_cooldown = min(self.max_cooldown, self.base_cooldown * 2 ** (self.trips - 1))
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self.probe_in_flight = False
+                logger.warning(f"{self.name} circuit opened for {self.current_cooldown:.0f} seconds "
+                               f"after {self.failures} failure(s)")
+    
+    def snapshot(self) -> Dict:
+        with self._lock:
+            retry_in = 0.0
+            if self.state == self.OPEN:
+                retry_in = max(0.0, self.current_cooldown - (time.monotonic() - self.opened_at))
+            return {
+                "state": self.state,
+                "working": self.state != self.OPEN or retry_in == 0,
+                "failures": self.failures,
+                "trips": self.trips,
+                "cooldown": self.current_cooldown,
+                "retry_in": round(retry_in, 1)
+            }
+
+
+class AIBackend(ABC):
+    """
+    One AI provider: how to build a (structured-output) request, read the reply and token usage,
+    and classify error responses. The HTTP exchange, rate limiting and circuit breaking are
+    shared and live in BarcodeAPIProcessor._call_ai_backend().
+    """
+    
+    # Errors that will not go away by retrying; they open the circuit for the hard cool-down
+    HARD_FAILURES = {401: "authentication failed - check API key", 402: "insufficient balance"}
+    
+    def __init__(self, name: str, label: str, url: str, api_key: Optional[str], model: str, max_tokens: int):
+        self.name = name
+        self.label = label
+        self.url = url
+        self.api_key = api_key
+        self.model = model
+        self.max_tokens = max_tokens
+    
+    @abstractmethod
+    def build_request(self, prompt: str, max_tokens: int, schema: Optional[Dict], system_prompt: str) -> Dict:
+        """Keyword arguments for session.post(); schema is None when structured output is off."""
+    
+    @abstractmethod
+    def parse_reply(self, response_json: Dict) -> Tuple[Optional[str], Tuple[int, int, int]]:
+        """(reply text or None, (prompt, completion, cached prompt) token counts)."""
+    
+    def classify_error(self, response) -> Tuple[bool, str]:
+        """(hard failure, log message) for a non-200 response."""
+        if response.status_code in self.HARD_FAILURES:
+            return True, self.HARD_FAILURES[response.status_code]
+        return False, f"{response.status_code} - {response.text}"
+
+
+class GeminiBackend(AIBackend):
+    """Google Gemini generateContent API (responseSchema structured output)."""
+    
+    def build_request(self, prompt, max_tokens, schema, system_prompt):
+        data = {
+            "systemInstruction": {"parts": [{"text": system_prompt}]},
+            "contents": [{"parts": [{"text": prompt}]}],
+            "generationConfig": {"temperature": AI_TEMPERATURE, "maxOutputTokens": max_tokens}
+        }
+        if schema:
+            data["generationConfig"]["responseMimeType"] = "application/json"
+            data["generationConfig"]["responseSchema"] = gemini_response_schema(schema)
+        return {"params": {"key": self.api_key}, "json": data}
+    
+    def parse_reply(self, response_json):
+        usage = response_json.get('usageMetadata', {})
+        tokens = (usage.get('promptTokenCount', 0), usage.get('candidatesTokenCount', 0),
+                  usage.get('cachedContentTokenCount', 0))
+        candidates = response_json.get('candidates') or []
+        parts = candidates[0].get('content', {}).get('parts', []) if candidates else []
+        return (parts[0]['text'] if parts and 'text' in parts[0] else None), tokens
+
+
+class OpenAIChatBackend(AIBackend):
+    """OpenAI-compatible chat completions API (OpenAI, DeepSeek)."""
+    
+    def __init__(self, *args, json_schema: bool = False):
+        super().__init__(*args)
+        # Whether the model accepts response_format json_schema; otherwise json_object is used
+        self.json_schema = json_schema
+    
+    def build_request(self, prompt, max_tokens, schema, system_prompt):
+        data = {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": prompt}
+            ],
+            "temperature": AI_TEMPERATURE,
+            "max_tokens": max_tokens
+        }
+        if schema and self.json_schema:
+            data["response_format"] = {
+                "type": "json_schema",
+                "json_schema": {"name": schema.get("title", "product"), "schema": strict_json_schema(schema), "strict": True}
+            }
+        elif schema:
+            data["response_format"] = {"type": "json_object"}
+        headers = {"Content-Type": "application/json", "Authorization": f"Bearer {self.api_key}"}
+        return {"headers": headers, "json": data}
+    
+    def parse_reply(self, response_json):
+        usage = response_json.get('usage') or {}
+        # OpenAI reports cached prompt tokens under prompt_tokens_details, DeepSeek as prompt_cache_hit_tokens
+        cached = (usage.get('prompt_tokens_details') or {}).get('cached_tokens') or usage.get('prompt_cache_hit_tokens', 0)
+        tokens = (usage.get('prompt_tokens', 0), usage.get('completion_tokens', 0), cached)
+        choices = response_json.get('choices') or []
+        return (choices[0].get('message', {}).get('content') if choices else None), tokens
+    
+    def classify_error(self, response):
+        if response.status_code == 429:
+            try:
+                error_data = response.json().get('error', {}) or {}
+            except ValueError:
+                error_data = {}
+            if 'insufficient_quota' in str(error_data.get('type', '')):
+                return True, "quota exceeded - opening circuit"
+            return False, f"rate limited: {error_data.get('message', 'Unknown error')}"
+        return super().classify_error(response)
+
+
+class AIRouter:
+    """Orders AI backends by a moving window of their latency, success rate and cost."""
+    
+    def __init__(self, names: List[str], strategy: str = DEFAULT_AI_ROUTING, window: int = DEFAULT_AI_ROUTER_WINDOW,
+                 probe_interval: float = DEFAULT_AI_ROUTER_PROBE_INTERVAL,
+                 cost_weight: float = DEFAULT_AI_ROUTER_COST_WEIGHT):
+        self.names = list(names)
+        self.strategy = strategy
+        self.probe_interval = probe_interval
+        self.cost_weight = cost_weight
+        self.latencies = {name: deque(maxlen=window) for name in self.names}
+        self.outcomes = {name: deque(maxlen=window) for name in self.names}
+        self.costs = {name: deque(maxlen=window) for name in self.names}
+        # Start the probe clock now so idle backends are only explored after a full interval
+        self.last_used = {name: time.monotonic() for name in self.names}
+        self._lock = threading.Lock()
+    
+    def record(self, name: str, latency: float, success: bool):
+        with self._lock:
+            self.latencies[name].append(latency)
+            self.outcomes[name].append(success)
+            self.last_used[name] = time.monotonic()
+    
+    def record_usage(self, name: str, prompt_tokens: int, completion_tokens: int):
+        prompt_price, completion_price = AI_BACKEND_PRICING.get(name, (0.0, 0.0))
+        with self._lock:
+            self.costs[name].append((prompt_tokens * prompt_price + completion_tokens * completion_price) / 1e6)
+    
+    def _score(self, name: str) -> Optional[float]:
+        """Expected seconds to a usable answer plus the weighted cost; None without data."""
+        if not self.latencies[name]:
+            return None
+        failure_rate = 1 - sum(self.outcomes[name]) / len(self.outcomes[name])
+        latency = sum(self.latencies[name]) / len(self.latencies[name])
+        cost = sum(self.costs[name]) / len(self.costs[name]) if self.costs[name] else 0.0
+        return latency + failure_rate * AI_ROUTER_FAILURE_PENALTY + self.cost_weight * cost
+    
+    def order(self, candidates: List[str]) -> List[str]:
+        """Candidates in the order they should be tried."""
+        if self.strategy == "priority" or len(candidates) < 2:
+            return list(candidates)
+        with self._lock:
+            scores = {name: self._score(name) for name in candidates}
+            # Measured backends by score, then untried ones in priority order
+            ranked = sorted(candidates, key=lambda name: (scores[name] is None, scores[name] or 0.0))
+            now = time.monotonic()
+            stale = [name for name in ranked[1:] if now - self.last_used[name] >= self.probe_interval]
+            if stale:
+                ranked.remove(stale[0])
+                ranked.insert(0, stale[0])
+                self.last_used[stale[0]] = now
+            return ranked
+    
+    def latency_percentile(self, name: str, fraction: float) -> Optional[float]:
+        """Latency at the given fraction of the window (nearest rank); None with too few samples."""
+        with self._lock:
+            latencies = sorted(self.latencies[name])
+        if len(latencies) < AI_HEDGE_MIN_SAMPLES:
+            return None
+        return latencies[min(len(latencies) - 1, int(round(fraction * (len(latencies) - 1))))]
+    
+    def snapshot(self) -> Dict:
+        with self._lock:
+            result = {}
+            for name in self.names:
+                calls = len(self.latencies[name])
+                score = self._score(name)
+                result[name] = {
+                    "calls": calls,
+                    "avg_latency_ms": round(sum(self.latencies[name]) / calls * 1000, 1) if calls else None,
+                    "success_rate": round(sum(self.outcomes[name]) / calls, 3) if calls else None,
+                    "avg_cost_usd": round(sum(self.costs[name]) / len(self.costs[name]), 6) if self.costs[name] else None,
+                    "score": round(score, 3) if score is not None else None
+                }
+            return {"strategy": self.strategy, "backends": result}
+
+
+class HedgeBudget:
+    """Caps hedged requests at a fraction of all requests, so hedging bounds its own extra spend."""
+    
+    def __init__(self, fraction: float):
+        self.fraction = max(0.0, fraction)
+        self.requests = 0
+        self.hedges = 0
+        self._lock = threading.Lock()
+    
+    def record_request(self):
+        with self._lock:
+            self.requests += 1
+    
+    def try_spend(self) -> bool:
+        """Claim one hedge if that keeps hedges within the budget."""
+        with self._lock:
+            if self.hedges + 1 > self.fraction * self.requests:
+                return False
+            self.hedges += 1
+            return True
+    
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {"requests": self.requests, "hedges": self.hedges, "budget": self.fraction}
+
+
+class TokenBucket:
+    """Thread-safe token bucket pacing the requests sent to a single provider."""
+    
+    def __init__(self, rate: float, burst: int):
+        self.rate = max(rate, 0.001)
+        self.burst = max(1, int(burst))
+        self.tokens = float(self.burst)
+        self.last_refill = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+    
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+    
+    def _try_take(self, give_up_at: Optional[float]) -> Optional[float]:
+        """Take a token if one is free (0), else seconds to wait before trying again; None once give_up_at passes."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if now >= self.paused_until and self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            wait = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+        if give_up_at is not None:
+            remaining = give_up_at - time.monotonic()
+            if remaining <= 0:
+                return None
+            wait = min(wait, remaining)
+        return wait
+    
+    def acquire(self, timeout: float = None) -> bool:
+        """Take one token, waiting as long as needed. Returns False if timeout expires first."""
+        give_up_at = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self._try_take(give_up_at)
+            if wait is None:
+                return False
+            if not wait:
+                return True
+            time.sleep(wait)
+    
+    async def acquire_async(self, timeout: float = None) -> bool:
+        """acquire() for coroutines: waits without blocking the event loop."""
+        give_up_at = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self._try_take(give_up_at)
+            if wait is None:
+                return False
+            if not wait:
+                return True
+            await asyncio.sleep(wait)
+    
+    def pause(self, seconds: float):
+        """Block the bucket for the given number of seconds (e.g. from a Retry-After header)."""
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0.0
+
+
+class RateLimiter:
+    """Holds one token bucket per upstream provider so callers only wait for the API they hit."""
+    
+    def __init__(self, limits: Dict[str, Dict] = None):
+        limits = limits or PROVIDER_RATE_LIMITS
+        self.buckets = {}
+        for provider, config in limits.items():
+            rate = float(os.getenv(f"{provider.upper()}_RATE_LIMIT", str(config["rate"])))
+            burst = int(os.getenv(f"{provider.upper()}_BURST", str(config["burst"])))
+            self.buckets[provider] = TokenBucket(rate, burst)
+    
+    def acquire(self, provider: str, timeout: float = None) -> bool:
+        bucket = self.buckets.get(provider)
+        return bucket.acquire(timeout) if bucket else True
+    
+    async def acquire_async(self, provider: str, timeout: float = None) -> bool:
+        bucket = self.buckets.get(provider)
+        return await bucket.acquire_async(timeout) if bucket else True
+    
+    def pause(self, provider: str, seconds: float):
+        bucket = self.buckets.get(provider)
+        if bucket and seconds > 0:
+            logger.warning(f"Pausing {provider} requests for {seconds:.1f} seconds")
+            bucket.pause(seconds)
+    
+    def snapshot(self) -> Dict:
+        return {provider: {"rate": bucket.rate, "burst": bucket.burst}
+                for provider, bucket in self.buckets.items()}
+
+
+class OpenFoodFactsLocalStore:
+    """
+    Indexed local copy of the OpenFoodFacts product fields, keyed by GTIN-14.
+    
+    Built and refreshed by import_openfoodfacts_dump.py; the processor opens it read-only
+    and answers OpenFoodFacts lookups with a primary-key read instead of an HTTP call.
+    """
+    
+    def __init__(self, path: str, readonly: bool = True):
+        self.path = path
+        if readonly:
+            self._conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        else:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self.create_schema(self._conn)
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def create_schema(conn: sqlite3.Connection):
+        columns = ", ".join(f"{field} TEXT" for field in OPENFOODFACTS_LOCAL_FIELDS)
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS off_products (
+                code TEXT PRIMARY KEY,
+                {columns},
+                last_modified_t INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID
+        """)
+        conn.execute("CREATE TABLE IF NOT EXISTS off_meta (key TEXT PRIMARY KEY, value TEXT)")
+        conn.commit()
+    
+    def get(self, barcode: str) -> Optional[Dict]:
+        """OpenFoodFacts product fields for a barcode, or None if the dump does not contain it."""
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(OPENFOODFACTS_LOCAL_FIELDS)} FROM off_products WHERE code = ?",
+                (gtin_key(barcode),)
+            ).fetchone()
+        if row is None:
+            return None
+        return {field: value or '' for field, value in zip(OPENFOODFACTS_LOCAL_FIELDS, row)}
+    
+    def stats(self) -> Dict:
+        with self._lock:
+            meta = dict(self._conn.execute("SELECT key, value FROM off_meta").fetchall())
+        return {"path": self.path, **meta}
+    
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class JobJournal:
+    """
+    Append-only NDJSON checkpoint file for a bulk job.
+    
+    The first line identifies the job (barcode count and fingerprint); every other line is an
+    outcome record, flushed and fsync'd as soon as its barcode finishes. Reopening a journal
+    drops a torn trailing line and remembers where the latest final record of each position is,
+    so results can be read back in input order without loading them all.
+    """
+    
+    def __init__(self, path: str, barcodes: List[str]):
+        self.path = path
+        self.total = len(barcodes)
+        self.fingerprint = hashlib.sha256("\n".join(barcodes).encode()).hexdigest()
+        self._offsets = {}
+        has_header = os.path.exists(path) and self._recover()
+        self._file = open(path, 'ab')
+        if not has_header:
+            self._write({"job": {"total": self.total, "fingerprint": self.fingerprint,
+                                 "created": datetime.now().isoformat()}})
+    
+    def _recover(self) -> bool:
+        """Index an existing journal and cut off a partially written last line; returns whether it had a header."""
+        has_header = False
+        offset = 0
+        with open(self.path, 'r+b') as journal_file:
+            for line in journal_file:
+                if not line.endswith(b'\n'):
+                    logger.warning(f"Dropping incomplete last entry of job journal {self.path}")
+                    break
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    logger.warning(f"Skipping unreadable entry at byte {offset} of job journal {self.path}")
+                    entry = {}
+                if 'job' in entry:
+                    if entry['job'].get('fingerprint') != self.fingerprint:
+                        raise ValueError(f"Job journal {self.path} belongs to a different barcode list; "
+                                         "remove it or use another output directory")
+                    has_header = True
+                elif entry.get('status') in JOB_FINAL_STATUSES:
+                    self._offsets[entry['index']] = offset
+                offset += len(line)
+            journal_file.truncate(offset)
+        return has_header
+    
+    def _write(self, entry: Dict) -> int:
+        self._file.seek(0, os.SEEK_END)
+        offset = self._file.tell()
+        self._file.write((json.dumps(entry, separators=(',', ':')) + "\n").encode())
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        return offset
+    
+    def append(self, record: Dict):
+        """Checkpoint one outcome record."""
+        offset = self._write(record)
+        if record['status'] in JOB_FINAL_STATUSES:
+            self._offsets[record['index']] = offset
+    
+    def completed(self) -> set:
+        """Input positions that already have a final outcome."""
+        return set(self._offsets)
+    
+    def iter_records(self) -> Iterator[Dict]:
+        """Yield the latest final record of each position, in input order, reading one line at a time."""
+        with open(self.path, 'rb') as journal_file:
+            for index in sorted(self._offsets):
+                journal_file.seek(self._offsets[index])
+                yield json.loads(journal_file.readline())
+    
+    def close(self):
+        self._file.close()
+
+
+def gs1_check_digit_valid(barcode: str) -> bool:
+    """Verify the GS1 mod-10 check digit (weights 3 and 1 alternating from the right) of a GTIN."""
+    body, check = barcode[:-1], barcode[-1]
+    total = sum(int(digit) * (3 if position % 2 == 0 else 1) for position, digit in enumerate(reversed(body)))
+    return (10 - total % 10) % 10 == int(check)
+
+
+class GS1PrefixIndex:
+    """
+    Longest-prefix index over GS1 prefixes: issuing country plus any company category hint.
+    
+    Country ranges are expanded into three-digit keys up front, so a lookup is a handful of
+    dictionary probes on the GTIN-13 form. EAN-8 codes are not indexed: their prefixes come
+    from the separate GS1-8 allocation, which the GTIN-13 ranges say nothing about.
+    """
+    
+    def __init__(self, prefix_ranges: List[Tuple[str, str, Dict]], company_hints: Dict[str, Dict]):
+        self.entries = {}
+        for first, last, info in prefix_ranges:
+            for prefix in range(int(first), int(last) + 1):
+                self.entries[f"{prefix:03d}"] = dict(info, prefix=f"{prefix:03d}")
+        for prefix, hint in company_hints.items():
+            country_info = self.entries.get(prefix[:3], {})
+            self.entries[prefix] = dict(country_info, **hint, prefix=prefix)
+        self.max_prefix_length = max(len(prefix) for prefix in self.entries)
+    
+    def lookup(self, barcode: str) -> Optional[Dict]:
+        """The most specific entry for a GTIN, or None for unassigned prefixes, EAN-8 and non-GTIN input."""
+        barcode = str(barcode).strip()
+        gtin = normalize_gtin(barcode)
+        if gtin is None or len(barcode) == 8:
+            return None
+        key = gtin[1:]  # GTIN-13 body; the GTIN-14 packaging indicator is not part of the prefix
+        for length in range(min(self.max_prefix_length, len(key)), 2, -1):
+            entry = self.entries.get(key[:length])
+            if entry is not None:
+                return entry
+        return None
+    
+    def country(self, barcode: str) -> str:
+        """Country the barcode's prefix was issued in, or "Unknown" when the prefix does not name one."""
+        entry = self.lookup(barcode)
+        return entry["country"] if entry and entry.get("origin", True) else "Unknown"
+
+
+def normalize_gtin(barcode: str) -> Optional[str]:
+    """Canonical GTIN-14 form of a barcode (left zero-padded), or None if it is not a GTIN."""
+    barcode = str(barcode).strip()
+    if not barcode.isdigit() or len(barcode) not in VALID_BARCODE_LENGTHS:
+        return None
+    return barcode.zfill(GTIN_LENGTH)
+
+
+def gtin_key(barcode: str) -> str:
+    """Key used to de-duplicate and cache a barcode; non-GTIN input is keyed as given."""
+    return normalize_gtin(barcode) or str(barcode).strip()
+
+
+GS1_PREFIX_INDEX = GS1PrefixIndex(GS1_PREFIX_RANGES, GS1_COMPANY_PREFIX_HINTS)
+
+
+def read_barcode_file(path: str) -> List[str]:
+    """Read barcodes from a JSON list or a text/CSV file (first column, one per line, # comments skipped)."""
+    with open(path, encoding='utf-8') as barcode_file:
+        if path.lower().endswith('.json'):
+            return [str(barcode).strip() for barcode in json.load(barcode_file)]
+        barcodes = []
+        for line in barcode_file:
+            value = line.split(',')[0].strip().strip('"')
+            if value and not value.startswith('#'):
+                barcodes.append(value)
+        return barcodes
+
+
+def build_http_session(pool_size: int = DEFAULT_HTTP_POOL_SIZE, keep_alive: bool = True) -> aiohttp.ClientSession:
+    """
+    Create an async HTTP session with up to pool_size connections; must be called on the event
+    loop it will run on. Timeouts and retries are applied per request by
+    BarcodeAPIProcessor._http_request().
+    """
+    return aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=pool_size, force_close=not keep_alive))
+
+
+class HTTPResponse:
+    """An upstream response read in full (its connection is already back in the pool)."""
+    
+    def __init__(self, status_code: int, headers, content: bytes):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+    
+    @property
+    def text(self) -> str:
+        return self.content.decode('utf-8', errors='replace')
+    
+    def json(self):
+        return json.loads(self.content)
+
+
+def retry_after_seconds(response, default: float) -> float:
+    """Read a Retry-After header (delta-seconds or HTTP date), falling back to default."""
+    value = response.headers.get('Retry-After') if response is not None else None
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo=timezone.utc)
+        return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return default
+
+
+async def _next_record(records: AsyncIterator[Dict]):
+    """Next record of a record stream, or _RECORDS_END once it is exhausted."""
+    try:
+        return await records.__anext__()
+    except StopAsyncIteration:
+        return _RECORDS_END
+
+
+async def _close_records(records):
+    """Close a record stream, cancelling the lookups it still has running."""
+    try:
+        await records.aclose()
+    except RuntimeError:
+        pass  # a cancelled step is still unwinding it, which closes it as well
+
+
+class BarcodeResultCache:
+    """SQLite-backed cache of lookup results keyed by (barcode, provider), with TTL and LRU eviction."""
+    
+    def __init__(self, path: str, ttl: float = DEFAULT_CACHE_TTL,
+                 negative_ttl: float = DEFAULT_CACHE_NEGATIVE_TTL,
+                 max_entries: int = DEFAULT_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS barcode_cache (
+                barcode TEXT NOT NULL,
+                provider TEXT NOT NULL,
+                payload TEXT,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (barcode, provider)
+            ) WITHOUT ROWID
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_barcode_cache_access ON barcode_cache (last_access)")
+        self._conn.commit()
+    
+    def get(self, barcode: str, provider: str) -> Tuple[bool, Optional[Dict]]:
+        """Return (hit, value). A hit with value None is a cached "not found" answer."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT payload, created_at FROM barcode_cache WHERE barcode = ? AND provider = ?",
+                (barcode, provider)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return False, None
+            payload, created_at = row
+            ttl = self.ttl if payload is not None else self.negative_ttl
+            if now - created_at > ttl:
+                self._conn.execute("DELETE FROM barcode_cache WHERE barcode = ? AND provider = ?", (barcode, provider))
+                self._conn.commit()
+                self.misses += 1
+                return False, None
+            self._conn.execute(
+                "UPDATE barcode_cache SET last_access = ? WHERE barcode = ? AND provider = ?",
+                (now, barcode, provider)
+            )
+            self._conn.commit()
+            self.hits += 1
+        return True, json.loads(payload) if payload is not None else None
+    
+    def put(self, barcode: str, provider: str, value: Optional[Dict]):
+        """Store a result; pass None to record a negative ("not found") answer."""
+        now = time.time()
+        payload = json.dumps(value) if value is not None else None
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO barcode_cache (barcode, provider, payload, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (barcode, provider, payload, now, now)
+            )
+            self._writes += 1
+            if self._writes % CACHE_EVICTION_CHECK_INTERVAL == 0:
+                self._evict()
+            self._conn.commit()
+    
+    def _evict(self):
+        """Drop least recently used entries above max_entries. Caller holds the lock."""
+        count = self._conn.execute("SELECT COUNT(*) FROM barcode_cache").fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM barcode_cache WHERE (barcode, provider) IN "
+                "(SELECT barcode, provider FROM barcode_cache ORDER BY last_access LIMIT ?)",
+                (excess,)
+            )
+            logger.info(f"Evicted {excess} least recently used cache entries")
+    
+    def keys(self, provider: str) -> List[str]:
+        """Every cached key for one provider (expired entries included until they are next read)."""
+        with self._lock:
+            return [row[0] for row in self._conn.execute(
+                "SELECT barcode FROM barcode_cache WHERE provider = ?", (provider,))]
+    
+    def stats(self) -> Dict:
+        return {"path": self.path, "hits": self.hits, "misses": self.misses}
+    
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def enhancement_fingerprint(product_data: Dict) -> Optional[str]:
+    """
+    'brand|name words' shared by pack-size variants of one product ("Maggi Masala Noodles 70g" and
+    "Maggi Masala Noodles 4 x 70g" match), or None if brand or name is too thin to key on.
+    """
+    brand = (product_data.get('brand') or '').split(',')[0]
+    brand_words = re.findall(r'[a-z0-9]+', brand.lower())
+    name = ENHANCEMENT_QUANTITY_PATTERN.sub(' ', (product_data.get('name') or '').lower())
+    words = [word for word in re.findall(r'[a-z0-9]+', name)
+             if word not in ENHANCEMENT_NAME_STOPWORDS and word not in brand_words]
+    if not brand_words or len(words) < ENHANCEMENT_MIN_NAME_WORDS:
+        return None
+    return f"{' '.join(brand_words)}|{' '.join(words)}"
+
+
+def _name_shingles(fingerprint: str) -> frozenset:
+    name = fingerprint.split('|', 1)[1]
+    return frozenset(name[i:i + ENHANCEMENT_SHINGLE_SIZE] for i in range(max(1, len(name) - ENHANCEMENT_SHINGLE_SIZE + 1)))
+
+
+class EnhancementCache:
+    """
+    AI enhancement results keyed by enhancement_fingerprint(), so variants of a product share one LLM call.
+    
+    Entries live in the persistent BarcodeResultCache when it is enabled (and are re-indexed on
+    start-up), otherwise in a bounded in-memory map. Near-duplicate lookups compare trigram sets
+    within the same brand only, which keeps each scan to a brand's own products.
+    """
+    
+    def __init__(self, store: Optional[BarcodeResultCache] = None,
+                 similarity: float = DEFAULT_ENHANCEMENT_CACHE_SIMILARITY,
+                 max_entries: int = DEFAULT_CACHE_MAX_ENTRIES):
+        self.store = store
+        self.similarity = similarity
+        self.max_entries = max_entries
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self._memory = {}
+        self._index = {}  # brand -> {fingerprint: name shingles}
+        self._lock = threading.Lock()
+        if store is not None:
+            for fingerprint in store.keys(CACHE_ENHANCEMENT_PROVIDER):
+                self._add_to_index(fingerprint)
+    
+    def _add_to_index(self, fingerprint: str):
+        brand = fingerprint.split('|', 1)[0]
+        self._index.setdefault(brand, {})[fingerprint] = _name_shingles(fingerprint)
+    
+    def _get(self, fingerprint: str) -> Optional[Dict]:
+        if self.store is not None:
+            return self.store.get(fingerprint, CACHE_ENHANCEMENT_PROVIDER)[1]
+        return self._memory.get(fingerprint)
+    
+    def _nearest(self, fingerprint: str) -> Optional[str]:
+        """Most similar indexed fingerprint of the same brand at or above the similarity threshold."""
+        shingles = _name_shingles(fingerprint)
+        best, best_score = None, self.similarity
+        with self._lock:
+            candidates = list(self._index.get(fingerprint.split('|', 1)[0], {}).items())
+        for candidate, candidate_shingles in candidates:
+            score = len(shingles & candidate_shingles) / len(shingles | candidate_shingles)
+            if score >= best_score:
+                best, best_score = candidate, score
+        return best
+    
+    def lookup(self, product_data: Dict) -> Optional[Dict]:
+        """Reusable enhancement fields for a product, or None."""
+        fingerprint = enhancement_fingerprint(product_data)
+        if fingerprint is None:
+            return None
+        cached = self._get(fingerprint)
+        near = False
+        if cached is None and self.similarity > 0:
+            nearest = self._nearest(fingerprint)
+            cached = self._get(nearest) if nearest else None
+            near = True
+        with self._lock:
+            if cached is None:
+                self.misses += 1
+            elif near:
+                self.near_hits += 1
+            else:
+                self.hits += 1
+        return cached
+    
+    def put(self, product_data: Dict, enhanced_data: Dict):
+        fingerprint = enhancement_fingerprint(product_data)
+        if fingerprint is None:
+            return
+        entry = {field: enhanced_data[field] for field in ENHANCEMENT_REUSED_FIELDS if field in enhanced_data}
+        if self.store is not None:
+            self.store.put(fingerprint, CACHE_ENHANCEMENT_PROVIDER, entry)
+        with self._lock:
+            if self.store is None:
+                if fingerprint not in self._memory and len(self._memory) >= self.max_entries:
+                    evicted = next(iter(self._memory))
+                    del self._memory[evicted]
+                    self._index.get(evicted.split('|', 1)[0], {}).pop(evicted, None)
+                self._memory[fingerprint] = entry
+            self._add_to_index(fingerprint)
+    
+    def stats(self) -> Dict:
+        with self._lock:
+            entries = sum(len(bucket) for bucket in self._index.values())
+        return {"entries": entries, "hits": self.hits, "near_hits": self.near_hits, "misses": self.misses,
+                "similarity": self.similarity}
 
-AI_ENHANCEMENT_PROMPT_TEMPLATE = """
-Analyze this product data for barcode {barcode} and enhance it with accurate information:
-
-Context Data:
-{context}
-
-Please return ONLY a valid JSON object with this exact structure:
-{{
-    "Product Name": "accurate product name",
-    "Brand": "brand name",
-    "Description": "detailed product description",
-    "Category": "main category (Food & Beverages, Personal Care, Household, Health & Medicine, Baby Care, Beauty, Other)",
-    "Subcategory": "specific subcategory",
-    "ProductLine": "brand + subcategory combination",
-    "Quantity": numeric_value,
-    "Unit": "g/ml/kg/l/pc",
-    "Features": ["feature1", "feature2", "feature3", "feature4"],
-    "Specification": {{
-        "Brand": "brand name",
-        "Weight/Volume": "quantity with unit",
-        "Country of Origin": "country",
-        "Barcode Type": "EAN-13/UPC-A/etc",
-        "Ingredients": "ingredient list if available",
-        "Nutrition Facts": "nutrition information if available"
-    }}
-}}
-
-Guidelines:
-1. Extract accurate product name, brand, and description
-2. Categorize appropriately based on product type
-3. Determine realistic quantity and unit
-4. Generate relevant features based on product category
-5. Include comprehensive specifications
-6. Ensure all JSON is properly formatted
-
-Return only the JSON object, no other text.
-"""
-
-# JSON parsing patterns
-JSON_CODEBLOCK_PATTERN = r'```(?:json)?\s*(\{.*?\})\s*```'
-JSON_UNQUOTED_PROPERTY_PATTERN = r'(\s*)([a-zA-Z_][a-zA-Z0-9_\s]*)\s*:'
-JSON_TRAILING_COMMA_PATTERN = r',(\s*[}\]])'
-JSON_MISSING_COMMA_PATTERN = r'(\}\s*)(\s*"[^"]*"\s*:)'
-JSON_UNQUOTED_VALUE_PATTERN = r':\s*([^",\[\{\s][^",\[\{]*[^",\[\}\s])\s*([,\}])'
-JSON_MAX_CLEANUP_ATTEMPTS = 3
 
 class BarcodeAPIProcessor:
     """Complete barcode processor for Node.js API integration - preserving all original functionality."""
@@ -211,27 +1879,132 @@ class BarcodeAPIProcessor:
         self.gemini_api_key = os.getenv("GEMINI_API_KEY")
         
         # Configuration
-        self.api_request_delay = float(os.getenv("API_REQUEST_DELAY", str(DEFAULT_API_REQUEST_DELAY)))
         self.max_retries = int(os.getenv("MAX_RETRIES", str(DEFAULT_MAX_RETRIES)))
+        self.max_workers = max(1, int(os.getenv("MAX_WORKERS", str(DEFAULT_MAX_WORKERS))))
+        self.ai_batch_size = max(1, int(os.getenv("AI_BATCH_SIZE", str(DEFAULT_AI_BATCH_SIZE))))
+        self.lookup_strategy = os.getenv("LOOKUP_STRATEGY", DEFAULT_LOOKUP_STRATEGY).lower()
+        if self.lookup_strategy not in LOOKUP_STRATEGIES:
+            logger.warning(f"Unknown LOOKUP_STRATEGY '{self.lookup_strategy}', using {DEFAULT_LOOKUP_STRATEGY}")
+            self.lookup_strategy = DEFAULT_LOOKUP_STRATEGY
+        self.lookup_hedge_delay = float(os.getenv("LOOKUP_HEDGE_DELAY", str(DEFAULT_LOOKUP_HEDGE_DELAY)))
+        self.batch_deadline = float(os.getenv("BATCH_DEADLINE")) if os.getenv("BATCH_DEADLINE") else None
+        self.barcode_deadline = float(os.getenv("BARCODE_DEADLINE")) if os.getenv("BARCODE_DEADLINE") else None
         self.openfoodfacts_url = os.getenv("OPENFOODFACTS_URL", OPENFOODFACTS_BASE_URL)
+        self.google_search_url = os.getenv("GOOGLE_SEARCH_URL", GOOGLE_SEARCH_API_URL)
+        self.digiteyes_url = os.getenv("DIGITEYES_URL", DIGITEYES_API_URL)
+        self.gemini_url = os.getenv("GEMINI_URL", GEMINI_API_URL)
+        self.openai_url = os.getenv("OPENAI_URL", OPENAI_API_URL)
+        self.deepseek_url = os.getenv("DEEPSEEK_URL", DEEPSEEK_API_URL)
         self.stop_requested = False
         
-        # Add local cache for Google search results
-        self.search_cache_dir = os.path.join(self.output_dir, 'cache')
+        # Per-provider pacing replaces the old fixed delay between requests
+        self.rate_limiter = RateLimiter()
+        
+        # One pooled session per upstream host so connections are reused across calls
+        self.http_pool_size = max(self.max_workers, int(os.getenv("HTTP_POOL_SIZE", str(DEFAULT_HTTP_POOL_SIZE))))
+        self.http_retries = int(os.getenv("HTTP_RETRIES", str(DEFAULT_HTTP_RETRIES)))
+        self.http_backoff = float(os.getenv("HTTP_RETRY_BACKOFF", str(DEFAULT_HTTP_RETRY_BACKOFF)))
+        self.http_keep_alive = os.getenv("HTTP_KEEP_ALIVE", "true").lower() not in ("0", "false", "no")
+        # Ask each AI provider for JSON output matching AI_PRODUCT_SCHEMA (disable for proxies that reject it)
+        self.ai_structured_output = os.getenv("AI_STRUCTURED_OUTPUT", "true").lower() not in ("0", "false", "no")
+        self.ai_prompt_token_budget = int(os.getenv("AI_PROMPT_TOKEN_BUDGET", str(DEFAULT_AI_PROMPT_TOKEN_BUDGET)))
+        # Append every raw model reply to this NDJSON file (replay with benchmark_json_parser.py --replies)
+        self.ai_reply_log = os.getenv("AI_REPLY_LOG") or None
+        self._ai_reply_log_lock = threading.Lock()
+        
+        # Every lookup and AI call runs as a coroutine on this event loop, started on its own thread
+        # the first time it is needed; the sync API waits on it, the async API awaits it. The HTTP
+        # sessions are created on it too, on first use
+        self.http_sessions = {}
+        self._loop = None
+        self._loop_thread = None
+        # Losing hedged AI calls, left to finish so the router still learns their latency
+        self._background_tasks = set()
+        
+        # Persistent lookup cache - one per user rather than per output directory, so every run and
+        # job (whatever directory it writes to) starts from what earlier ones already looked up
+        self.search_cache_dir = os.getenv("BARCODE_CACHE_DIR") or DEFAULT_CACHE_DIR
         os.makedirs(self.search_cache_dir, exist_ok=True)
+        self.cache = None
+        if os.getenv("BARCODE_CACHE_ENABLED", "true").lower() not in ("0", "false", "no"):
+            self.cache = BarcodeResultCache(
+                os.path.join(self.search_cache_dir, CACHE_DB_FILENAME),
+                ttl=float(os.getenv("BARCODE_CACHE_TTL", str(DEFAULT_CACHE_TTL))),
+                negative_ttl=float(os.getenv("BARCODE_CACHE_NEGATIVE_TTL", str(DEFAULT_CACHE_NEGATIVE_TTL))),
+                max_entries=int(os.getenv("BARCODE_CACHE_MAX_ENTRIES", str(DEFAULT_CACHE_MAX_ENTRIES)))
+            )
+        
+        # AI results shared between variants of one product (stored in the lookup cache when enabled)
+        self.enhancement_cache = None
+        if os.getenv("ENHANCEMENT_CACHE_ENABLED", "true").lower() not in ("0", "false", "no"):
+            self.enhancement_cache = EnhancementCache(
+                self.cache,
+                similarity=float(os.getenv("ENHANCEMENT_CACHE_SIMILARITY", str(DEFAULT_ENHANCEMENT_CACHE_SIMILARITY))),
+                max_entries=int(os.getenv("BARCODE_CACHE_MAX_ENTRIES", str(DEFAULT_CACHE_MAX_ENTRIES)))
+            )
+        
+        # Optional local OpenFoodFacts copy; barcodes missing from it still go to the live API
+        # unless OPENFOODFACTS_LOCAL_ONLY is set (the dump is then treated as complete)
+        self.off_store = None
+        off_db = os.getenv("OPENFOODFACTS_LOCAL_DB")
+        self.off_local_only = os.getenv("OPENFOODFACTS_LOCAL_ONLY", "false").lower() in ("1", "true", "yes")
+        if off_db:
+            try:
+                self.off_store = OpenFoodFactsLocalStore(off_db)
+                logger.info(f"Using local OpenFoodFacts store: {off_db}")
+            except sqlite3.Error as e:
+                logger.warning(f"Could not open local OpenFoodFacts store {off_db}: {e}")
+        
+        # Lookups currently running, keyed by (GTIN-14, enhance), so concurrent callers can share them
+        # (only touched on the event loop)
+        self._inflight = {}
+        
+        # Stage timings and counters; the per-barcode timings dict and deadline live in _BARCODE_TIMINGS
+        # and _BARCODE_DEADLINE
+        self.metrics = ProcessorMetrics()
         
         # Track processed items
         self.last_processed_item = None
         self.processed_barcodes = []
+        self._state_lock = threading.Lock()
         
-        # AI failure tracking - set Gemini as the primary service
-        self.ai_service_status = AI_SERVICE_DEFAULT_STATUS.copy()
+        # AI failure tracking - one circuit breaker per service, Gemini is the primary service
+        failure_threshold = int(os.getenv("AI_CIRCUIT_FAILURE_THRESHOLD", str(DEFAULT_AI_CIRCUIT_FAILURE_THRESHOLD)))
+        cooldown = float(os.getenv("AI_CIRCUIT_COOLDOWN", str(DEFAULT_AI_CIRCUIT_COOLDOWN)))
+        max_cooldown = float(os.getenv("AI_CIRCUIT_MAX_COOLDOWN", str(DEFAULT_AI_CIRCUIT_MAX_COOLDOWN)))
+        hard_cooldown = float(os.getenv("AI_CIRCUIT_HARD_COOLDOWN", str(DEFAULT_AI_CIRCUIT_HARD_COOLDOWN)))
+        self.ai_breakers = {
+            service: CircuitBreaker(service, failure_threshold, cooldown, max_cooldown, hard_cooldown)
+            for service in AI_SERVICES
+        }
         
-        # Added failover info for common Indian product companies
-        self.india_company_codes = INDIA_COMPANY_CODES
+        # AI backends behind one interface, tried in the order picked by the router
+        self.ai_backends = {
+            "gemini": GeminiBackend("gemini", "Gemini", self.gemini_url, self.gemini_api_key,
+                                    GEMINI_MODEL, GEMINI_MAX_TOKENS),
+            "openai": OpenAIChatBackend("openai", "OpenAI", self.openai_url, self.openai_api_key, OPENAI_MODEL,
+                                        OPENAI_MAX_TOKENS,
+                                        json_schema=OPENAI_MODEL.startswith(OPENAI_JSON_SCHEMA_MODEL_PREFIXES)),
+            "deepseek": OpenAIChatBackend("deepseek", "DeepSeek", self.deepseek_url, self.deepseek_api_key,
+                                          DEEPSEEK_MODEL, DEEPSEEK_MAX_TOKENS)
+        }
+        ai_routing = os.getenv("AI_ROUTING", DEFAULT_AI_ROUTING).lower()
+        if ai_routing not in AI_ROUTING_STRATEGIES:
+            logger.warning(f"Unknown AI_ROUTING '{ai_routing}', using {DEFAULT_AI_ROUTING}")
+            ai_routing = DEFAULT_AI_ROUTING
+        self.ai_router = AIRouter(
+            AI_SERVICES, ai_routing,
+            window=int(os.getenv("AI_ROUTER_WINDOW", str(DEFAULT_AI_ROUTER_WINDOW))),
+            probe_interval=float(os.getenv("AI_ROUTER_PROBE_INTERVAL", str(DEFAULT_AI_ROUTER_PROBE_INTERVAL))),
+            cost_weight=float(os.getenv("AI_ROUTER_COST_WEIGHT", str(DEFAULT_AI_ROUTER_COST_WEIGHT)))
+        )
+        self.ai_hedging = os.getenv("AI_HEDGING", "false").lower() in ("1", "true", "yes")
+        self.ai_hedge_percentile = float(os.getenv("AI_HEDGE_PERCENTILE", str(DEFAULT_AI_HEDGE_PERCENTILE)))
+        self.ai_hedge_min_delay = float(os.getenv("AI_HEDGE_MIN_DELAY", str(DEFAULT_AI_HEDGE_MIN_DELAY)))
+        self.ai_hedge_budget = HedgeBudget(float(os.getenv("AI_HEDGE_BUDGET", str(DEFAULT_AI_HEDGE_BUDGET))))
         
-        # Common product categories by barcode patterns
-        self.barcode_category_patterns = BARCODE_CATEGORY_PATTERNS
+        # GS1 prefix index: issuing country and company category hints without a network call
+        self.gs1_index = GS1_PREFIX_INDEX
         
         logger.info("Barcode API processor initialized with all original functionality")
         
@@ -263,142 +2036,785 @@ class BarcodeAPIProcessor:
         else:
             logger.info("All required API keys loaded successfully.")
 
-    def process_barcodes(self, barcodes: List[str]) -> List[Dict]:
+    def process_barcodes(self, barcodes: List[str], max_workers: int = None,
+                         deadline: float = None, barcode_deadline: float = None) -> List[Dict]:
         """
         Process a list of barcodes and return product data.
         
         Args:
             barcodes: List of barcode strings
+            max_workers: Number of barcodes looked up concurrently (defaults to MAX_WORKERS)
+            deadline: Seconds allowed for the whole batch (defaults to BATCH_DEADLINE, no limit if unset)
+            barcode_deadline: Seconds allowed per barcode (defaults to BARCODE_DEADLINE, no limit if unset)
             
         Returns:
-            List of product data dictionaries
+            List of product data dictionaries found before the deadline, in input order
+        """
+        records = sorted(self.iter_process_barcodes(barcodes, max_workers, deadline, barcode_deadline),
+                         key=lambda r: r['index'])
+        results = [record['product'] for record in records if record['status'] == 'found']
+        
+        logger.info(f"Completed processing. Found data for {len(results)} out of {len(barcodes)} barcodes")
+        return results
+
+    def iter_process_barcodes(self, barcodes: List[str], max_workers: int = None,
+                              deadline: float = None, barcode_deadline: float = None) -> Iterator[Dict]:
+        """
+        Process barcodes and yield one outcome record per barcode as soon as it is resolved.
+        
+        Records arrive in completion order and look like:
+            {"index": 0, "barcode": "...", "status": "found", "product": {...}, "elapsed_ms": 812.4,
+             "timings": {"validation": 0.1, "lookup_openfoodfacts": 240.3, "llm_gemini": 570.2, ...}}
+            {"index": 1, "barcode": "...", "status": "not_found", "reason": "...", "elapsed_ms": 95.0, "timings": {...}}
+        where status is one of found, not_found, invalid, error or pending and timings holds
+        milliseconds per stage. Barcodes still unresolved when the deadline passes are reported
+        as pending so callers keep everything finished so far.
+        
+        Repeated barcodes (including the same GTIN written as UPC-A and EAN-13) are looked up
+        once; every repeat gets its own record with its own index and barcode, plus
+        "duplicate_of" pointing at the first position.
+        
+        This is a blocking wrapper around the async pipeline: the work runs on the processor's
+        event loop while the calling thread waits for each record.
+        """
+        records = self._iter_records(barcodes, max_workers, deadline, barcode_deadline)
+        try:
+            while True:
+                record = self._run(_next_record(records))
+                if record is _RECORDS_END:
+                    return
+                yield record
+        finally:
+            # Stopping early cancels the lookups still running
+            self._run(_close_records(records))
+
+    async def _iter_records(self, barcodes: List[str], max_workers: int = None,
+                            deadline: float = None, barcode_deadline: float = None) -> AsyncIterator[Dict]:
+        """The pipeline behind iter_process_barcodes(), run on the processor's event loop."""
+        # Collapse duplicates; positions[i] lists every input index sharing unique barcode i
+        positions = []
+        unique_barcodes = []
+        first_seen = {}
+        for index, barcode in enumerate(barcodes):
+            key = gtin_key(barcode)
+            if key not in first_seen:
+                first_seen[key] = len(unique_barcodes)
+                unique_barcodes.append(barcode)
+                positions.append([])
+            positions[first_seen[key]].append(index)
+        if len(unique_barcodes) < len(barcodes):
+            logger.info(f"Collapsed {len(barcodes) - len(unique_barcodes)} duplicate barcode(s)")
+            self.metrics.increment("duplicates_collapsed", amount=len(barcodes) - len(unique_barcodes))
+        
+        total = len(unique_barcodes)
+        workers = max(1, max_workers or self.max_workers)
+        deadline = deadline if deadline is not None else self.batch_deadline
+        barcode_deadline = barcode_deadline if barcode_deadline is not None else self.barcode_deadline
+        deadline_at = time.monotonic() + deadline if deadline is not None else None
+        
+        logger.info(f"Starting to process {total} barcodes with {workers} worker(s)")
+        
+        # Outcomes that finished ahead of an earlier barcode wait here so that
+        # processed_barcodes/last_processed_item are updated in input order
+        reorder_buffer = {}
+        next_index = 0
+        
+        # With batching enabled, lookups are enhanced together once enough have been found
+        batch_enhancement = self.ai_batch_size > 1
+        awaiting_enhancement = []
+        
+        async def finish(records):
+            nonlocal next_index
+            for record in records:
+                if record['status'] == 'lookup_found':
+                    awaiting_enhancement.append(record)
+                    continue
+                for fanned in self._fan_out(record, positions[record['index']], barcodes):
+                    next_index = self._record_progress(fanned, reorder_buffer, next_index)
+                    yield fanned
+            if len(awaiting_enhancement) >= self.ai_batch_size:
+                batch = awaiting_enhancement[:]
+                awaiting_enhancement.clear()
+                async for fanned in finish(await self._enhance_records(batch, deadline_at)):
+                    yield fanned
+        
+        # At most `workers` barcodes are in flight; the next one starts as soon as one finishes
+        queued = iter(enumerate(unique_barcodes))
+        running = {}
+        
+        def start_next():
+            for index, barcode in queued:
+                running[asyncio.ensure_future(self._process_barcode_entry(
+                    index, total, barcode, batch_enhancement, deadline_at, barcode_deadline))] = (index, barcode)
+                if len(running) >= workers:
+                    return
+        
+        try:
+            start_next()
+            while running:
+                # Barcodes stop on their own at the deadline; the grace period lets them report back
+                wait_for = None if deadline_at is None else max(0.0, deadline_at - time.monotonic()) + DEADLINE_GRACE
+                done, _ = await asyncio.wait(list(running), timeout=wait_for, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    for task in running:
+                        task.cancel()
+                    unfinished = sorted(running.values()) + list(queued)
+                    running.clear()
+                    logger.warning(f"Batch deadline reached with {len(unfinished)} barcode(s) unfinished")
+                    async for record in finish([self._pending_record(index, barcode) for index, barcode in unfinished]):
+                        yield record
+                    break
+                finished = sorted(done, key=lambda t: running[t][0])
+                for task in finished:
+                    del running[task]
+                start_next()
+                for task in finished:
+                    async for record in finish([task.result()]):
+                        yield record
+        finally:
+            for task in running:
+                task.cancel()
+        
+        if awaiting_enhancement:
+            async for record in finish(await self._enhance_records(awaiting_enhancement[:], deadline_at)):
+                yield record
+
+    async def process_barcodes_async(self, barcodes: List[str], max_workers: int = None,
+                                     deadline: float = None, barcode_deadline: float = None) -> List[Dict]:
+        """
+        Coroutine version of process_barcodes(): same arguments, same result. Lookups and AI calls
+        are non-blocking, so many of these can be awaited at once without a thread each.
+        """
+        records = [record async for record in
+                   self.iter_process_barcodes_async(barcodes, max_workers, deadline, barcode_deadline)]
+        records.sort(key=lambda r: r['index'])
+        results = [record['product'] for record in records if record['status'] == 'found']
+        
+        logger.info(f"Completed processing. Found data for {len(results)} out of {len(barcodes)} barcodes")
+        return results
+
+    async def process_barcode_async(self, barcode: str, deadline: float = None) -> Dict:
+        """
+        Look up one barcode and return its outcome record (the same shape iter_process_barcodes()
+        yields). Each call is a few coroutines on the processor's event loop, so thousands can be
+        in flight at once.
+        """
+        async for record in self.iter_process_barcodes_async([barcode], max_workers=1,
+                                                             barcode_deadline=deadline):
+            return record
+        return self._pending_record(0, barcode)
+
+    async def iter_process_barcodes_async(self, barcodes: List[str], max_workers: int = None,
+                                          deadline: float = None,
+                                          barcode_deadline: float = None) -> AsyncIterator[Dict]:
+        """
+        Async iterator version of iter_process_barcodes(): records arrive in completion order as
+        soon as they resolve. The pipeline runs on the processor's event loop whichever loop
+        awaits it; if the consumer stops early (break, cancellation) the lookups still running
+        are cancelled.
+        """
+        loop = self._get_loop()
+        records = self._iter_records(barcodes, max_workers, deadline, barcode_deadline)
+        try:
+            while True:
+                record = await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(_next_record(records), loop))
+                if record is _RECORDS_END:
+                    break
+                yield record
+        finally:
+            await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(_close_records(records), loop))
+
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        """The processor's event loop, started on a daemon thread on first use."""
+        with self._state_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._loop_thread = threading.Thread(target=self._loop.run_forever, name='barcode-processor-loop',
+                                                     daemon=True)
+                self._loop_thread.start()
+            return self._loop
+
+    def _run(self, coro):
+        """Run a coroutine on the processor's event loop and block until it returns."""
+        future = asyncio.run_coroutine_threadsafe(coro, self._get_loop())
+        try:
+            return future.result()
+        finally:
+            # No-op once it finished; otherwise (KeyboardInterrupt in this thread) stop it
+            future.cancel()
+
+    def run_job(self, barcode_file: str, max_workers: int = None,
+                deadline: float = None, barcode_deadline: float = None) -> Dict:
+        """
+        Process a barcode file as a resumable job.
+        
+        Every finished barcode is checkpointed to <name>.journal.ndjson in output_dir, so a job
+        that is killed or runs out of time picks up where it stopped when run again (pending and
+        errored barcodes are retried). Found products are then streamed from the journal into
+        <name>.results.json in input order.
+        
+        Returns:
+            Summary with counts and the journal and output paths
+        """
+        barcodes = read_barcode_file(barcode_file)
+        job_name = os.path.splitext(os.path.basename(barcode_file))[0]
+        journal = JobJournal(os.path.join(self.output_dir, job_name + JOB_JOURNAL_SUFFIX), barcodes)
+        output_path = os.path.join(self.output_dir, job_name + JOB_OUTPUT_SUFFIX)
+        
+        try:
+            completed = journal.completed()
+            remaining = [index for index in range(len(barcodes)) if index not in completed]
+            logger.info(f"Job {job_name}: {len(completed)} of {len(barcodes)} barcodes already done, "
+                        f"{len(remaining)} to process")
+            
+            counts = {}
+            records = self.iter_process_barcodes([barcodes[index] for index in remaining],
+                                                 max_workers, deadline, barcode_deadline)
+            for record in records:
+                record = dict(record, index=remaining[record['index']])
+                journal.append(record)
+                counts[record['status']] = counts.get(record['status'], 0) + 1
+            
+            found = self._write_job_output(journal, output_path)
+            unfinished = len(barcodes) - len(journal.completed())
+        finally:
+            journal.close()
+        
+        logger.info(f"Job {job_name} wrote {found} products to {output_path}, {unfinished} barcode(s) unfinished")
+        return {
+            "job": job_name,
+            "total": len(barcodes),
+            "skipped": len(completed),
+            "processed": counts,
+            "found": found,
+            "unfinished": unfinished,
+            "journal": journal.path,
+            "output": output_path
+        }
+
+    def _write_job_output(self, journal: JobJournal, output_path: str) -> int:
+        """Stream found products from the journal into a JSON list; replaced atomically."""
+        found = 0
+        temp_path = output_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as output_file:
+            output_file.write("[")
+            for record in journal.iter_records():
+                if record['status'] != 'found':
+                    continue
+                output_file.write(",\n" if found else "\n")
+                output_file.write(json.dumps(record['product'], indent=2))
+                found += 1
+            output_file.write("\n]\n")
+        os.replace(temp_path, output_path)
+        return found
+
+    def _fan_out(self, record: Dict, indexes: List[int], barcodes: List[str]) -> List[Dict]:
+        """Copy a unique barcode's record to every input position that shares it."""
+        if len(indexes) == 1:
+            record['index'] = indexes[0]
+            return [record]
+        fanned = []
+        for index in indexes:
+            duplicate = dict(record, index=index, barcode=barcodes[index])
+            if 'product' in record:
+                duplicate['product'] = dict(record['product'], Barcode=barcodes[index])
+            if index != indexes[0]:
+                duplicate['duplicate_of'] = indexes[0]
+            fanned.append(duplicate)
+        return fanned
+
+    def _pending_record(self, index: int, barcode: str, reason: str = "Deadline exceeded") -> Dict:
+        return {'index': index, 'barcode': barcode, 'status': 'pending', 'reason': reason,
+                'elapsed_ms': 0.0, 'timings': {}}
+
+    def _record_progress(self, record: Dict, reorder_buffer: Dict, next_index: int) -> int:
+        """Update progress tracking in input order; returns the next index still outstanding."""
+        self.metrics.increment("barcodes", record['status'], label="status")
+        reorder_buffer[record['index']] = record
+        with self._state_lock:
+            while next_index in reorder_buffer:
+                ready = reorder_buffer.pop(next_index)
+                if ready['status'] == 'found':
+                    self.last_processed_item = ready['product']
+                    self.processed_barcodes.append(ready['barcode'])
+                next_index += 1
+        return next_index
+
+    async def _process_barcode_entry(self, index: int, total: int, barcode: str, defer_enhancement: bool = False,
+                                     deadline_at: float = None, barcode_deadline: float = None) -> Dict:
+        """
+        Validate and process one barcode of a batch and return its outcome record; never raises.
+        
+        With defer_enhancement, products found by a lookup are returned with status
+        "lookup_found" and the raw data under "lookup" so they can be AI-enhanced in a batch.
+        The barcode's deadline is the earlier of the batch deadline and barcode_deadline seconds from now.
+        """
+        started = time.monotonic()
+        if barcode_deadline is not None:
+            deadline_at = min(deadline_at or float('inf'), started + barcode_deadline)
+        if deadline_at is not None and started >= deadline_at:
+            return self._pending_record(index, barcode, "Deadline exceeded before processing started")
+        
+        record = {'index': index, 'barcode': barcode, 'timings': {}}
+        timings_token = _BARCODE_TIMINGS.set(record['timings'])
+        deadline_token = _BARCODE_DEADLINE.set(deadline_at)
+        try:
+            logger.info(f"Processing barcode {index + 1}/{total}: {barcode}")
+            
+            # Validate barcode format
+            with self._stage("validation"):
+                problem = self._barcode_problem(barcode)
+            if problem:
+                logger.warning(f"{problem}: {barcode}")
+                record.update(status='invalid', reason=problem)
+                return record
+            
+            # Process single barcode
+            product_data, failure_reasons, needs_enhancement = await self._resolve_barcode(
+                barcode, enhance=not defer_enhancement)
+            
+            if needs_enhancement:
+                record.update(status='lookup_found', lookup=product_data)
+            elif product_data:
+                logger.info(f"Successfully processed barcode: {barcode}")
+                record.update(status='found', product=product_data)
+            elif self._deadline_passed():
+                logger.warning(f"Deadline reached before barcode {barcode} was resolved")
+                record.update(status='pending', reason='Deadline exceeded')
+            else:
+                logger.warning(f"No data found for barcode: {barcode}")
+                record.update(status='not_found', reason='; '.join(failure_reasons))
+            
+            return record
+            
+        except Exception as e:
+            logger.error(f"Error processing barcode {barcode}: {e}")
+            record.update(status='error', reason=str(e))
+            return record
+        finally:
+            elapsed = time.monotonic() - started
+            self.metrics.observe("barcode", elapsed)
+            record['elapsed_ms'] = round(elapsed * 1000, 1)
+            _BARCODE_TIMINGS.reset(timings_token)
+            _BARCODE_DEADLINE.reset(deadline_token)
+
+    @contextmanager
+    def _stage(self, stage: str):
+        """Time a processing stage into the aggregate metrics and the current barcode's timings."""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started
+            self.metrics.observe(stage, elapsed)
+            timings = _BARCODE_TIMINGS.get()
+            if timings is not None:
+                timings[stage] = round(timings.get(stage, 0.0) + elapsed * 1000, 1)
+
+    def _time_left(self) -> Optional[float]:
+        """Seconds left before the current barcode's deadline, or None when there is no deadline."""
+        deadline_at = _BARCODE_DEADLINE.get()
+        return None if deadline_at is None else max(0.0, deadline_at - time.monotonic())
+
+    def _deadline_passed(self) -> bool:
+        time_left = self._time_left()
+        return time_left is not None and time_left <= 0
+
+    def _budget(self, seconds: float) -> float:
+        """Clamp a timeout or wait to the time left before the deadline."""
+        time_left = self._time_left()
+        return seconds if time_left is None else max(DEADLINE_MIN_TIMEOUT, min(seconds, time_left))
+
+    async def _http_request(self, provider: str, method: str, url: str, timeout: float, **kwargs) -> HTTPResponse:
+        """
+        Send a request on a provider's session, retrying GETs on transport errors and
+        HTTP_RETRY_STATUS_CODES (backoff doubling from HTTP_RETRY_BACKOFF, or Retry-After)
+        up to HTTP_RETRIES times. Under a deadline every attempt and wait is cut to the time
+        left. Returns the last response; raises aiohttp.ClientError if the last attempt got none.
+        """
+        retries = self.http_retries if method == "GET" else 0
+        for attempt in range(retries + 1):
+            response = error = None
+            try:
+                response = await self._send(provider, method, url, timeout, **kwargs)
+                if response.status_code not in HTTP_RETRY_STATUS_CODES:
+                    return response
+            except aiohttp.ClientError as e:
+                error = e
+            backoff = retry_after_seconds(response, self.http_backoff * 2 ** attempt)
+            time_left = self._time_left()
+            if attempt == retries or (time_left is not None and time_left <= backoff + DEADLINE_MIN_TIMEOUT):
+                break
+            logger.info(f"Retrying {provider} request in {backoff:.1f}s: "
+                        f"{error or f'HTTP {response.status_code}'}")
+            await asyncio.sleep(backoff)
+        if error:
+            raise error
+        return response
+
+    async def _send(self, provider: str, method: str, url: str, timeout: float, **kwargs) -> HTTPResponse:
+        """One HTTP attempt, allowed timeout seconds in total (less under a deadline)."""
+        session = self.http_sessions.get(provider)
+        if session is None:
+            session = self.http_sessions[provider] = build_http_session(self.http_pool_size, self.http_keep_alive)
+        timeout = self._budget(timeout)
+        try:
+            async with session.request(method, url, timeout=aiohttp.ClientTimeout(total=timeout), **kwargs) as response:
+                return HTTPResponse(response.status, response.headers, await response.read())
+        except asyncio.TimeoutError:
+            raise aiohttp.ServerTimeoutError(f"{provider} request took longer than {timeout:.1f}s")
+
+    async def _acquire(self, provider: str) -> bool:
+        """Wait for a rate-limit token; gives up (False) if the deadline would pass first."""
+        if not self._deadline_passed() and await self.rate_limiter.acquire_async(provider, timeout=self._time_left()):
+            return True
+        logger.warning(f"Deadline reached before a {provider} request could be sent")
+        self.metrics.increment("deadline_exceeded", provider)
+        return False
+
+    def _process_single_barcode(self, barcode: str) -> Optional[Dict]:
+        """Process a single barcode and return the product data - preserving original logic."""
+        return self._run(self._resolve_barcode(barcode))[0]
+
+    async def _resolve_barcode(self, barcode: str, enhance: bool = True,
+                               retry_inconclusive: bool = True) -> Tuple[Optional[Dict], List[str], bool]:
         """
-        results = []
+        Look up and enhance a barcode.
         
-        logger.info(f"Starting to process {len(barcodes)} barcodes")
+        Returns the product data, the reasons for any failure and whether the data still
+        needs AI enhancement (only when enhance is False and a lookup found the product).
+        Concurrent calls for the same GTIN (other workers, other daemon requests) share
+        the lookup that is already in flight instead of repeating it. A shared lookup that
+        missed without a definitive answer (its owner's deadline, provider errors) is run
+        again once by a waiter that still has time left.
+        """
+        inflight_key = (gtin_key(barcode), enhance)
+        future = self._inflight.get(inflight_key)
+        owner = future is None
+        if owner:
+            future = self._inflight[inflight_key] = asyncio.get_running_loop().create_future()
         
-        for i, barcode in enumerate(barcodes, 1):
+        if not owner:
+            logger.info(f"Waiting for in-flight lookup of barcode: {barcode}")
+            self.metrics.increment("coalesced_lookups")
+            time_left = self._time_left()
             try:
-                logger.info(f"Processing barcode {i}/{len(barcodes)}: {barcode}")
-                
-                # Validate barcode format
-                if not self._is_valid_barcode(barcode):
-                    logger.warning(f"Invalid barcode format: {barcode}")
-                    continue
-                
-                # Process single barcode
-                product_data = self._process_single_barcode(barcode)
-                
-                if product_data:
-                    results.append(product_data)
-                    self.last_processed_item = product_data
-                    self.processed_barcodes.append(barcode)
-                    logger.info(f"Successfully processed barcode: {barcode}")
-                else:
-                    logger.warning(f"No data found for barcode: {barcode}")
-                    
-                # Small delay between requests to respect rate limits
-                time.sleep(self.api_request_delay)
-                
-            except Exception as e:
-                logger.error(f"Error processing barcode {barcode}: {e}")
-                continue
+                result = await asyncio.wait_for(asyncio.shield(future),
+                                                None if time_left is None else time_left + DEADLINE_GRACE)
+            except asyncio.TimeoutError:
+                return None, ["Deadline exceeded while waiting for in-flight lookup"], False
+            # Callers may modify the product, so each gets its own copy, under its own spelling
+            product, reasons, needs_enhancement, definitive = copy.deepcopy(result)
+            if product is None and not definitive and retry_inconclusive and not self._deadline_passed():
+                logger.info(f"In-flight lookup of barcode {barcode} was inconclusive, looking it up again")
+                return await self._resolve_barcode(barcode, enhance, retry_inconclusive=False)
+            return self._as_requested(product, barcode), reasons, needs_enhancement
         
-        logger.info(f"Completed processing. Found data for {len(results)} out of {len(barcodes)} barcodes")
-        return results
+        try:
+            result = await self._lookup_and_enhance(barcode, enhance)
+        except asyncio.CancelledError:
+            # The owner's batch gave up on it; waiters look it up themselves if they have time left
+            future.set_result((None, ["Lookup was cancelled"], False, False))
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # the owner raises it; waiters, if any, get it too
+            raise
+        else:
+            future.set_result(copy.deepcopy(result))
+            return result[:3]
+        finally:
+            self._inflight.pop(inflight_key, None)
 
-    def _process_single_barcode(self, barcode: str) -> Optional[Dict]:
-        """Process a single barcode and return the product data - preserving original logic."""
+    @staticmethod
+    def _as_requested(product: Optional[Dict], barcode: str) -> Optional[Dict]:
+        """
+        A product shared by GTIN (cache hit, coalesced lookup) carries the spelling of whoever
+        looked it up first; give it back under the barcode this caller asked for.
+        """
+        if product and 'Barcode' in product:
+            product['Barcode'] = barcode
+        return product
+
+    async def _lookup_and_enhance(self, barcode: str, enhance: bool) -> Tuple[Optional[Dict], List[str], bool, bool]:
+        """_resolve_barcode() without coalescing, plus whether a miss is definitive."""
         logger.info(f"Processing barcode: {barcode}")
+        cache_key = gtin_key(barcode)
+        
+        if self.cache:
+            with self._stage("cache"):
+                hit, cached = self.cache.get(cache_key, CACHE_RESULT_PROVIDER)
+            self.metrics.increment("cache_hits" if hit else "cache_misses", CACHE_RESULT_PROVIDER)
+            if hit:
+                logger.info(f"Cache hit for barcode: {barcode}")
+                return (self._as_requested(cached, barcode), [] if cached else ["Not found in any source (cached)"],
+                        False, True)
+    
+        if self.lookup_strategy == "sequential":
+            product_data, failure_reasons, definitive = await self._lookup_sequential(barcode)
+        else:
+            product_data, failure_reasons, definitive = await self._lookup_concurrent(barcode)
     
+        # If we have data, enhance it with AI
+        if product_data and product_data.get('name'):
+            logger.info(f"Found product data: {product_data.get('name')}")
+            if not enhance:
+                return product_data, [], True, True
+            product_data = await self._enhance_with_ai(product_data, barcode)
+            self._store_result(barcode, product_data)
+            return product_data, [], False, True
+        else:
+            logger.warning(f"No product information found for barcode: {barcode}")
+            if self.cache and definitive:
+                self.cache.put(cache_key, CACHE_RESULT_PROVIDER, None)
+            return None, failure_reasons, False, definitive
+
+    def _lookup_search_functions(self) -> Dict:
+        return {
+            "openfoodfacts": self._search_openfoodfacts,
+            "google": self._search_google,
+            "digiteyes": self._search_digiteyes
+        }
+
+    async def _lookup_sequential(self, barcode: str) -> Tuple[Optional[Dict], List[str], bool]:
+        """Try each lookup provider in priority order - preserving original logic."""
+        search_fns = self._lookup_search_functions()
+        
         # First try OpenFoodFacts
-        product_data = self._search_openfoodfacts(barcode)
+        product_data, definitive = await self._cached_lookup("openfoodfacts", barcode, search_fns["openfoodfacts"])
         failure_reasons = []
     
         # If not found, try Google Search
         if not product_data or not product_data.get('name'):
             logger.info(f"No data found in OpenFoodFacts, trying Google for: {barcode}")
-            failure_reasons.append("Not found in OpenFoodFacts")
-            product_data = self._search_google(barcode)
+            failure_reasons.append(LOOKUP_FAILURE_REASONS["openfoodfacts"])
+            product_data, google_definitive = await self._cached_lookup("google", barcode, search_fns["google"])
+            definitive = definitive and google_definitive
     
         # If not found, try DigiTeyes API
         if not product_data or not product_data.get('name'):
             logger.info(f"No data found in Google, trying DigiTeyes for: {barcode}")
-            failure_reasons.append("Not found in Google Search")
-            product_data = self._search_digiteyes(barcode)
-    
-        # If we have data, enhance it with AI
-        if product_data and product_data.get('name'):
-            logger.info(f"Found product data: {product_data.get('name')}")
-            product_data = self._enhance_with_ai(product_data, barcode)
-            return product_data
-        else:
-            logger.warning(f"No product information found for barcode: {barcode}")
-            failure_reasons.append("Not found in DigiTeyes")
-            return None
+            failure_reasons.append(LOOKUP_FAILURE_REASONS["google"])
+            product_data, digiteyes_definitive = await self._cached_lookup("digiteyes", barcode,
+                                                                           search_fns["digiteyes"])
+            definitive = definitive and digiteyes_definitive
+        
+        if not product_data or not product_data.get('name'):
+            failure_reasons.append(LOOKUP_FAILURE_REASONS["digiteyes"])
+            product_data = None
+        
+        return product_data, failure_reasons, definitive
+
+    async def _lookup_concurrent(self, barcode: str) -> Tuple[Optional[Dict], List[str], bool]:
+        """
+        Query lookup providers in parallel and keep the highest-priority successful answer.
+        
+        Lower-priority answers are only used once every provider above them has missed;
+        lookups still running are cancelled as soon as a winner is known.
+        """
+        search_fns = self._lookup_search_functions()
+        tasks = {}
+        
+        def launch(provider):
+            # Tasks inherit this barcode's timings and deadline
+            tasks[provider] = asyncio.ensure_future(self._cached_lookup(provider, barcode, search_fns[provider]))
+        
+        try:
+            primary = LOOKUP_PROVIDERS[0]
+            launch(primary)
+            if self.lookup_strategy == "hedged":
+                # Give the free provider a head start before spending quota on the others
+                await asyncio.wait([tasks[primary]], timeout=self._budget(self.lookup_hedge_delay))
+                if tasks[primary].done():
+                    product_data, _ = tasks[primary].result()
+                    if product_data and product_data.get('name'):
+                        return product_data, [], True
+                logger.info(f"Hedging lookup for {barcode} to remaining providers")
+            for provider in LOOKUP_PROVIDERS[1:]:
+                launch(provider)
+            
+            failure_reasons = []
+            definitive = True
+            for provider in LOOKUP_PROVIDERS:
+                time_left = self._time_left()
+                try:
+                    product_data, provider_definitive = await asyncio.wait_for(
+                        tasks[provider], None if time_left is None else time_left + DEADLINE_GRACE)
+                except asyncio.TimeoutError:
+                    product_data, provider_definitive = None, False
+                if product_data and product_data.get('name'):
+                    return product_data, failure_reasons, definitive
+                failure_reasons.append(LOOKUP_FAILURE_REASONS[provider])
+                definitive = definitive and provider_definitive
+            
+            return None, failure_reasons, definitive
+        finally:
+            for task in tasks.values():
+                task.cancel()
+
+    def _store_result(self, barcode: str, product_data: Dict):
+        """Cache a final product record. Locally formatted results are skipped so AI enhancement is retried next time."""
+        if self.cache and product_data.get('Data Source') == 'AI Enhanced':
+            self.cache.put(gtin_key(barcode), CACHE_RESULT_PROVIDER, product_data)
+
+    async def _enhance_records(self, records: List[Dict], deadline_at: float = None) -> List[Dict]:
+        """Enhance a batch of "lookup_found" records and turn them into final "found" records."""
+        items = [(record['barcode'], record.pop('lookup')) for record in records]
+        batch_timings = {}
+        started = time.monotonic()
+        timings_token = _BARCODE_TIMINGS.set(batch_timings)
+        deadline_token = _BARCODE_DEADLINE.set(deadline_at)
+        try:
+            enhanced = await self._enhance_batch_with_ai(items)
+        finally:
+            _BARCODE_TIMINGS.reset(timings_token)
+            _BARCODE_DEADLINE.reset(deadline_token)
+        batch_ms = (time.monotonic() - started) * 1000
+        for record in records:
+            record['elapsed_ms'] = round(record['elapsed_ms'] + batch_ms, 1)
+            for stage, ms in batch_timings.items():
+                record['timings'][stage] = round(record['timings'].get(stage, 0.0) + ms, 1)
+            product_data = enhanced[record['barcode']]
+            self._store_result(record['barcode'], product_data)
+            logger.info(f"Successfully processed barcode: {record['barcode']}")
+            record.update(status='found', product=product_data)
+        return records
+
+    async def _cached_lookup(self, provider: str, barcode: str, search_fn) -> Tuple[Optional[Dict], bool]:
+        """
+        Run a provider lookup through the persistent cache.
+        
+        Returns the product data and whether the answer was definitive. Lookups that
+        failed (network errors, rate limits, missing credentials) are not definitive
+        and are never negatively cached.
+        """
+        cache_key = gtin_key(barcode)
+        if self.cache:
+            hit, cached = self.cache.get(cache_key, provider)
+            self.metrics.increment("cache_hits" if hit else "cache_misses", provider)
+            if hit:
+                return cached, True
+        
+        failed_token = _LOOKUP_FAILED.set(False)
+        try:
+            with self._stage(f"lookup_{provider}"):
+                product_data = await search_fn(barcode)
+            definitive = not _LOOKUP_FAILED.get()
+        finally:
+            _LOOKUP_FAILED.reset(failed_token)
+        if not definitive:
+            self.metrics.increment("lookup_failures", provider)
+        
+        if self.cache:
+            if product_data and product_data.get('name'):
+                self.cache.put(cache_key, provider, product_data)
+            elif definitive:
+                self.cache.put(cache_key, provider, None)
+        return product_data, definitive
+
+    def _flag_lookup_failure(self):
+        """Mark the current provider lookup as failed rather than a genuine "not found"."""
+        _LOOKUP_FAILED.set(True)
 
     def _is_valid_barcode(self, barcode: str) -> bool:
-        """Check if barcode has a valid format - preserving original logic."""
+        """Check if barcode has a valid format, check digit and a product GS1 prefix."""
+        problem = self._barcode_problem(barcode)
+        if problem:
+            logger.warning(f"{problem}: {barcode}")
+        return problem is None
+
+    def _barcode_problem(self, barcode: str) -> Optional[str]:
+        """Reason a barcode can never resolve to a product, or None if it is worth looking up."""
         barcode = str(barcode).strip()
         
         # First check: must be all digits
         if not barcode.isdigit():
-            logger.warning(f"Invalid barcode (non-digits): {barcode}")
-            return False
+            return "Invalid barcode (non-digits)"
             
         # Second check: must be of valid length
         if len(barcode) not in VALID_BARCODE_LENGTHS:
-            logger.warning(f"Invalid barcode (wrong length): {barcode}")
-            return False
+            return "Invalid barcode (wrong length)"
+        
+        # Third check: GS1 check digit, catches mistyped and truncated codes before any lookup
+        if not gs1_check_digit_valid(barcode):
+            return "Invalid barcode (check digit mismatch)"
         
-        return True
+        # Coupons and refund receipts share the format but are never products
+        entry = self.gs1_index.lookup(barcode)
+        if entry and not entry.get("lookup", True):
+            return f"Invalid barcode ({entry['country']} prefix {entry['prefix']})"
+        
+        return None
 
-    def _search_openfoodfacts(self, barcode: str) -> Optional[Dict]:
+    async def _search_openfoodfacts(self, barcode: str) -> Optional[Dict]:
         """Search for barcode in OpenFoodFacts - preserving original logic."""
+        if self.off_store:
+            try:
+                product = self.off_store.get(barcode)
+                if product:
+                    self.metrics.increment("local_hits", "openfoodfacts")
+                    return self._openfoodfacts_product_data(product)
+                if self.off_local_only:
+                    return None
+            except sqlite3.Error as e:
+                logger.error(f"Error reading local OpenFoodFacts store: {e}")
+        
         try:
             url = f"{self.openfoodfacts_url}{barcode}.json"
-            response = requests.get(url, timeout=10)
+            if not await self._acquire("openfoodfacts"):
+                self._flag_lookup_failure()
+                return None
+            response = await self._http_request("openfoodfacts", "GET", url, 10)
+            if response.status_code == 429:
+                self.metrics.increment("rate_limited", "openfoodfacts")
+                self.rate_limiter.pause("openfoodfacts", retry_after_seconds(response, DEFAULT_RATE_LIMIT_BACKOFF))
+                self._flag_lookup_failure()
+                return None
             data = response.json()
             
             if data.get('status') == 1 and 'product' in data:
-                product = data['product']
-                
-                # Extract relevant information
-                product_data = {
-                    'name': product.get('product_name', ''),
-                    'brand': product.get('brands', ''),
-                    'description': product.get('generic_name', ''),
-                    'ingredients': product.get('ingredients_text', ''),
-                    'image_url': product.get('image_url', ''),
-                    'quantity': product.get('quantity', ''),
-                    'source': 'OpenFoodFacts'
-                }
-                
-                # Try to extract numbers from quantity
-                if product_data['quantity']:
-                    qty_match = re.search(r'(\d+(?:\.\d+)?)\s*(g|ml|l|kg)', product_data['quantity'].lower())
-                    if qty_match:
-                        product_data['quantity_value'] = float(qty_match.group(1))
-                        product_data['quantity_unit'] = qty_match.group(2)
-                
-                return product_data
+                return self._openfoodfacts_product_data(data['product'])
             return None
         except Exception as e:
             logger.error(f"Error in OpenFoodFacts search: {e}")
+            self._flag_lookup_failure()
             return None
 
-    def _search_google(self, barcode: str) -> Optional[Dict]:
+    def _openfoodfacts_product_data(self, product: Dict) -> Dict:
+        """Map an OpenFoodFacts product (live API or local store) to the processor's lookup fields."""
+        # Extract relevant information
+        product_data = {
+            'name': product.get('product_name', ''),
+            'brand': product.get('brands', ''),
+            'description': product.get('generic_name', ''),
+            'ingredients': product.get('ingredients_text', ''),
+            'image_url': product.get('image_url', ''),
+            'quantity': product.get('quantity', ''),
+            'source': 'OpenFoodFacts'
+        }
+        
+        # Try to extract numbers from quantity
+        if product_data['quantity']:
+            qty_match = re.search(r'(\d+(?:\.\d+)?)\s*(g|ml|l|kg)', product_data['quantity'].lower())
+            if qty_match:
+                product_data['quantity_value'] = float(qty_match.group(1))
+                product_data['quantity_unit'] = qty_match.group(2)
+        
+        return product_data
+
+    async def _search_google(self, barcode: str) -> Optional[Dict]:
         """Search for barcode on Google using Google Custom Search API - preserving original logic."""
         try:
             if not self.google_api_key or not self.google_cx:
                 logger.warning("Google API credentials not available")
+                self._flag_lookup_failure()
                 return None
             
             # First try a direct search for the barcode
             query = f"{barcode} product"
             
             # Use Google Custom Search API
-            url = GOOGLE_SEARCH_API_URL
+            url = self.google_search_url
             params = {
                 "key": self.google_api_key,
                 "cx": self.google_cx,
@@ -409,28 +2825,15 @@ class BarcodeAPIProcessor:
             logger.info(f"Searching Google for: {query}")
             
             # Add retries for API calls
-            for attempt in range(self.max_retries):
-                try:
-                    response = requests.get(url, params=params, timeout=15)
-                    if response.status_code == 200:
-                        break
-                    elif response.status_code == 429:  # Rate limit
-                        wait_time = (attempt + 1) * 5
-                        logger.warning(f"Google API rate limit hit, waiting {wait_time} seconds")
-                        time.sleep(wait_time)
-                    else:
-                        logger.warning(f"Google API error: {response.status_code} - {response.text}")
-                        break
-                except requests.exceptions.RequestException as e:
-                    logger.warning(f"Request failed: {e}")
-                    time.sleep(1)
+            response = await self._google_search_request(url, params)
             
-            if response.status_code != 200:
-                logger.error(f"Google API error after retries: {response.status_code} - {response.text}")
+            if response is None or response.status_code != 200:
+                if response is not None:
+                    logger.error(f"Google API error after retries: {response.status_code} - {response.text}")
+                self._flag_lookup_failure()
                 return None
                 
             data = response.json()
-            time.sleep(self.api_request_delay)  # Respect rate limits
             
             # Extract search results
             search_results = []
@@ -454,7 +2857,7 @@ class BarcodeAPIProcessor:
                 logger.info(f"No good results, trying alternate search for barcode {barcode}")
                 
                 # Try specific phrases for Indian products
-                if barcode.startswith('890'):
+                if self.gs1_index.country(barcode) == 'India':
                     alternate_query = f"{barcode} indian product description"
                 else:
                     alternate_query = f"{barcode} product details"
@@ -462,23 +2865,9 @@ class BarcodeAPIProcessor:
                 params['q'] = alternate_query
                 
                 # Retry mechanism for alternate search
-                for attempt in range(self.max_retries):
-                    try:
-                        response = requests.get(url, params=params, timeout=15)
-                        if response.status_code == 200:
-                            break
-                        elif response.status_code == 429:  # Rate limit
-                            wait_time = (attempt + 1) * 5
-                            logger.warning(f"Google API rate limit hit, waiting {wait_time} seconds")
-                            time.sleep(wait_time)
-                        else:
-                            logger.warning(f"Google API error: {response.status_code} - {response.text}")
-                            break
-                    except requests.exceptions.RequestException as e:
-                        logger.warning(f"Request failed: {e}")
-                        time.sleep(1)
+                response = await self._google_search_request(url, params)
                 
-                if response.status_code == 200:
+                if response is not None and response.status_code == 200:
                     data = response.json()
                     
                     # Extract from alternate search
@@ -493,8 +2882,6 @@ class BarcodeAPIProcessor:
                                 'snippet': snippet,
                                 'link': link
                             })
-                
-                time.sleep(self.api_request_delay)  # Respect rate limits
             
             # Extract product information from search results
             if search_results:
@@ -550,16 +2937,48 @@ class BarcodeAPIProcessor:
             return None
         except Exception as e:
             logger.error(f"Error in Google search: {e}")
+            self._flag_lookup_failure()
             return None
 
-    def _search_digiteyes(self, barcode: str) -> Optional[Dict]:
+    async def _google_search_request(self, url: str, params: Dict) -> Optional[HTTPResponse]:
+        """Send a Google Custom Search request, retrying on rate limits and transport errors."""
+        response = None
+        for attempt in range(self.max_retries):
+            if attempt:
+                self.metrics.increment("retries", "google")
+            if not await self._acquire("google"):
+                break
+            try:
+                response = await self._http_request("google", "GET", url, 15, params=params)
+                if response.status_code == 200:
+                    break
+                elif response.status_code == 429:  # Rate limit
+                    self.metrics.increment("rate_limited", "google")
+                    wait_time = retry_after_seconds(response, (attempt + 1) * DEFAULT_RATE_LIMIT_BACKOFF)
+                    time_left = self._time_left()
+                    if time_left is not None and wait_time >= time_left:
+                        logger.warning(f"Google API rate limit hit, {wait_time:.1f}s wait exceeds the deadline")
+                        self.rate_limiter.pause("google", wait_time)
+                        break
+                    logger.warning(f"Google API rate limit hit, waiting {wait_time:.1f} seconds")
+                    self.rate_limiter.pause("google", wait_time)
+                else:
+                    logger.warning(f"Google API error: {response.status_code} - {response.text}")
+                    break
+            except aiohttp.ClientError as e:
+                logger.warning(f"Request failed: {e}")
+                await asyncio.sleep(self._budget(1))
+        return response
+
+    async def _search_digiteyes(self, barcode: str) -> Optional[Dict]:
         """Search for barcode using DigiTeyes API - preserving original logic."""
         try:
             if not self.digiteyes_app_key or not self.digiteyes_signature:
                 logger.warning("DigiTeyes API credentials not available")
+                self._flag_lookup_failure()
                 return None
             
-            url = DIGITEYES_API_URL
+            url = self.digiteyes_url
             params = {
                 "upcCode": barcode,
                 "app_key": self.digiteyes_app_key,
@@ -568,7 +2987,16 @@ class BarcodeAPIProcessor:
             }
             
             logger.info(f"Searching DigiTeyes for barcode: {barcode}")
-            response = requests.get(url, params=params, timeout=10)
+            if not await self._acquire("digiteyes"):
+                self._flag_lookup_failure()
+                return None
+            response = await self._http_request("digiteyes", "GET", url, 10, params=params)
+            
+            if response.status_code == 429:
+                self.metrics.increment("rate_limited", "digiteyes")
+                self.rate_limiter.pause("digiteyes", retry_after_seconds(response, DEFAULT_RATE_LIMIT_BACKOFF))
+                self._flag_lookup_failure()
+                return None
             
             if response.status_code == 200:
                 data = response.json()
@@ -592,317 +3020,396 @@ class BarcodeAPIProcessor:
                             product_data['quantity_unit'] = qty_match.group(2).lower()
                     
                     return product_data
+            elif response.status_code != 404:
+                logger.warning(f"DigiTeyes API error: {response.status_code}")
+                self._flag_lookup_failure()
             
             return None
         except Exception as e:
             logger.error(f"Error in DigiTeyes search: {e}")
+            self._flag_lookup_failure()
             return None
 
     def clean_and_parse_json(self, text):
-        """Clean and parse potentially malformed JSON from AI responses - preserving original logic."""
-        # First, try to extract JSON block if embedded in other text
-        json_match = re.search(JSON_CODEBLOCK_PATTERN, text, re.DOTALL)
-        if json_match:
-            text = json_match.group(1)
-        else:
-            # Try to find JSON between curly braces
-            json_start = text.find('{')
-            json_end = text.rfind('}') + 1
-            if json_start >= 0 and json_end > json_start:
-                text = text[json_start:json_end]
-        
-        # Try direct parsing first
-        try:
-            return json.loads(text)
-        except json.JSONDecodeError:
-            pass
-        
-        # Fix unquoted property names (the error you're specifically seeing)
-        fixed_text = re.sub(JSON_UNQUOTED_PROPERTY_PATTERN, r'\1"\2":', text)
-        
-        # Fix trailing commas in lists and objects
-        fixed_text = re.sub(JSON_TRAILING_COMMA_PATTERN, r'\1', fixed_text)
-        
-        # Fix missing commas between elements
-        fixed_text = re.sub(JSON_MISSING_COMMA_PATTERN, r'\1,\n\2', fixed_text)
-        
-        # Try parsing the fixed JSON
-        try:
-            return json.loads(fixed_text)
-        except json.JSONDecodeError:
-            # If still failing, try a more aggressive approach
-            # Fix single quotes to double quotes
-            fixed_text = fixed_text.replace("'", '"')
-            # Fix missing quotes around string values
-            fixed_text = re.sub(JSON_UNQUOTED_VALUE_PATTERN, r': "\1"\2', fixed_text)
-            
-            try:
-                return json.loads(fixed_text)
-            except json.JSONDecodeError as e:
-                # Last resort, log the error and return None
-                logger.error(f"Failed to parse JSON after cleanup: {e}")
-                logger.debug(f"Problematic text: {text}")
-                return None
+        """Clean and parse potentially malformed JSON from AI responses (single-pass tolerant scanner)."""
+        parsed = parse_llm_json(text)
+        if parsed is None:
+            logger.error("Failed to parse JSON from AI response")
+            logger.debug(f"Problematic text: {text}")
+        return parsed
+
+    @property
+    def ai_service_status(self) -> Dict:
+        """Per-service circuit breaker state (state, working, failures, cool-down)."""
+        return {service: breaker.snapshot() for service, breaker in self.ai_breakers.items()}
 
-    def _enhance_with_ai(self, product_data: Dict, barcode: str) -> Dict:
+    def _ai_available(self) -> bool:
+        """Whether at least one AI service currently accepts requests and the deadline leaves time for it."""
+        time_left = self._time_left()
+        if time_left is not None and time_left < AI_MIN_TIME_LEFT:
+            return False
+        return any(breaker.is_available() for breaker in self.ai_breakers.values())
+
+    async def _enhance_with_ai(self, product_data: Dict, barcode: str) -> Dict:
         """Enhance product data using AI, with fallback to local processing - preserving original logic."""
+        # A variant of an already enhanced product reuses that result without an LLM call
+        reused = self._cached_enhancement(product_data, barcode)
+        if reused:
+            return reused
+        
         # Skip AI if all services have had multiple failures
-        if (not self.ai_service_status["gemini"]["working"] and
-            not self.ai_service_status["openai"]["working"] and 
-            not self.ai_service_status["deepseek"]["working"]):
-            logger.info("All AI services are disabled due to repeated failures, using local processing")
-            return self._intelligent_format_product_data(product_data, barcode)
+        if not self._ai_available():
+            logger.info("No AI service available (circuits open or deadline near), using local processing")
+            return self._format_locally(product_data, barcode)
         
         try:
             # Prepare data for AI enhancement
-            context = json.dumps(product_data, indent=2)
-            
-            prompt = AI_ENHANCEMENT_PROMPT_TEMPLATE.format(barcode=barcode, context=context)
-            
-            # Try AI enhancement with fixed error handling
-            response = None
-            
-            # Try Gemini first (primary AI service)
-            if self.ai_service_status["gemini"]["working"]:
-                logger.info("Enhancing product data with Gemini API")
-                response = self._call_gemini_api(prompt)
-                
-                # If Gemini failed 3 times in a row, mark it as not working
-                if not response and self.ai_service_status["gemini"]["failures"] >= 3:
-                    logger.warning("Gemini API marked as unavailable after repeated failures")
-                    self.ai_service_status["gemini"]["working"] = False
+            with self._stage("prompt_build"):
+                context = minified_json(compact_prompt_context(product_data, self.ai_prompt_token_budget))
+                prompt = AI_ENHANCEMENT_PROMPT_TEMPLATE.format(barcode=barcode, context=context)
             
-            # If Gemini failed, try OpenAI if it's still working
-            if not response and self.ai_service_status["openai"]["working"]:
-                logger.info("Gemini enhancement failed, trying OpenAI")
-                response = self._call_openai_api(prompt)
-                
-                # If OpenAI failed 3 times in a row, mark it as not working
-                if not response and self.ai_service_status["openai"]["failures"] >= 3:
-                    logger.warning("OpenAI API marked as unavailable after repeated failures")
-                    self.ai_service_status["openai"]["working"] = False
-            
-            # If OpenAI failed or is marked as not working, try DeepSeek
-            if not response and self.ai_service_status["deepseek"]["working"]:
-                logger.info("OpenAI enhancement failed, trying DeepSeek")
-                response = self._call_deepseek_api(prompt)
-                
-                # If DeepSeek failed 3 times in a row, mark it as not working
-                if not response and self.ai_service_status["deepseek"]["failures"] >= 3:
-                    logger.warning("DeepSeek API marked as unavailable after repeated failures")
-                    self.ai_service_status["deepseek"]["working"] = False
+            # Structured-output request; replies are parsed and validated against AI_PRODUCT_SCHEMA
+            enhanced_data = await self._request_ai_json(prompt)
             
-            if response:
-                try:
-                    # Use the improved JSON parser (now a class method)
-                    enhanced_data = self.clean_and_parse_json(response)
-                    
-                    if enhanced_data and 'Product Name' in enhanced_data and enhanced_data['Product Name']:
-                        # Add timestamps and image info
-                        enhanced_data['Product Image'] = product_data.get('image_url', '')
-                        enhanced_data['Product Ingredient Image'] = product_data.get('ingredient_image', '')
-                        enhanced_data['Data Source'] = 'AI Enhanced'
-                        enhanced_data['Timestamp'] = datetime.now().isoformat()
-                        enhanced_data['Barcode'] = barcode
-                        
-                        logger.info("Successfully enhanced product data with AI")
-                        return enhanced_data
-                except Exception as e:
-                    logger.error(f"Error parsing AI response: {e}")
+            if enhanced_data:
+                logger.info("Successfully enhanced product data with AI")
+                if self.enhancement_cache:
+                    self.enhancement_cache.put(product_data, enhanced_data)
+                return self._finalize_enhanced_data(enhanced_data, product_data, barcode)
             
             # If AI fails, use intelligent local processing
             logger.info("AI enhancement failed, using intelligent local processing")
-            return self._intelligent_format_product_data(product_data, barcode)
+            return self._format_locally(product_data, barcode)
             
         except Exception as e:
             logger.error(f"Error enhancing product data with AI: {e}")
+            return self._format_locally(product_data, barcode)
+
+    def _format_locally(self, product_data: Dict, barcode: str) -> Dict:
+        """Timed fallback to local formatting when AI enhancement is unavailable or failed."""
+        self.metrics.increment("ai_fallbacks")
+        with self._stage("formatting"):
             return self._intelligent_format_product_data(product_data, barcode)
 
-    def _call_gemini_api(self, prompt: str) -> Optional[str]:
-        """Call Google Gemini API with updated model name - preserving original logic."""
-        try:
-            # Skip if this service is marked as not working
-            if not self.ai_service_status["gemini"]["working"]:
-                return None
-            
-            if not self.gemini_api_key:
-                return None
-            
-            # Updated URL and model name
-            url = GEMINI_API_URL
-            params = {
-                "key": self.gemini_api_key
-            }
-            data = {
-                "contents": [
-                    {
-                        "parts": [{"text": prompt}]
-                    }
-                ],
-                "generationConfig": {
-                    "temperature": AI_TEMPERATURE,
-                    "maxOutputTokens": GEMINI_MAX_TOKENS
-                }
-            }
+    async def _enhance_batch_with_ai(self, items: List[Tuple[str, Dict]]) -> Dict[str, Dict]:
+        """
+        Enhance several products with a single AI request.
+        
+        Args:
+            items: List of (barcode, product_data) pairs
             
+        Returns:
+            Dictionary mapping each barcode to its final product record. Products the
+            model dropped or garbled are enhanced again with individual requests.
+        """
+        enhanced = {}
+        for barcode, product_data in items:
+            reused = self._cached_enhancement(product_data, barcode)
+            if reused:
+                enhanced[barcode] = reused
+        items = [(barcode, product_data) for barcode, product_data in items if barcode not in enhanced]
+        
+        if len(items) > 1 and self._ai_available():
             try:
-                response = requests.post(url, params=params, json=data, timeout=30)
+                with self._stage("prompt_build"):
+                    context = minified_json([
+                        {"barcode": barcode, "data": compact_prompt_context(product_data, self.ai_prompt_token_budget)}
+                        for barcode, product_data in items
+                    ])
+                    prompt = AI_BATCH_ENHANCEMENT_PROMPT_TEMPLATE.format(count=len(items), context=context)
+                max_tokens = min(AI_BATCH_MAX_OUTPUT_TOKENS, GEMINI_MAX_TOKENS * len(items))
                 
-                if response.status_code == 200:
-                    self.ai_service_status["gemini"]["failures"] = 0
-                    response_json = response.json()
-                    
-                    if 'candidates' in response_json and len(response_json['candidates']) > 0:
-                        content = response_json['candidates'][0].get('content', {})
-                        parts = content.get('parts', [])
-                        if parts and 'text' in parts[0]:
-                            return parts[0]['text']
-                    
-                    logger.warning("Unexpected response format from Gemini API")
-                    self.ai_service_status["gemini"]["failures"] += 1
-                    return None
-                else:
-                    logger.warning(f"Gemini API error: {response.status_code} - {response.text}")
-                    self.ai_service_status["gemini"]["failures"] += 1
-                    return None
-                    
-            except requests.exceptions.RequestException as e:
-                logger.error(f"Gemini request failed: {e}")
-                self.ai_service_status["gemini"]["failures"] += 1
-                return None
+                logger.info(f"Enhancing {len(items)} products with one batched AI request")
+                parsed = await self._request_ai_json(prompt, max_tokens, AI_BATCH_SCHEMA, AI_BATCH_ENVELOPE_SCHEMA,
+                                                     AI_BATCH_SYSTEM_PROMPT)
+                entries = parsed['products'] if parsed else []
                 
-        except Exception as e:
-            logger.error(f"Error calling Gemini API: {e}")
-            self.ai_service_status["gemini"]["failures"] += 1
+                entry_schema = AI_BATCH_SCHEMA["properties"]["products"]["items"]
+                product_lookup = dict(items)
+                for entry in entries:
+                    if schema_errors(coerce_to_schema(entry, entry_schema), entry_schema):
+                        continue
+                    barcode = str(entry.pop('Barcode', '')).strip()
+                    if barcode in product_lookup and barcode not in enhanced and entry.get('Product Name'):
+                        if self.enhancement_cache:
+                            self.enhancement_cache.put(product_lookup[barcode], entry)
+                        enhanced[barcode] = self._finalize_enhanced_data(entry, product_lookup[barcode], barcode)
+                
+                logger.info(f"Batched AI request enhanced {len(enhanced)} of {len(items)} products")
+            except Exception as e:
+                logger.error(f"Error in batched AI enhancement: {e}")
+        
+        # Fall back to one request per product for anything the batch did not cover
+        for barcode, product_data in items:
+            if barcode not in enhanced:
+                enhanced[barcode] = await self._enhance_with_ai(product_data, barcode)
+        return enhanced
+
+    def _cached_enhancement(self, product_data: Dict, barcode: str) -> Optional[Dict]:
+        """
+        Record built from a cached enhancement of a variant of this product, or None. Category,
+        subcategory, features and the product-line part of the specification are reused; name,
+        brand, description, quantity and the barcode-specific specification entries come from
+        the product itself, formatted the same way as a record without AI.
+        """
+        if not self.enhancement_cache:
             return None
+        with self._stage("enhancement_cache"):
+            cached = self.enhancement_cache.lookup(product_data)
+        self.metrics.increment("cache_hits" if cached else "cache_misses", CACHE_ENHANCEMENT_PROVIDER)
+        if not cached:
+            return None
+        
+        record = self._intelligent_format_product_data(product_data, barcode)
+        quantity = record.get('Quantity')
+        if isinstance(quantity, float) and quantity.is_integer():
+            # Whole numbers as the AI path returns them: 280 g, not 280.0 g
+            record['Quantity'] = int(quantity)
+            for field in ('Weight/Volume', 'Net Quantity'):
+                if field in record['Specification']:
+                    record['Specification'][field] = f"{int(quantity)} {record['Unit']}"
+        for field in ENHANCEMENT_REUSED_FIELDS:
+            if field in cached and field != 'Specification':
+                record[field] = copy.deepcopy(cached[field])
+        specification = dict(cached.get('Specification') or {})
+        for field in ENHANCEMENT_PRODUCT_SPECIFICATION_FIELDS:
+            specification.pop(field, None)
+        specification.update({field: value for field, value in record['Specification'].items()
+                              if field in ENHANCEMENT_PRODUCT_SPECIFICATION_FIELDS})
+        record['Specification'] = specification
+        subcategory = record.get('Subcategory')
+        record['ProductLine'] = f"{record['Brand']} {subcategory} Products" if subcategory else f"{record['Brand']} Products"
+        
+        logger.info(f"Reusing cached AI enhancement for {barcode} ({record['Product Name']})")
+        record = self._finalize_enhanced_data(record, product_data, barcode)
+        record['Data Source'] = 'AI Enhanced (cached)'
+        return record
+
+    def _finalize_enhanced_data(self, enhanced_data: Dict, product_data: Dict, barcode: str) -> Dict:
+        """Attach image, source and timestamp fields to an AI-enhanced product record."""
+        # Add timestamps and image info
+        enhanced_data['Product Image'] = product_data.get('image_url', '')
+        enhanced_data['Product Ingredient Image'] = product_data.get('ingredient_image', '')
+        enhanced_data['Data Source'] = 'AI Enhanced'
+        enhanced_data['Timestamp'] = datetime.now().isoformat()
+        enhanced_data['Barcode'] = barcode
+        return enhanced_data
+
+    async def _request_ai_json(self, prompt: str, max_tokens: int = None, schema: Dict = AI_PRODUCT_SCHEMA,
+                               validation_schema: Dict = None, system_prompt: str = AI_SYSTEM_PROMPT):
+        """
+        Send a prompt to the AI backends in the order chosen by the router (by default the one with
+        the best recent latency, success rate and cost first) in structured-output mode, and return
+        the first reply that parses and matches the schema, or None.
+        """
+        candidates = [service for service in AI_SERVICES
+                      if self.ai_backends[service].api_key and self.ai_breakers[service].is_available()]
+        ordered = self.ai_router.order(candidates)
+        request = (prompt, max_tokens, schema, validation_schema or schema, system_prompt)
+        if self.ai_hedging and len(ordered) > 1:
+            return await self._request_ai_json_hedged(ordered, request)
+        
+        for attempt, service in enumerate(ordered):
+            if attempt:
+                logger.info(f"AI enhancement failed, trying {self.ai_backends[service].label}")
+            else:
+                logger.info(f"Enhancing product data with {self.ai_backends[service].label} API")
+            parsed = await self._ai_attempt(service, *request)
+            if parsed is not None:
+                return parsed
+        return None
 
-    def _call_openai_api(self, prompt: str) -> Optional[str]:
-        """Call OpenAI API with better error handling - preserving original logic."""
+    async def _request_ai_json_hedged(self, ordered: List[str], request: Tuple):
+        """
+        Hedged variant of _request_ai_json: the next backend is started when the current one fails,
+        or, within the hedge budget, when it has been running for its hedge delay. The first valid
+        answer wins; a losing request is left to finish in the background and only updates the router.
+        """
+        pending = {}
+        remaining = list(ordered)
+        
+        def launch():
+            service = remaining.pop(0)
+            # Tasks start right away (there is no pool to queue in), so the hedge delay runs from here
+            pending[asyncio.ensure_future(self._ai_attempt(service, *request))] = service
+            return service
+        
+        primary = launch()
+        logger.info(f"Enhancing product data with {self.ai_backends[primary].label} API (hedged)")
+        self.ai_hedge_budget.record_request()
+        hedge_at = time.monotonic() + self._ai_hedge_delay(primary)
+        hedged = False
+        
         try:
-            if not self.ai_service_status["openai"]["working"]:
-                return None
-            
-            if not self.openai_api_key:
-                return None
-            
-            url = OPENAI_API_URL
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {self.openai_api_key}"
-            }
-            data = {
-                "model": OPENAI_MODEL,
-                "messages": [
-                    {"role": "system", "content": "You are a product data specialist who extracts and formats product information."},
-                    {"role": "user", "content": prompt}
-                ],
-                "temperature": AI_TEMPERATURE,
-                "max_tokens": OPENAI_MAX_TOKENS
-            }
-            
-            try:
-                response = requests.post(url, headers=headers, json=data, timeout=30)
-                
-                if response.status_code == 200:
-                    self.ai_service_status["openai"]["failures"] = 0
-                    return response.json()["choices"][0]["message"]["content"]
-                
-                # Better error handling
-                if response.status_code == 429:
-                    error_data = response.json().get('error', {})
-                    error_type = error_data.get('type', '')
-                    
-                    if 'insufficient_quota' in error_type:
-                        logger.warning("OpenAI API quota exceeded - marking as unavailable")
-                        self.ai_service_status["openai"]["working"] = False
-                    else:
-                        logger.warning(f"OpenAI API rate limited: {error_data.get('message', 'Unknown error')}")
-                    
-                    self.ai_service_status["openai"]["failures"] += 1
-                    return None
-                
-                elif response.status_code == 401:
-                    logger.error("OpenAI API authentication failed - check API key")
-                    self.ai_service_status["openai"]["working"] = False
-                    return None
-                
-                else:
-                    logger.warning(f"OpenAI API error: {response.status_code} - {response.text}")
-                    self.ai_service_status["openai"]["failures"] += 1
+            while pending:
+                time_left = self._time_left()
+                timeout = None if time_left is None else time_left + DEADLINE_GRACE
+                if not hedged and remaining:
+                    timeout = max(0.0, hedge_at - time.monotonic()) if timeout is None else \
+                        min(timeout, max(0.0, hedge_at - time.monotonic()))
+                done, _ = await asyncio.wait(list(pending), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    service = pending.pop(task)
+                    parsed = task.result()
+                    if parsed is not None:
+                        if hedged:
+                            self.metrics.increment("ai_hedge_wins", service)
+                        return parsed
+                if done:
+                    # Plain failover: the attempt failed outright, so move on without touching the budget
+                    if not pending and remaining:
+                        logger.info(f"AI enhancement failed, trying {self.ai_backends[remaining[0]].label}")
+                        primary = launch()
+                        hedge_at = time.monotonic() + self._ai_hedge_delay(primary)
+                    continue
+                if self._deadline_passed():
                     return None
-                
-            except requests.exceptions.RequestException as e:
-                logger.error(f"OpenAI request failed: {e}")
-                self.ai_service_status["openai"]["failures"] += 1
-                return None
-                
-        except Exception as e:
-            logger.error(f"Error calling OpenAI API: {e}")
-            self.ai_service_status["openai"]["failures"] += 1
+                if hedged or not remaining:
+                    continue
+                hedged = True
+                if self.ai_hedge_budget.try_spend():
+                    service = launch()
+                    self.metrics.increment("ai_hedges", service)
+                    logger.info(f"{self.ai_backends[primary].label} slow, hedging AI request to "
+                                f"{self.ai_backends[service].label}")
+            return None
+        finally:
+            for task in pending:
+                self._background_tasks.add(task)
+                task.add_done_callback(self._background_tasks.discard)
+
+    def _ai_hedge_delay(self, service: str) -> float:
+        """How long the first backend gets before a hedge is sent: its recent latency percentile."""
+        latency = self.ai_router.latency_percentile(service, self.ai_hedge_percentile)
+        if latency is None:
+            return DEFAULT_AI_HEDGE_DELAY
+        return min(DEFAULT_AI_REQUEST_TIMEOUT, max(self.ai_hedge_min_delay, latency))
+
+    async def _ai_attempt(self, service: str, prompt: str, max_tokens: Optional[int], schema: Dict,
+                          validation_schema: Dict, system_prompt: str):
+        """One timed request to one backend: parsed and validated reply or None, recorded with the router."""
+        backend = self.ai_backends[service]
+        started = time.monotonic()
+        with self._stage(f"llm_{service}"):
+            parsed = await self._call_ai_backend(service, prompt, max_tokens or backend.max_tokens, schema,
+                                                 system_prompt, validation_schema)
+        self.metrics.increment("llm_calls" if parsed is not None else "llm_failures", service)
+        self.ai_router.record(service, time.monotonic() - started, parsed is not None)
+        return parsed
+
+    def _parse_ai_response(self, response: Optional[str], schema: Dict, service: str):
+        """Parse a model reply and check it against the schema; None (counted as llm_invalid) if unusable."""
+        if not response:
             return None
+        if self.ai_reply_log:
+            self._log_ai_reply(service, response)
+        with self._stage("json_repair"):
+            parsed = self.clean_and_parse_json(response)
+        # Some models answer a batch with the bare list of products
+        if isinstance(parsed, list) and "products" in schema.get("properties", {}):
+            parsed = {"products": parsed}
+        if parsed is not None:
+            parsed = coerce_to_schema(parsed, schema)
+        errors = schema_errors(parsed, schema) if parsed is not None else ["unparseable reply"]
+        if errors:
+            logger.warning(f"Discarding {service} reply that does not match the schema: {'; '.join(errors[:5])}")
+            self.metrics.increment("llm_invalid", service)
+            return None
+        return parsed
+
+    def _log_ai_reply(self, service: str, response: str):
+        try:
+            line = json.dumps({"service": service, "reply": response, "timestamp": datetime.now().isoformat()})
+            with self._ai_reply_log_lock, open(self.ai_reply_log, 'a', encoding='utf-8') as log_file:
+                log_file.write(line + "\n")
+        except OSError as e:
+            logger.warning(f"Could not write AI reply log {self.ai_reply_log}: {e}")
+
+    def _record_token_usage(self, service: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0):
+        """Count the tokens an AI call reported (prompt, completion and the cached part of the prompt)."""
+        self.metrics.increment("llm_prompt_tokens", service, prompt_tokens or 0)
+        self.metrics.increment("llm_completion_tokens", service, completion_tokens or 0)
+        self.ai_router.record_usage(service, prompt_tokens or 0, completion_tokens or 0)
+        if cached_tokens:
+            self.metrics.increment("llm_cached_prompt_tokens", service, cached_tokens)
+        logger.info(f"{service} tokens: prompt={prompt_tokens} (cached {cached_tokens or 0}), completion={completion_tokens}")
 
-    def _call_deepseek_api(self, prompt: str) -> Optional[str]:
-        """Call DeepSeek API with better balance checking - preserving original logic."""
+    async def _call_ai_backend(self, service: str, prompt: str, max_tokens: int, schema: Dict = None,
+                               system_prompt: str = AI_SYSTEM_PROMPT, validation_schema: Dict = None):
+        """
+        Send one request to an AI backend under its rate limit and circuit breaker. Returns the reply
+        text, or with validation_schema the parsed and validated reply. The breaker only records a
+        success for a usable reply; an empty or (with validation_schema) invalid one is a failure.
+        """
+        backend = self.ai_backends[service]
+        breaker = self.ai_breakers[service]
         try:
-            if not self.ai_service_status["deepseek"]["working"]:
+            if not backend.api_key:
                 return None
             
-            if not self.deepseek_api_key:
+            # Wait for the rate limiter before claiming a (possibly half-open probe) slot
+            if not await self._acquire(service):
+                return None
+            
+            # Skip if the circuit is open (or a half-open probe is already running)
+            if not breaker.allow_request():
                 return None
-                
-            url = DEEPSEEK_API_URL
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {self.deepseek_api_key}"
-            }
-            data = {
-                "model": DEEPSEEK_MODEL,
-                "messages": [
-                    {"role": "system", "content": "You are a product data specialist who extracts and formats product information."},
-                    {"role": "user", "content": prompt}
-                ],
-                "temperature": AI_TEMPERATURE,
-                "max_tokens": DEEPSEEK_MAX_TOKENS
-            }
             
+            request = backend.build_request(prompt, max_tokens, schema if self.ai_structured_output else None,
+                                            system_prompt)
             try:
-                response = requests.post(url, headers=headers, json=data, timeout=30)
+                response = await self._http_request(service, "POST", backend.url, DEFAULT_AI_REQUEST_TIMEOUT,
+                                                    **request)
                 
                 if response.status_code == 200:
-                    self.ai_service_status["deepseek"]["failures"] = 0
-                    return response.json()["choices"][0]["message"]["content"]
-                
-                # Better error handling for payment issues
-                elif response.status_code == 402:
-                    logger.warning("DeepSeek API insufficient balance - marking as unavailable")
-                    self.ai_service_status["deepseek"]["working"] = False
-                    return None
-                
-                elif response.status_code == 401:
-                    logger.error("DeepSeek API authentication failed - check API key")
-                    self.ai_service_status["deepseek"]["working"] = False
-                    return None
+                    text, tokens = backend.parse_reply(response.json())
+                    self._record_token_usage(service, *tokens)
+                    if not text:
+                        logger.warning(f"Unexpected response format from {backend.label} API")
+                        breaker.record_failure()
+                        return None
+                    reply = text if validation_schema is None else self._parse_ai_response(text, validation_schema,
+                                                                                            service)
+                    if reply is None:
+                        breaker.record_failure()
+                        return None
+                    breaker.record_success()
+                    return reply
                 
-                elif response.status_code == 429:
-                    logger.warning("DeepSeek API rate limited")
-                    self.ai_service_status["deepseek"]["failures"] += 1
-                    return None
+                hard, message = backend.classify_error(response)
+                if response.status_code == 429:
+                    self.metrics.increment("rate_limited", service)
+                    if not hard:
+                        self.rate_limiter.pause(service, retry_after_seconds(response, DEFAULT_RATE_LIMIT_BACKOFF))
+                logger.warning(f"{backend.label} API error: {message}")
+                breaker.record_failure(hard=hard)
+                return None
                 
-                else:
-                    logger.error(f"DeepSeek API error: {response.status_code} - {response.text}")
-                    self.ai_service_status["deepseek"]["failures"] += 1
-                    return None
-                    
-            except requests.exceptions.RequestException as e:
-                logger.error(f"DeepSeek request failed: {e}")
-                self.ai_service_status["deepseek"]["failures"] += 1
+            except aiohttp.ClientError as e:
+                logger.error(f"{backend.label} request failed: {e}")
+                breaker.record_failure()
                 return None
             
         except Exception as e:
-            logger.error(f"Error calling DeepSeek API: {e}")
-            self.ai_service_status["deepseek"]["failures"] += 1
+            logger.error(f"Error calling {backend.label} API: {e}")
+            breaker.record_failure()
             return None
 
+    async def _call_gemini_api(self, prompt: str, max_tokens: int = GEMINI_MAX_TOKENS, schema: Dict = None,
+                               system_prompt: str = AI_SYSTEM_PROMPT) -> Optional[str]:
+        """Call Google Gemini API (see GeminiBackend)."""
+        return await self._call_ai_backend("gemini", prompt, max_tokens, schema, system_prompt)
+
+    async def _call_openai_api(self, prompt: str, max_tokens: int = OPENAI_MAX_TOKENS, schema: Dict = None,
+                               system_prompt: str = AI_SYSTEM_PROMPT) -> Optional[str]:
+        """Call OpenAI API (see OpenAIChatBackend)."""
+        return await self._call_ai_backend("openai", prompt, max_tokens, schema, system_prompt)
+
+    async def _call_deepseek_api(self, prompt: str, max_tokens: int = DEEPSEEK_MAX_TOKENS, schema: Dict = None,
+                                 system_prompt: str = AI_SYSTEM_PROMPT) -> Optional[str]:
+        """Call DeepSeek API (see OpenAIChatBackend)."""
+        return await self._call_ai_backend("deepseek", prompt, max_tokens, schema, system_prompt)
+
     def _intelligent_format_product_data(self, product_data: Dict, barcode: str) -> Dict:
         """Intelligently format product data without AI, using improved pattern recognition - preserving original logic."""
         
@@ -921,20 +3428,14 @@ class BarcodeAPIProcessor:
         # Combine all text for analysis
         full_text = f"{name} {description} {search_text}".lower()
         
-        # Detect category with improved algorithm
-        category = 'Other'
-        subcategory = ''
-        
-        for cat, keywords in CATEGORY_KEYWORDS.items():
-            if any(keyword in full_text for keyword in keywords):
-                category = cat
-                break
+        # Detect category, subcategory, quantity and unit in one pass over the text
+        category, subcategory, quantity, unit = PRODUCT_CLASSIFIER.classify(full_text)
         
-        # Detect subcategory with improved search
-        for keyword, subcat in SUBCATEGORY_MAP.items():
-            if keyword in full_text:
-                subcategory = subcat
-                break
+        # Fall back to the category known for the barcode's GS1 company prefix
+        gs1_entry = self.gs1_index.lookup(barcode) or {}
+        if category == 'Other' and gs1_entry.get('category'):
+            category = gs1_entry['category']
+            subcategory = subcategory or gs1_entry.get('subcategory', '')
         
         # Extract brand if not already present
         if not brand and name:
@@ -942,62 +3443,6 @@ class BarcodeAPIProcessor:
             if len(words) > 1:
                 brand = words[0]
         
-        # Extract quantity and unit with more comprehensive patterns
-        quantity = 0
-        unit = ""
-        
-        # Enhanced patterns for finding quantity and unit
-        for pattern in QUANTITY_PATTERNS:
-            # Search in full text first
-            match = re.search(pattern, full_text)
-            if match:
-                if len(match.groups()) == 1:
-                    quantity = float(match.group(1))
-                    
-                    # Determine unit based on pattern
-                    if 'g' in pattern:
-                        unit = 'g'
-                    elif 'ml' in pattern:
-                        unit = 'ml'
-                    elif 'kg' in pattern:
-                        unit = 'kg'
-                    elif 'l' in pattern:
-                        unit = 'l'
-                    elif 'pc' in pattern or 'piece' in pattern:
-                        unit = 'pc'
-                        
-                elif len(match.groups()) == 3:  # For patterns like "2 x 500g"
-                    quantity = float(match.group(1)) * float(match.group(2))
-                    unit = match.group(3)
-                    
-                break
-        
-        # If no match found, try more general numeric extraction
-        if quantity == 0:
-            # Look for specific numbers followed by weight units
-            weight_matches = re.findall(r'(\d+)\s*(?:g|gm|gram|ml|l|kg)', full_text)
-            if weight_matches:
-                # Use the first found weight
-                quantity = float(weight_matches[0])
-                
-                # Try to determine unit from context
-                if f"{quantity} g" in full_text or f"{quantity}g" in full_text:
-                    unit = 'g'
-                elif f"{quantity} ml" in full_text or f"{quantity}ml" in full_text:
-                    unit = 'ml'
-                elif f"{quantity} kg" in full_text or f"{quantity}kg" in full_text:
-                    unit = 'kg'
-                elif f"{quantity} l" in full_text or f"{quantity}l" in full_text:
-                    unit = 'l'
-        
-        # Look for specifically formatted weight patterns common in product listings
-        if quantity == 0 and unit == "":
-            # Search for weight in common formats like "500 Gm"
-            weight_gm_match = re.search(r'(\d+)\s*Gm\b', full_text, re.IGNORECASE)
-            if weight_gm_match:
-                quantity = float(weight_gm_match.group(1))
-                unit = 'g'
-        
         # Generate intelligent features based on category and product info
         features = []
         
@@ -1024,7 +3469,7 @@ class BarcodeAPIProcessor:
         # Create specifications
         specifications = {
             'Brand': brand,
-            'Country of Origin': 'India' if barcode.startswith('890') else 'Unknown' ,
+            'Country of Origin': self.gs1_index.country(barcode),
             'Barcode Type': f"{len(barcode)}-digit barcode"
         }
         
@@ -1094,6 +3539,18 @@ class BarcodeAPIProcessor:
 
     def cleanup(self):
         """Clean up temporary files and directories."""
+        if self.cache:
+            self.cache.close()
+            self.cache = None
+        if self.off_store:
+            self.off_store.close()
+            self.off_store = None
+        if self._loop:
+            asyncio.run_coroutine_threadsafe(self._close_http_sessions(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._loop_thread.join()
+            self._loop.close()
+            self._loop = self._loop_thread = None
         if self.temp_dir and os.path.exists(self.temp_dir):
             try:
                 import shutil
@@ -1102,22 +3559,154 @@ class BarcodeAPIProcessor:
             except Exception as e:
                 logger.warning(f"Could not clean up temporary directory: {e}")
 
+    async def _close_http_sessions(self):
+        """Cancel whatever still runs on the loop (background hedges) and close the HTTP sessions."""
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for session in self.http_sessions.values():
+            await session.close()
+        self.http_sessions.clear()
+
     def get_processing_stats(self):
         """Get processing statistics."""
         return {
             "processed_items": len(self.processed_barcodes),
             "ai_service_status": self.ai_service_status,
+            "ai_routing": self.ai_router.snapshot(),
+            "ai_hedging": self.ai_hedge_budget.snapshot() if self.ai_hedging else None,
+            "rate_limits": self.rate_limiter.snapshot(),
+            "cache": self.cache.stats() if self.cache else None,
+            "enhancement_cache": self.enhancement_cache.stats() if self.enhancement_cache else None,
+            "openfoodfacts_local": self.off_store.stats() if self.off_store else None,
+            "metrics": self.metrics.snapshot(),
             "last_processed_barcode": self.processed_barcodes[-1] if self.processed_barcodes else None
         }
 
 
+def serve(processor: BarcodeAPIProcessor, input_stream=None, output_stream=None, max_concurrent: int = None):
+    """
+    Run as a long-lived worker speaking newline-delimited JSON.
+    
+    Each input line is a request object:
+        {"id": 1, "barcodes": ["8901030000001", ...]}   -> {"id": 1, "results": [...]}
+        {"id": 1, "barcodes": [...], "stream": true}     -> {"id": 1, "result": {...}} per barcode,
+                                                            then {"id": 1, "done": true, "found": n}
+        {"id": 2, "command": "stats"}                    -> {"id": 2, "stats": {...}}
+        {"id": 3, "command": "metrics", "format": "prometheus"}
+                                                         -> {"id": 3, "metrics": "..."} (format: json or prometheus)
+        {"command": "shutdown"}                          -> stops the loop once running requests finish
+    Process requests may also carry "max_workers", "deadline" and "barcode_deadline" (seconds).
+    Up to max_concurrent (DAEMON_CONCURRENCY) process requests run at once, so their responses
+    can interleave; match them by id. Failures are answered with {"id": ..., "error": "message"}.
+    Logs stay on stderr.
+    """
+    input_stream = input_stream or sys.stdin
+    output_stream = output_stream or sys.stdout
+    max_concurrent = max(1, max_concurrent or int(os.getenv("DAEMON_CONCURRENCY", str(DEFAULT_DAEMON_CONCURRENCY))))
+    output_lock = threading.Lock()
+    
+    def respond(message: Dict):
+        with output_lock:
+            output_stream.write(json.dumps(message) + "\n")
+            output_stream.flush()
+    
+    def process(request_id, barcodes: List[str], request: Dict):
+        try:
+            options = (request.get('max_workers'), request.get('deadline'), request.get('barcode_deadline'))
+            if request.get('stream'):
+                found = 0
+                for record in processor.iter_process_barcodes(barcodes, *options):
+                    found += record['status'] == 'found'
+                    respond({"id": request_id, "result": record})
+                respond({"id": request_id, "done": True, "found": found})
+            else:
+                results = processor.process_barcodes(barcodes, *options)
+                respond({"id": request_id, "results": results})
+        except Exception as e:
+            logger.error(f"Error handling daemon request {request_id}: {e}")
+            respond({"id": request_id, "error": str(e)})
+    
+    executor = ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix='daemon-request')
+    logger.info(f"Barcode processor daemon ready, handling up to {max_concurrent} requests at once")
+    try:
+        for line in input_stream:
+            line = line.strip()
+            if not line:
+                continue
+            request_id = None
+            try:
+                request = json.loads(line)
+                request_id = request.get('id')
+                command = request.get('command', 'process')
+                
+                if command == 'shutdown':
+                    logger.info("Shutdown requested, stopping daemon")
+                    break
+                elif command == 'stats':
+                    respond({"id": request_id, "stats": processor.get_processing_stats()})
+                elif command == 'metrics':
+                    fmt = request.get('format', 'json')
+                    if fmt not in METRICS_FORMATS:
+                        raise ValueError(f"Unknown metrics format: {fmt}")
+                    respond({"id": request_id, "metrics": processor.metrics.export(fmt)})
+                elif command == 'process':
+                    barcodes = request.get('barcodes')
+                    if not isinstance(barcodes, list):
+                        raise ValueError("'barcodes' must be a list")
+                    executor.submit(process, request_id, [str(b) for b in barcodes], request)
+                else:
+                    raise ValueError(f"Unknown command: {command}")
+            except Exception as e:
+                logger.error(f"Error handling daemon request: {e}")
+                respond({"id": request_id, "error": str(e)})
+    finally:
+        executor.shutdown(wait=True)
+
+
 def main():
     """Main function for command line usage."""
-    processor = BarcodeAPIProcessor()
+    parser = argparse.ArgumentParser(
+        description="Look up and enhance product data for barcodes.",
+        epilog="Barcodes can also be piped as a JSON list: echo '[\"barcode1\", \"barcode2\"]' | python barcode_api_processor.py"
+    )
+    parser.add_argument('barcodes', nargs='*', help="barcodes to process")
+    parser.add_argument('--serve', action='store_true',
+                        help="keep one processor alive and answer newline-delimited JSON requests on stdin")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="number of barcodes processed concurrently (default: MAX_WORKERS)")
+    parser.add_argument('--stream', action='store_true',
+                        help="write one compact JSON line per barcode as soon as it is resolved")
+    parser.add_argument('--job', metavar='FILE',
+                        help="process a barcode file (JSON list, or one per line) as a resumable job")
+    parser.add_argument('--output-dir',
+                        help="where job journals and results are written (default: next to the job file)")
+    parser.add_argument('--deadline', type=float, default=None,
+                        help="seconds allowed for the whole batch; unfinished barcodes are reported as pending")
+    parser.add_argument('--barcode-deadline', type=float, default=None,
+                        help="seconds allowed per barcode")
+    parser.add_argument('--metrics', choices=METRICS_FORMATS,
+                        help="write stage timings and counters to stderr when done")
+    args = parser.parse_args()
+    
+    output_dir = args.output_dir
+    if args.job and not output_dir:
+        output_dir = os.path.dirname(os.path.abspath(args.job))
+    processor = BarcodeAPIProcessor(output_dir)
     
     try:
+        if args.serve:
+            serve(processor)
+            return
+        
+        if args.job:
+            summary = processor.run_job(args.job, args.workers, args.deadline, args.barcode_deadline)
+            print(json.dumps(summary, indent=2))
+            return
+        
         # Check if input is from stdin (pipe)
-        if not sys.stdin.isatty():
+        if not args.barcodes and not sys.stdin.isatty():
             # Reading from pipe (echo '["barcode"]' | python script.py)
             try:
                 input_data = sys.stdin.read().strip()
@@ -1133,14 +3722,19 @@ def main():
                 sys.exit(1)
         else:
             # Reading from command line arguments
-            if len(sys.argv) < 2:
-                print("Usage: python barcode_api_processor.py <barcode1> [barcode2] [barcode3] ...")
-                print("   or: echo '[\"barcode1\", \"barcode2\"]' | python barcode_api_processor.py")
+            if not args.barcodes:
+                parser.print_usage()
                 sys.exit(1)
-            barcodes = sys.argv[1:]
+            barcodes = args.barcodes
+        
+        if args.stream:
+            # One NDJSON line per barcode, including failures with their reason
+            for record in processor.iter_process_barcodes(barcodes, args.workers, args.deadline, args.barcode_deadline):
+                print(json.dumps(record, separators=(',', ':')), flush=True)
+            return
         
         # Process barcodes
-        results = processor.process_barcodes(barcodes)
+        results = processor.process_barcodes(barcodes, args.workers, args.deadline, args.barcode_deadline)
         
         # Output results as JSON
         print(json.dumps(results, indent=2))
@@ -1151,7 +3745,12 @@ def main():
     except Exception as e:
         print(f"Error in main: {e}", file=sys.stderr)
         sys.exit(1)
+    finally:
+        if args.metrics:
+            metrics = processor.metrics.export(args.metrics)
+            print(metrics if isinstance(metrics, str) else json.dumps(metrics, indent=2), file=sys.stderr)
+        processor.cleanup()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
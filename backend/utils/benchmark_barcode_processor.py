@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark for BarcodeAPIProcessor.
+
+Starts a local stand-in for every upstream (OpenFoodFacts, Google CSE, DigiTeyes,
+Gemini, OpenAI, DeepSeek) in a separate process, points the processor at it through
+its URL settings and reports throughput, per-barcode latency percentiles, per-provider
+call counts and peak RSS for a range of batch sizes.
+
+Usage:
+    python benchmark_barcode_processor.py --sizes 1,10,100,1000,10000 --workers 8 --latency-ms 80
+    python benchmark_barcode_processor.py --recorded fixtures.json --error-rate 0.05 --json
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import random
+import re
+import resource
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+PROVIDER_PATHS = {
+    "/off/": "openfoodfacts",
+    "/google": "google",
+    "/digiteyes": "digiteyes",
+    "/gemini": "gemini",
+    "/openai": "openai",
+    "/deepseek": "deepseek"
+}
+DEFAULT_BATCH_SIZES = "1,10,100,1000,10000"
+BARCODE_IN_TEXT_PATTERN = re.compile(r'\b\d{8,14}\b')
+
+
+def gs1_barcode(sequence: int, prefix: str = "890") -> str:
+    """Build a synthetic EAN-13 with a valid GS1 check digit."""
+    body = f"{prefix}{sequence:09d}"[:12]
+    total = sum(int(digit) * (3 if position % 2 else 1) for position, digit in enumerate(body))
+    return body + str((10 - total % 10) % 10)
+
+
+def barcode_bucket(barcode: str) -> float:
+    """Deterministic value in [0, 1) per barcode so every provider agrees on hits and misses."""
+    return (zlib.crc32(barcode.encode()) % 10000) / 10000
+
+
+def synthetic_product(barcode: str) -> Dict:
+    return {
+        "product_name": f"Benchmark Sunflower Oil {barcode[-4:]}",
+        "brands": "Benchmark",
+        "generic_name": "Refined sunflower cooking oil",
+        "ingredients_text": "Refined sunflower oil, antioxidants (E319)",
+        "image_url": f"https://images.example.com/{barcode}.jpg",
+        "quantity": "1 l"
+    }
+
+
+def enhanced_product(barcode: str) -> Dict:
+    return {
+        "Barcode": barcode,
+        "Product Name": f"Benchmark Sunflower Oil {barcode[-4:]}",
+        "Brand": "Benchmark",
+        "Description": "Refined sunflower cooking oil",
+        "Category": "Food & Beverages",
+        "Subcategory": "Cooking Oil",
+        "ProductLine": "Benchmark Cooking Oil",
+        "Quantity": 1,
+        "Unit": "l",
+        "Features": ["Light", "Rich in vitamin E", "Refined", "Cholesterol free"],
+        "Specification": {"Brand": "Benchmark", "Weight/Volume": "1 l", "Country of Origin": "India"}
+    }
+
+
+class MockUpstreamHandler(BaseHTTPRequestHandler):
+    """Replays recorded or synthetic upstream responses with configurable latency and failures."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload, headers: Dict = None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _provider(self) -> str:
+        for prefix, provider in PROVIDER_PATHS.items():
+            if self.path.startswith(prefix):
+                return provider
+        return ""
+
+    def _inject_failures(self, provider: str) -> bool:
+        """Apply latency, 429 bursts and random errors; returns True if a failure was sent."""
+        server = self.server
+        config = server.config
+        with server.lock:
+            server.calls[provider] = server.calls.get(provider, 0) + 1
+            call_number = server.calls[provider]
+            delay = max(0.0, server.rng.gauss(config["latency_ms"], config["jitter_ms"])) / 1000
+            fail = server.rng.random() < config["error_rate"]
+        time.sleep(delay)
+
+        every = config["rate_limit_every"]
+        if every and (call_number % every) < config["rate_limit_burst"]:
+            with server.lock:
+                server.throttled[provider] = server.throttled.get(provider, 0) + 1
+            self._send_json(429, {"error": {"message": "rate limited", "type": "rate_limit"}},
+                            {"Retry-After": str(config["retry_after"])})
+            return True
+        if fail:
+            self._send_json(500, {"error": {"message": "synthetic failure"}})
+            return True
+        return False
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        if parsed.path == "/__stats":
+            with self.server.lock:
+                self._send_json(200, {"calls": self.server.calls, "throttled": self.server.throttled})
+            return
+
+        provider = self._provider()
+        if not provider:
+            self._send_json(404, {})
+            return
+        if self._inject_failures(provider):
+            return
+
+        config = self.server.config
+        recorded = self.server.recorded.get(provider, {})
+        query = parse_qs(parsed.query)
+
+        if provider == "openfoodfacts":
+            barcode = parsed.path.rsplit("/", 1)[-1].replace(".json", "")
+            if barcode in recorded:
+                self._send_json(200, recorded[barcode])
+            elif barcode_bucket(barcode) < config["off_hit_rate"]:
+                self._send_json(200, {"status": 1, "product": synthetic_product(barcode)})
+            else:
+                self._send_json(200, {"status": 0, "status_verbose": "product not found"})
+        elif provider == "google":
+            barcode = query.get("q", [""])[0].split(" ")[0]
+            if barcode in recorded:
+                self._send_json(200, recorded[barcode])
+            elif barcode_bucket(barcode) < config["off_hit_rate"] + config["google_hit_rate"]:
+                self._send_json(200, {"items": [{
+                    "title": f"Benchmark Sunflower Oil {barcode[-4:]} 1 l - Grocery Store",
+                    "snippet": "Refined sunflower cooking oil, 1 litre pouch",
+                    "link": f"https://www.bigbasket.com/pd/{barcode}"
+                }]})
+            else:
+                self._send_json(200, {"items": []})
+        elif provider == "digiteyes":
+            barcode = query.get("upcCode", [""])[0]
+            if barcode in recorded:
+                self._send_json(200, recorded[barcode])
+            else:
+                self._send_json(404, {})
+
+    def do_POST(self):
+        provider = self._provider()
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length).decode("utf-8", "replace")
+        if provider not in ("gemini", "openai", "deepseek"):
+            self._send_json(404, {})
+            return
+        if self._inject_failures(provider):
+            return
+        # LLM latency grows with the prompt; charge it per (roughly estimated) input token
+        time.sleep(self.server.config["llm_ms_per_1k_tokens"] * len(body) / 4 / 1000 / 1000)
+
+        # Answer with an enhanced record for every barcode mentioned in the prompt
+        barcodes = list(dict.fromkeys(BARCODE_IN_TEXT_PATTERN.findall(body)))
+        if '"products"' in body or len(barcodes) > 1:
+            text = json.dumps({"products": [enhanced_product(barcode) for barcode in barcodes]})
+        else:
+            text = json.dumps(enhanced_product(barcodes[0] if barcodes else "0"))
+
+        usage = {"prompt_tokens": len(body) // 4, "completion_tokens": len(text) // 4}
+        if provider == "gemini":
+            self._send_json(200, {
+                "candidates": [{"content": {"parts": [{"text": text}]}}],
+                "usageMetadata": {"promptTokenCount": usage["prompt_tokens"],
+                                  "candidatesTokenCount": usage["completion_tokens"]}
+            })
+        else:
+            self._send_json(200, {"choices": [{"message": {"content": text}}], "usage": usage})
+
+
+class MockUpstreamServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 drops connection bursts from wide batches, and each dropped SYN
+    # costs the client a one-second retransmit that has nothing to do with the processor
+    request_queue_size = 1024
+    
+    def handle_error(self, request, client_address):
+        # Clients hanging up early (timeouts, deadlines) are expected during a benchmark
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def run_mock_server(config: Dict, recorded: Dict, port_queue):
+    server = MockUpstreamServer(("127.0.0.1", 0), MockUpstreamHandler)
+    server.config = config
+    server.recorded = recorded
+    server.calls = {}
+    server.throttled = {}
+    server.lock = threading.Lock()
+    server.rng = random.Random(config["seed"])
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    position = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+    return ordered[position]
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def configure_environment(base_url: str, args):
+    """Point the processor at the mock upstream before it is constructed."""
+    os.environ.update({
+        "OPENFOODFACTS_URL": f"{base_url}/off/",
+        "GOOGLE_SEARCH_URL": f"{base_url}/google",
+        "DIGITEYES_URL": f"{base_url}/digiteyes",
+        "GEMINI_URL": f"{base_url}/gemini",
+        "OPENAI_URL": f"{base_url}/openai",
+        "DEEPSEEK_URL": f"{base_url}/deepseek",
+        "GOOGLE_API_KEY": "benchmark", "GOOGLE_SEARCH_CX": "benchmark",
+        "DIGITEYES_APP_KEY": "benchmark", "DIGITEYES_SIGNATURE": "benchmark",
+        "GEMINI_API_KEY": "benchmark", "OPENAI_API_KEY": "benchmark", "DEEPSEEK_API_KEY": "benchmark",
+        "BARCODE_CACHE_ENABLED": "true" if args.cache else "false",
+        "ENHANCEMENT_CACHE_ENABLED": "true" if args.cache else "false",
+        "MAX_WORKERS": str(args.workers)
+    })
+    if args.lookup_strategy:
+        os.environ["LOOKUP_STRATEGY"] = args.lookup_strategy
+    if args.ai_batch_size:
+        os.environ["AI_BATCH_SIZE"] = str(args.ai_batch_size)
+    if not args.keep_rate_limits:
+        # Measure the pipeline itself, not the production request budgets
+        for provider in PROVIDER_PATHS.values():
+            os.environ[f"{provider.upper()}_RATE_LIMIT"] = "100000"
+            os.environ[f"{provider.upper()}_BURST"] = "100000"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the barcode pipeline against a local mock upstream.")
+    parser.add_argument("--sizes", default=DEFAULT_BATCH_SIZES,
+                        help="comma separated batch sizes (default: %(default)s; the 10000 run takes about two "
+                             "minutes, drop it for a quick check)")
+    parser.add_argument("--workers", type=int, default=8, help="processor worker count (default: %(default)s)")
+    parser.add_argument("--lookup-strategy", choices=["sequential", "race", "hedged"], help="override LOOKUP_STRATEGY")
+    parser.add_argument("--ai-batch-size", type=int, help="override AI_BATCH_SIZE")
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="mean upstream latency (default: %(default)s)")
+    parser.add_argument("--jitter-ms", type=float, default=20.0, help="latency standard deviation (default: %(default)s)")
+    parser.add_argument("--llm-ms-per-1k-tokens", type=float, default=0.0,
+                        help="extra AI latency per 1000 prompt tokens (default: %(default)s)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls answered with HTTP 500")
+    parser.add_argument("--rate-limit-every", type=int, default=0,
+                        help="start a burst of 429s every N calls per provider (0 disables)")
+    parser.add_argument("--rate-limit-burst", type=int, default=3, help="length of each 429 burst (default: %(default)s)")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with 429s")
+    parser.add_argument("--off-hit-rate", type=float, default=0.7, help="fraction of barcodes found in OpenFoodFacts")
+    parser.add_argument("--google-hit-rate", type=float, default=0.2,
+                        help="fraction of barcodes only found through Google")
+    parser.add_argument("--recorded", help="JSON file of recorded responses: {provider: {barcode: body}}")
+    parser.add_argument("--cache", action="store_true", help="keep the persistent result and enhancement caches enabled")
+    parser.add_argument("--keep-rate-limits", action="store_true", help="use the configured provider rate limits")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    recorded = {}
+    if args.recorded:
+        with open(args.recorded) as fixture_file:
+            recorded = json.load(fixture_file)
+
+    config = {
+        "latency_ms": args.latency_ms, "jitter_ms": args.jitter_ms, "error_rate": args.error_rate,
+        "rate_limit_every": args.rate_limit_every, "rate_limit_burst": args.rate_limit_burst,
+        "retry_after": args.retry_after, "off_hit_rate": args.off_hit_rate,
+        "google_hit_rate": args.google_hit_rate, "llm_ms_per_1k_tokens": args.llm_ms_per_1k_tokens,
+        "seed": args.seed
+    }
+    port_queue = multiprocessing.Queue()
+    server_process = multiprocessing.Process(target=run_mock_server, args=(config, recorded, port_queue), daemon=True)
+    server_process.start()
+    base_url = f"http://127.0.0.1:{port_queue.get(timeout=10)}"
+
+    configure_environment(base_url, args)
+    logging.getLogger("barcode_api_processor").setLevel(logging.CRITICAL)
+
+    from barcode_api_processor import BarcodeAPIProcessor
+
+    reports = []
+    sequence = 0
+    try:
+        for size in [int(value) for value in args.sizes.split(",") if value.strip()]:
+            processor = BarcodeAPIProcessor()
+            calls_before = requests.get(f"{base_url}/__stats").json()
+            barcodes = [gs1_barcode(sequence + offset) for offset in range(size)]
+            sequence += size
+
+            latencies = []
+            statuses = {}
+            started = time.perf_counter()
+            for record in processor.iter_process_barcodes(barcodes):
+                latencies.append(record.get("elapsed_ms", 0.0))
+                statuses[record["status"]] = statuses.get(record["status"], 0) + 1
+            elapsed = time.perf_counter() - started
+            stages = processor.metrics.snapshot()["stages"]
+            processor.cleanup()
+
+            calls_after = requests.get(f"{base_url}/__stats").json()
+            calls = {provider: count - calls_before["calls"].get(provider, 0)
+                     for provider, count in calls_after["calls"].items()}
+            throttled = {provider: count - calls_before["throttled"].get(provider, 0)
+                         for provider, count in calls_after["throttled"].items()}
+            reports.append({
+                "batch_size": size,
+                "seconds": round(elapsed, 3),
+                "barcodes_per_sec": round(size / elapsed, 2) if elapsed else 0.0,
+                "p50_ms": percentile(latencies, 0.50),
+                "p95_ms": percentile(latencies, 0.95),
+                "p99_ms": percentile(latencies, 0.99),
+                "statuses": statuses,
+                "provider_calls": calls,
+                "provider_429s": {provider: count for provider, count in throttled.items() if count},
+                "stage_avg_ms": {stage: entry["avg_ms"] for stage, entry in stages.items()},
+                "peak_rss_mb": round(peak_rss_mb(), 1)
+            })
+    finally:
+        server_process.terminate()
+
+    if args.json:
+        print(json.dumps(reports, indent=2))
+        return
+
+    print(f"{'batch':>7} {'sec':>8} {'bc/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'rss MB':>8}  provider calls")
+    for report in reports:
+        calls = ", ".join(f"{provider}={count}" for provider, count in sorted(report["provider_calls"].items()))
+        print(f"{report['batch_size']:>7} {report['seconds']:>8.2f} {report['barcodes_per_sec']:>9.1f} "
+              f"{report['p50_ms']:>9.1f} {report['p95_ms']:>9.1f} {report['p99_ms']:>9.1f} "
+              f"{report['peak_rss_mb']:>8.1f}  {calls}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the tolerant LLM JSON parser used by BarcodeAPIProcessor.
+
+Runs a corpus of malformed model replies (prose around the JSON, code fences, trailing and
+missing commas, unquoted keys and values, single, typographic and unescaped quotes, Python
+literals, comments, output cut off at the token limit) through parse_llm_json() and through the
+previous regex-based cleanup, and reports per-case results, success rate and parses per second
+for both. The built-in corpus is hand-written after the failure shapes seen from the models.
+
+Replies captured from the live providers can be replayed with --replies: run the processor with
+AI_REPLY_LOG=replies.ndjson, then pass that file. A captured reply counts as parsed when it
+yields a product (or batch of products) that passes schema validation the way the processor
+checks it; lines that also carry an "expected" value are compared exactly instead.
+
+Usage:
+    python benchmark_json_parser.py
+    python benchmark_json_parser.py --iterations 5000 --legacy-iterations 20 --json
+    python benchmark_json_parser.py --replies replies.ndjson
+"""
+import argparse
+import json
+import logging
+import re
+import sys
+import time
+from typing import Callable, Dict, List, Tuple
+
+from barcode_api_processor import (AI_BATCH_SCHEMA, AI_PRODUCT_SCHEMA, coerce_to_schema, parse_llm_json,
+                                   schema_errors)
+
+# Regex cleanup as it shipped before the single-pass scanner, kept for comparison
+LEGACY_CODEBLOCK_PATTERN = r'```(?:json)?\s*(\{.*?\})\s*```'
+LEGACY_UNQUOTED_PROPERTY_PATTERN = r'(\s*)([a-zA-Z_][a-zA-Z0-9_\s]*)\s*:'
+LEGACY_TRAILING_COMMA_PATTERN = r',(\s*[}\]])'
+LEGACY_MISSING_COMMA_PATTERN = r'(\}\s*)(\s*"[^"]*"\s*:)'
+LEGACY_UNQUOTED_VALUE_PATTERN = r':\s*([^",\[\{\s][^",\[\{]*[^",\[\}\s])\s*([,\}])'
+
+
+def legacy_parse(text: str):
+    json_match = re.search(LEGACY_CODEBLOCK_PATTERN, text, re.DOTALL)
+    if json_match:
+        text = json_match.group(1)
+    else:
+        json_start = text.find('{')
+        json_end = text.rfind('}') + 1
+        if json_start >= 0 and json_end > json_start:
+            text = text[json_start:json_end]
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+    fixed_text = re.sub(LEGACY_UNQUOTED_PROPERTY_PATTERN, r'\1"\2":', text)
+    fixed_text = re.sub(LEGACY_TRAILING_COMMA_PATTERN, r'\1', fixed_text)
+    fixed_text = re.sub(LEGACY_MISSING_COMMA_PATTERN, r'\1,\n\2', fixed_text)
+    try:
+        return json.loads(fixed_text)
+    except json.JSONDecodeError:
+        fixed_text = fixed_text.replace("'", '"')
+        fixed_text = re.sub(LEGACY_UNQUOTED_VALUE_PATTERN, r': "\1"\2', fixed_text)
+        try:
+            return json.loads(fixed_text)
+        except json.JSONDecodeError:
+            return None
+
+
+PRODUCT = {
+    "Product Name": "Maggi 2-Minute Noodles Masala",
+    "Brand": "Maggi",
+    "Description": "Instant noodles with masala tastemaker.",
+    "Category": "Food",
+    "Quantity": 70,
+    "Unit": "g"
+}
+
+# (name, model reply, expected parse)
+CORPUS = [
+    ("clean", json.dumps(PRODUCT), PRODUCT),
+    ("clean_pretty", json.dumps(PRODUCT, indent=2), PRODUCT),
+    ("code_fence", "Here is the product:\n```json\n" + json.dumps(PRODUCT, indent=2) + "\n```\nLet me know!", PRODUCT),
+    ("prose_around", "Sure! " + json.dumps(PRODUCT) + " Hope this helps {smile}.", PRODUCT),
+    ("trailing_commas",
+     '{"Brand": "Amul", "Tags": ["dairy", "butter",], "Quantity": 100,}',
+     {"Brand": "Amul", "Tags": ["dairy", "butter"], "Quantity": 100}),
+    ("unquoted_keys",
+     '{Brand: "Amul", Quantity: 500, Unit: "g"}',
+     {"Brand": "Amul", "Quantity": 500, "Unit": "g"}),
+    ("single_quotes",
+     "{'Brand': 'Parle', 'Product Name': 'Parle-G Biscuits', 'Quantity': 250}",
+     {"Brand": "Parle", "Product Name": "Parle-G Biscuits", "Quantity": 250}),
+    ("apostrophe_in_string",
+     '{"Product Name": "Haldiram\'s Bhujia", "Description": "India\'s favourite snack",}',
+     {"Product Name": "Haldiram's Bhujia", "Description": "India's favourite snack"}),
+    ("missing_commas",
+     '{"Brand": "Tata"\n"Product Name": "Tata Salt"\n"Quantity": 1\n"Unit": "kg"}',
+     {"Brand": "Tata", "Product Name": "Tata Salt", "Quantity": 1, "Unit": "kg"}),
+    ("python_literals",
+     "{'Brand': 'Dabur', 'Vegetarian': True, 'Allergens': None, 'Imported': False}",
+     {"Brand": "Dabur", "Vegetarian": True, "Allergens": None, "Imported": False}),
+    ("truncated_mid_string",
+     '{"Brand": "Britannia", "Product Name": "Good Day Cashew", "Description": "Crunchy cookies wi',
+     {"Brand": "Britannia", "Product Name": "Good Day Cashew", "Description": "Crunchy cookies wi"}),
+    ("truncated_after_colon",
+     '{"Brand": "Britannia", "Specification": {"Weight": "200g", "Flavour":',
+     {"Brand": "Britannia", "Specification": {"Weight": "200g", "Flavour": None}}),
+    ("comments",
+     '{\n  // best guess from the name\n  "Brand": "Nestle", /* inferred */ "Quantity": 400\n}',
+     {"Brand": "Nestle", "Quantity": 400}),
+    ("unquoted_values",
+     '{"Brand": Nestle, "Category": Food, "Unit": g, "Quantity": 400}',
+     {"Brand": "Nestle", "Category": "Food", "Unit": "g", "Quantity": 400}),
+    ("nested_specification",
+     '{"Brand": "Surf Excel", "Specification": {"Form": "Liquid", "Volume": "1 L",}, '
+     '"Key Features": ["Removes stains", "Quick wash"]}',
+     {"Brand": "Surf Excel", "Specification": {"Form": "Liquid", "Volume": "1 L"},
+      "Key Features": ["Removes stains", "Quick wash"]}),
+    ("batch_products",
+     '```json\n{"products": [\n  {"barcode": "8901058000290", "Brand": "Maggi"},\n'
+     '  {"barcode": "8901063010237", "Brand": "Britannia",}\n]}\n```',
+     {"products": [{"barcode": "8901058000290", "Brand": "Maggi"},
+                   {"barcode": "8901063010237", "Brand": "Britannia"}]}),
+    ("batch_bare_list",
+     'Results:\n[{"barcode": "8901058000290", "Brand": "Maggi"}, {"barcode": "8901063010237", "Brand": "Britannia"}]',
+     [{"barcode": "8901058000290", "Brand": "Maggi"}, {"barcode": "8901063010237", "Brand": "Britannia"}]),
+    ("raw_newline_in_string",
+     '{"Brand": "Amul", "Description": "Pasteurised butter.\nMade from fresh cream."}',
+     {"Brand": "Amul", "Description": "Pasteurised butter.\nMade from fresh cream."}),
+    ("brace_in_string",
+     'Answer: {"Brand": "Lay\'s", "Description": "Chips {classic} salted"} (end)',
+     {"Brand": "Lay's", "Description": "Chips {classic} salted"}),
+    ("long_unquoted_value",
+     '{"Brand": "Acme", "Description": ' + "very long description without quotes " * 200 + '}',
+     {"Brand": "Acme", "Description": ("very long description without quotes " * 200).strip()}),
+    ("missing_comma_after_number",
+     '{"Quantity": 500 "Unit": "g", "Brand": "Amul"}',
+     {"Quantity": 500, "Unit": "g", "Brand": "Amul"}),
+    ("missing_comma_after_bare_value",
+     '{"Brand": Nestle India "Category": Food}',
+     {"Brand": "Nestle India", "Category": "Food"}),
+    ("missing_comma_in_array",
+     '{"Key Features": ["Rich" "Creamy"] "Brand": "Amul"}',
+     {"Key Features": ["Rich", "Creamy"], "Brand": "Amul"}),
+    ("missing_commas_between_numbers",
+     '{"Pack Sizes": [1 2 3], "Brand": "Amul"}',
+     {"Pack Sizes": [1, 2, 3], "Brand": "Amul"}),
+    ("unescaped_inner_quotes",
+     '{"Product Name": "Amul "Taaza" Toned Milk", "Description": "Sold as "pouch pack"."}',
+     {"Product Name": 'Amul "Taaza" Toned Milk', "Description": 'Sold as "pouch pack".'}),
+    ("single_quoted_apostrophe",
+     "{'Brand': 'Haldiram's', 'Product Name': 'Haldiram's Aloo Bhujia'}",
+     {"Brand": "Haldiram's", "Product Name": "Haldiram's Aloo Bhujia"}),
+    ("typographic_quotes",
+     '{\u201cBrand\u201d: \u201cAmul\u201d, \u201cQuantity\u201d: 500}',
+     {"Brand": "Amul", "Quantity": 500}),
+    ("json_label_no_fence",
+     'json\n{"Brand": "Amul", "Quantity": 500}',
+     {"Brand": "Amul", "Quantity": 500}),
+    ("two_objects",
+     '{"Brand": "Amul", "Quantity": 500}\n{"Brand": "Amul", "Quantity": 1000}',
+     {"Brand": "Amul", "Quantity": 500}),
+    ("truncated_in_array",
+     '{\n  "Brand": "Amul",\n  "Quantity": 500,\n  "Key Features": ["Rich", "Crea',
+     {"Brand": "Amul", "Quantity": 500, "Key Features": ["Rich", "Crea"]}),
+    ("truncated_batch_mid_key",
+     '{"products": [{"Barcode": "8901058000290", "Brand": "Maggi"}, {"Barcode": "8901063010237", "Bra',
+     {"products": [{"Barcode": "8901058000290", "Brand": "Maggi"}, {"Barcode": "8901063010237", "Bra": None}]}),
+    ("no_json", "I could not find any information about this barcode.", None),
+]
+
+
+def time_parser(parse: Callable, iterations: int, corpus: List[Tuple[str, str, object]]) -> float:
+    """Parses per second over the whole corpus."""
+    texts = [text for _, text, _ in corpus]
+    started = time.perf_counter()
+    for _ in range(iterations):
+        for text in texts:
+            parse(text)
+    elapsed = time.perf_counter() - started
+    return len(texts) * iterations / elapsed if elapsed > 0 else 0.0
+
+
+# Marks a captured reply without an expected parse; it is judged by schema validation instead
+MISSING = object()
+
+
+def load_replies(path: str) -> List[Tuple[str, str, object]]:
+    """(name, reply, expected) from an AI_REPLY_LOG file; expected is MISSING unless the line has one."""
+    replies = []
+    with open(path, encoding='utf-8') as reply_file:
+        for line_number, line in enumerate(reply_file, 1):
+            if line.strip():
+                entry = json.loads(line)
+                replies.append((f"{entry.get('service', 'reply')}:{line_number}", entry['reply'],
+                                entry.get('expected', MISSING)))
+    return replies
+
+
+def is_usable(parsed) -> bool:
+    """Whether a parse would pass the processor's schema check for a single or batched reply."""
+    if isinstance(parsed, list):
+        parsed = {"products": parsed}
+    if not isinstance(parsed, dict):
+        return False
+    schema = AI_BATCH_SCHEMA if "products" in parsed else AI_PRODUCT_SCHEMA
+    return not schema_errors(coerce_to_schema(parsed, schema), schema)
+
+
+def run(iterations: int, legacy_iterations: int, replies: List[Tuple[str, str, object]] = None) -> Dict:
+    parsers = {"scanner": parse_llm_json, "legacy": legacy_parse}
+    timed_iterations = {"scanner": iterations, "legacy": legacy_iterations}
+    corpus = CORPUS + (replies or [])
+    cases: List[Dict] = []
+    for name, text, expected in corpus:
+        case = {"case": name}
+        for label, parse in parsers.items():
+            parsed = parse(text)
+            case[label] = is_usable(parsed) if expected is MISSING else parsed == expected
+        cases.append(case)
+    summary = {}
+    for label, parse in parsers.items():
+        passed = sum(1 for case in cases if case[label])
+        summary[label] = {
+            "passed": passed,
+            "success_rate": round(passed / len(cases), 3),
+            "parses_per_sec": round(time_parser(parse, timed_iterations[label], corpus))
+        }
+    return {"cases": cases, "summary": summary, "iterations": timed_iterations}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the LLM JSON scanner with the legacy regex cleanup.")
+    parser.add_argument("--iterations", type=int, default=500, help="timed passes over the corpus (default: %(default)s)")
+    # The regex cleanup backtracks badly on long unquoted values, so it gets far fewer passes
+    parser.add_argument("--legacy-iterations", type=int, default=5,
+                        help="timed passes for the legacy cleanup (default: %(default)s)")
+    parser.add_argument("--replies", metavar="FILE",
+                        help="also replay captured model replies (NDJSON written with AI_REPLY_LOG)")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    logging.getLogger("barcode_api_processor").setLevel(logging.CRITICAL)
+    results = run(args.iterations, args.legacy_iterations, load_replies(args.replies) if args.replies else None)
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+        return
+
+    print(f"{'case':<32}{'scanner':>10}{'legacy':>10}")
+    for case in results["cases"]:
+        print(f"{case['case']:<32}{'ok' if case['scanner'] else 'FAIL':>10}{'ok' if case['legacy'] else 'FAIL':>10}")
+    print()
+    for label, stats in results["summary"].items():
+        print(f"{label:<10} {stats['passed']}/{len(results['cases'])} passed "
+              f"({stats['success_rate']:.0%}), {stats['parses_per_sec']} parses/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Import an OpenFoodFacts data dump into the local store used by BarcodeAPIProcessor.
+
+Streams the JSONL export (openfoodfacts-products.jsonl.gz) or the tab-separated CSV export
+(en.openfoodfacts.org.products.csv.gz), keeps only the fields the processor reads and upserts
+them into SQLite keyed by GTIN-14. Re-running with a newer full dump or a daily delta file only
+rewrites products whose last_modified_t moved forward.
+
+Usage:
+    python import_openfoodfacts_dump.py openfoodfacts-products.jsonl.gz --db ./cache/openfoodfacts.sqlite3
+    python import_openfoodfacts_dump.py openfoodfacts_products_1718000000_1718086400.json.gz --db ./cache/openfoodfacts.sqlite3
+
+Then point the processor at it with OPENFOODFACTS_LOCAL_DB=./cache/openfoodfacts.sqlite3.
+"""
+import argparse
+import csv
+import gzip
+import json
+import logging
+import sqlite3
+import sys
+import time
+from datetime import datetime
+from typing import Dict, Iterator
+
+from barcode_api_processor import OPENFOODFACTS_LOCAL_FIELDS, OpenFoodFactsLocalStore, normalize_gtin
+
+logger = logging.getLogger('import_openfoodfacts_dump')
+
+DEFAULT_BATCH_SIZE = 10000
+PROGRESS_INTERVAL = 100000
+
+
+def open_dump(path: str):
+    """Open a dump as text, decompressing .gz files on the fly."""
+    if path == '-':
+        return sys.stdin
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', errors='replace')
+    return open(path, encoding='utf-8', errors='replace')
+
+
+def iter_jsonl_products(dump_file) -> Iterator[Dict]:
+    for line_number, line in enumerate(dump_file, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError:
+            logger.warning(f"Skipping malformed JSON on line {line_number}")
+
+
+def iter_csv_products(dump_file) -> Iterator[Dict]:
+    # Ingredient lists can be far longer than the csv module's default field limit
+    csv.field_size_limit(sys.maxsize)
+    yield from csv.DictReader(dump_file, delimiter='\t', quoting=csv.QUOTE_NONE)
+
+
+def product_row(product: Dict):
+    """(code, fields..., last_modified_t) for a product worth storing, or None."""
+    code = normalize_gtin(product.get('code') or '')
+    if code is None:
+        return None
+    values = [str(product.get(field) or '').strip() for field in OPENFOODFACTS_LOCAL_FIELDS]
+    if not values[0] and not values[1]:
+        return None  # no name and no brand, nothing the processor could use
+    try:
+        last_modified = int(float(product.get('last_modified_t') or 0))
+    except (TypeError, ValueError):
+        last_modified = 0
+    return (code, *values, last_modified)
+
+
+def import_dump(path: str, db_path: str, dump_format: str = None, batch_size: int = DEFAULT_BATCH_SIZE) -> Dict:
+    if dump_format is None:
+        name = path.lower().replace('.gz', '')
+        dump_format = 'csv' if name.endswith(('.csv', '.tsv')) else 'jsonl'
+
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    OpenFoodFactsLocalStore.create_schema(conn)
+
+    columns = ['code'] + OPENFOODFACTS_LOCAL_FIELDS + ['last_modified_t']
+    updates = ", ".join(f"{column} = excluded.{column}" for column in columns[1:])
+    # Delta semantics: existing rows are only replaced by a newer revision of the product
+    upsert = (f"INSERT INTO off_products ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+              f"ON CONFLICT(code) DO UPDATE SET {updates} "
+              f"WHERE excluded.last_modified_t > off_products.last_modified_t")
+
+    started = time.monotonic()
+    read = skipped = 0
+    changes_before = conn.total_changes
+    batch = []
+    with open_dump(path) as dump_file:
+        products = iter_csv_products(dump_file) if dump_format == 'csv' else iter_jsonl_products(dump_file)
+        for product in products:
+            read += 1
+            row = product_row(product)
+            if row is None:
+                skipped += 1
+            else:
+                batch.append(row)
+            if len(batch) >= batch_size:
+                conn.executemany(upsert, batch)
+                conn.commit()
+                batch.clear()
+            if read % PROGRESS_INTERVAL == 0:
+                logger.info(f"Read {read} products ({read / (time.monotonic() - started):.0f}/s)")
+        if batch:
+            conn.executemany(upsert, batch)
+
+    written = conn.total_changes - changes_before
+    total = conn.execute("SELECT COUNT(*) FROM off_products").fetchone()[0]
+    conn.executemany("INSERT OR REPLACE INTO off_meta (key, value) VALUES (?, ?)", [
+        ("last_import", datetime.now().isoformat()),
+        ("last_import_source", path),
+        ("products", str(total))
+    ])
+    conn.commit()
+    conn.close()
+
+    return {
+        "read": read,
+        "skipped": skipped,
+        "written": written,
+        "products": total,
+        "seconds": round(time.monotonic() - started, 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import an OpenFoodFacts JSONL or CSV dump into a local SQLite store.")
+    parser.add_argument('dump', help="dump file (.jsonl, .csv, optionally .gz) or - for stdin")
+    parser.add_argument('--db', required=True, help="SQLite file to create or update")
+    parser.add_argument('--format', choices=['jsonl', 'csv'], help="dump format (default: from the file name)")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    summary = import_dump(args.dump, args.db, args.format, args.batch_size)
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Process a very large barcode file across several processes.
+
+The file is cut into fixed-size chunks that are handed to a pool of worker processes. Each
+worker keeps its own BarcodeAPIProcessor for its whole life (sessions, caches, circuit
+breakers). The workers take their tokens from one set of per-provider buckets kept in shared
+memory, so the pool as a whole gets exactly the rate and burst a single processor would use,
+and a Retry-After pause seen by one worker holds back all of them. Local work (formatting,
+classification, JSON repair, cache and local OpenFoodFacts reads) is CPU-bound, so cache-warm
+re-runs scale with the process count.
+
+Results are written as one NDJSON record per input barcode, in input order, as soon as every
+earlier chunk has finished. A chunk whose worker fails gets an error record per barcode instead
+of stopping the job. A summary goes to stderr.
+
+Usage:
+    python run_sharded_job.py barcodes.txt --processes 8 > results.ndjson
+    python run_sharded_job.py barcodes.json --processes 4 --workers 2 --output results.ndjson
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.util import Finalize
+from typing import Dict, List
+
+from barcode_api_processor import PROVIDER_RATE_LIMITS, BarcodeAPIProcessor, TokenBucket, read_barcode_file
+
+logger = logging.getLogger('run_sharded_job')
+
+DEFAULT_CHUNK_SIZE = 200
+# Chunks submitted per process ahead of the oldest unwritten one. Counts chunks that are
+# finished but waiting on an earlier one too, so memory stays bounded on huge inputs
+CHUNKS_IN_FLIGHT_PER_PROCESS = 2
+
+# The processor living in this worker process, created once by init_worker()
+_processor = None
+
+
+class SharedTokenBucket(TokenBucket):
+    """TokenBucket whose state and lock live in shared memory, so every worker draws on one budget."""
+    
+    def __init__(self, rate: float, burst: int, context):
+        # Must exist before TokenBucket.__init__ assigns tokens/last_refill/paused_until
+        self._state = context.RawArray('d', 3)
+        super().__init__(rate, burst)
+        self._lock = context.Lock()
+    
+    tokens = property(lambda self: self._state[0], lambda self, value: self._state.__setitem__(0, value))
+    last_refill = property(lambda self: self._state[1], lambda self, value: self._state.__setitem__(1, value))
+    paused_until = property(lambda self: self._state[2], lambda self, value: self._state.__setitem__(2, value))
+
+
+def shared_rate_limits(context) -> Dict[str, SharedTokenBucket]:
+    """One shared bucket per provider, sized from <PROVIDER>_RATE_LIMIT / <PROVIDER>_BURST."""
+    buckets = {}
+    for provider, config in PROVIDER_RATE_LIMITS.items():
+        rate = float(os.getenv(f"{provider.upper()}_RATE_LIMIT", str(config["rate"])))
+        burst = int(os.getenv(f"{provider.upper()}_BURST", str(config["burst"])))
+        buckets[provider] = SharedTokenBucket(rate, burst, context)
+    return buckets
+
+
+def init_worker(buckets: Dict[str, SharedTokenBucket], output_dir: str = None):
+    global _processor
+    _processor = BarcodeAPIProcessor(output_dir)
+    _processor.rate_limiter.buckets.update(buckets)
+    # Runs when the pool shuts the worker down, so caches are closed and temp dirs removed
+    Finalize(_processor, _processor.cleanup, exitpriority=10)
+
+
+def process_chunk(offset: int, barcodes: List[str], max_workers: int = None,
+                  barcode_deadline: float = None) -> List[Dict]:
+    """Outcome records for one chunk, in order, with indexes relative to the whole file."""
+    records = sorted(_processor.iter_process_barcodes(barcodes, max_workers, barcode_deadline=barcode_deadline),
+                     key=lambda r: r['index'])
+    for record in records:
+        record['index'] += offset
+        if 'duplicate_of' in record:
+            record['duplicate_of'] += offset
+    return records
+
+
+def chunk_error_records(offset: int, barcodes: List[str], error: Exception) -> List[Dict]:
+    """Error records for every barcode of a chunk whose worker failed."""
+    reason = f"Worker failed: {error!r}"
+    return [{'index': offset + i, 'barcode': barcode, 'status': 'error', 'reason': reason,
+             'elapsed_ms': 0.0, 'timings': {}}
+            for i, barcode in enumerate(barcodes)]
+
+
+def run_sharded(barcodes: List[str], output, processes: int = None, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                max_workers: int = None, barcode_deadline: float = None, output_dir: str = None) -> Dict:
+    processes = max(1, processes or os.cpu_count() or 1)
+    chunks = [(offset, barcodes[offset:offset + chunk_size]) for offset in range(0, len(barcodes), chunk_size)]
+    processes = min(processes, max(1, len(chunks)))
+    logger.info(f"Processing {len(barcodes)} barcodes in {len(chunks)} chunk(s) on {processes} process(es)")
+
+    started = time.monotonic()
+    statuses = {}
+    # Chunks that finished ahead of an earlier one wait here so output stays in input order
+    finished = {}
+    next_chunk = 0
+    submitted = 0
+    in_flight = set()
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=processes, mp_context=context, initializer=init_worker,
+                             initargs=(shared_rate_limits(context), output_dir)) as executor:
+        futures = {}
+        while next_chunk < len(chunks):
+            while submitted < len(chunks) and submitted - next_chunk < processes * CHUNKS_IN_FLIGHT_PER_PROCESS:
+                offset, chunk = chunks[submitted]
+                try:
+                    future = executor.submit(process_chunk, offset, chunk, max_workers, barcode_deadline)
+                except BrokenProcessPool as e:
+                    finished[submitted] = chunk_error_records(offset, chunk, e)
+                else:
+                    futures[future] = submitted
+                    in_flight.add(future)
+                submitted += 1
+            if in_flight:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    number = futures.pop(future)
+                    try:
+                        finished[number] = future.result()
+                    except Exception as e:
+                        offset, chunk = chunks[number]
+                        logger.error(f"Chunk {number} (barcodes {offset}-{offset + len(chunk) - 1}) failed: {e!r}")
+                        finished[number] = chunk_error_records(offset, chunk, e)
+            while next_chunk in finished:
+                for record in finished.pop(next_chunk):
+                    statuses[record['status']] = statuses.get(record['status'], 0) + 1
+                    output.write(json.dumps(record, separators=(',', ':')) + "\n")
+                output.flush()
+                next_chunk += 1
+
+    seconds = time.monotonic() - started
+    return {
+        "barcodes": len(barcodes),
+        "processes": processes,
+        "chunks": len(chunks),
+        "statuses": statuses,
+        "seconds": round(seconds, 2),
+        "barcodes_per_sec": round(len(barcodes) / seconds, 1) if seconds > 0 else None
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Process a barcode file across a pool of worker processes.")
+    parser.add_argument('barcode_file', help="barcode file (JSON list, or one per line)")
+    parser.add_argument('--processes', type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="barcodes processed concurrently inside each process (default: MAX_WORKERS)")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+                        help="barcodes handed to a process at a time (default: %(default)s)")
+    parser.add_argument('--barcode-deadline', type=float, default=None, help="seconds allowed per barcode")
+    parser.add_argument('--output', help="NDJSON file to write (default: stdout)")
+    parser.add_argument('--output-dir', help="output directory for each worker's processor")
+    args = parser.parse_args()
+
+    barcodes = read_barcode_file(args.barcode_file)
+    output = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    try:
+        summary = run_sharded(barcodes, output, args.processes, max(1, args.chunk_size), args.workers,
+                              args.barcode_deadline, args.output_dir)
+    finally:
+        if args.output:
+            output.close()
+    print(json.dumps(summary, indent=2), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
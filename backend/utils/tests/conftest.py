@@ -0,0 +1,61 @@
+"""
+Shared fixtures for the barcode processor tests.
+
+The processor is pointed at the offline upstream stand-in from benchmark_barcode_processor.py,
+so the tests need no network access or API keys.
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from barcode_api_processor import BarcodeAPIProcessor  # noqa: E402
+from benchmark_barcode_processor import configure_environment, run_mock_server  # noqa: E402
+
+MOCK_UPSTREAM_CONFIG = {
+    "latency_ms": 50, "jitter_ms": 0, "error_rate": 0, "rate_limit_every": 0, "rate_limit_burst": 0,
+    "retry_after": 0.1, "off_hit_rate": 0.4, "google_hit_rate": 0.2, "seed": 1, "llm_ms_per_1k_tokens": 0
+}
+
+
+def start_mock_upstream(**overrides):
+    """Start the upstream stand-in in its own process; returns (base URL, process)."""
+    port_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=run_mock_server, args=(dict(MOCK_UPSTREAM_CONFIG, **overrides), {}, port_queue),
+                                      daemon=True)
+    process.start()
+    return f"http://127.0.0.1:{port_queue.get(timeout=10)}", process
+
+
+@pytest.fixture(scope="session")
+def mock_upstream():
+    base_url, process = start_mock_upstream()
+    yield base_url
+    process.terminate()
+    process.join()
+
+
+@pytest.fixture
+def make_processor(mock_upstream, tmp_path):
+    """Build processors against the mock upstream; extra keyword arguments become environment variables."""
+    saved_environ = dict(os.environ)
+    processors = []
+
+    def make(base_url=None, **env):
+        configure_environment(base_url or mock_upstream, argparse.Namespace(
+            cache=False, workers=1, lookup_strategy=None, ai_batch_size=1, keep_rate_limits=False))
+        os.environ["BARCODE_CACHE_DIR"] = str(tmp_path / "cache")
+        os.environ.update({name: str(value) for name, value in env.items()})
+        processor = BarcodeAPIProcessor(str(tmp_path / f"output{len(processors)}"))
+        processors.append(processor)
+        return processor
+
+    yield make
+    for processor in processors:
+        processor.cleanup()
+    os.environ.clear()
+    os.environ.update(saved_environ)
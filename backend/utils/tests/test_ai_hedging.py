@@ -0,0 +1,15 @@
+from benchmark_barcode_processor import gs1_barcode
+
+
+def test_hedge_delay_is_not_spent_waiting_for_a_thread(make_processor):
+    # Every AI reply takes ~50 ms, well inside the 0.2 s hedge delay, so nothing should be hedged
+    # even when a batch runs many more workers than MAX_WORKERS
+    processor = make_processor(MAX_WORKERS=1, AI_HEDGING="true", AI_HEDGE_MIN_DELAY=0.2, AI_HEDGE_BUDGET=1.0)
+    processor.process_barcodes([gs1_barcode(sequence, prefix="891") for sequence in range(8)], max_workers=1)
+
+    results = processor.process_barcodes([gs1_barcode(sequence, prefix="892") for sequence in range(48)],
+                                         max_workers=16)
+
+    counters = processor.metrics.snapshot()["counters"]
+    assert results
+    assert "ai_hedges" not in counters
@@ -0,0 +1,45 @@
+import pytest
+
+from barcode_api_processor import GS1_PREFIX_INDEX
+
+
+def with_check_digit(body: str) -> str:
+    total = sum(int(digit) * (3 if position % 2 == 0 else 1) for position, digit in enumerate(reversed(body)))
+    return body + str((10 - total % 10) % 10)
+
+
+@pytest.mark.parametrize("body, country", [
+    ("890103000001", "India"),
+    ("400638133393", "Germany"),
+    ("03600029145", "USA & Canada"),      # UPC-A
+    ("978030640615", "Unknown"),          # Books (ISBN)
+    ("977123456700", "Unknown"),          # Serial publications (ISSN)
+    ("960123456789", "Unknown"),          # GS1 Global Office (GTIN-8)
+    ("950123456789", "Unknown"),          # GS1 Global Office
+    ("210216300001", "Unknown"),          # Restricted distribution
+    ("140000000000", "Unknown"),          # unassigned
+])
+def test_country_only_names_real_countries(body, country):
+    assert GS1_PREFIX_INDEX.country(with_check_digit(body)) == country
+
+
+@pytest.mark.parametrize("body", ["0512345", "1234567", "9812345", "9912345", "8901234"])
+def test_ean8_is_not_read_against_gtin13_prefixes(body):
+    barcode = with_check_digit(body)
+    assert GS1_PREFIX_INDEX.lookup(barcode) is None
+    assert GS1_PREFIX_INDEX.country(barcode) == "Unknown"
+
+
+def test_formatted_country_of_origin(make_processor):
+    processor = make_processor()
+    for body, country in [("978030640615", "Unknown"), ("210216300001", "Unknown"), ("890103000001", "India")]:
+        product = processor._intelligent_format_product_data({"name": "Test product"}, with_check_digit(body))
+        assert product["Specification"]["Country of Origin"] == country
+
+
+def test_coupons_are_rejected_but_ean8_is_not(make_processor):
+    processor = make_processor()
+    for body in ["981234567890", "991234567890", "051234567890", "980123456789"]:
+        assert processor._barcode_problem(with_check_digit(body))
+    for body in ["0512345", "9812345", "9912345"]:
+        assert processor._barcode_problem(with_check_digit(body)) is None
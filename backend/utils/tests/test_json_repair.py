@@ -0,0 +1,33 @@
+import time
+
+import pytest
+
+from barcode_api_processor import parse_llm_json
+from benchmark_json_parser import CORPUS
+
+
+@pytest.mark.parametrize("name, text, expected", CORPUS, ids=[case[0] for case in CORPUS])
+def test_corpus(name, text, expected):
+    assert parse_llm_json(text) == expected
+
+
+@pytest.mark.parametrize("text, expected", [
+    ('[1 2 3]', [1, 2, 3]),
+    ('{"Flags": [true false null]}', {"Flags": [True, False, None]}),
+    ('{"Features": [Rich and creamy, Light]}', {"Features": ["Rich and creamy", "Light"]}),
+    ('{"Weight": 500 g}', {"Weight": "500 g"}),
+])
+def test_bare_values(text, expected):
+    assert parse_llm_json(text) == expected
+
+
+@pytest.mark.parametrize("tail", [
+    '{"Brand": Amul' + ' ' * 200000 + '}',
+    '{"Brand": Amul' + ' \t' * 100000,
+    '{"Features": [Rich' + ' x' * 100000 + ']}',
+])
+def test_long_whitespace_runs_repair_in_linear_time(tail):
+    started = time.monotonic()
+    parsed = parse_llm_json(tail)
+    assert time.monotonic() - started < 1.0
+    assert parsed is not None
@@ -0,0 +1,79 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from benchmark_barcode_processor import barcode_bucket, gs1_barcode
+from conftest import start_mock_upstream
+
+
+def timed_batch(processor, barcodes, max_workers):
+    started = time.monotonic()
+    results = processor.process_barcodes(barcodes, max_workers=max_workers)
+    return time.monotonic() - started, results
+
+
+def test_race_with_more_workers_than_configured_is_not_slower_than_sequential(make_processor):
+    # MAX_WORKERS=1 but the batch asks for 8: the race pool has to follow the batch, not the setting
+    barcodes = [gs1_barcode(sequence) for sequence in range(24)]
+    sequential = make_processor(MAX_WORKERS=1, LOOKUP_STRATEGY="sequential")
+    race = make_processor(MAX_WORKERS=1, LOOKUP_STRATEGY="race")
+
+    sequential_seconds, sequential_results = timed_batch(sequential, barcodes, max_workers=8)
+    race_seconds, race_results = timed_batch(race, barcodes, max_workers=8)
+
+    assert len(race_results) == len(sequential_results)
+    assert race_seconds <= sequential_seconds
+
+
+@pytest.fixture(scope="module")
+def slow_upstream():
+    base_url, process = start_mock_upstream(latency_ms=400)
+    yield base_url
+    process.terminate()
+    process.join()
+
+
+def found_barcode():
+    """A barcode the mock upstream has on OpenFoodFacts."""
+    return next(barcode for barcode in map(gs1_barcode, range(1000)) if barcode_bucket(barcode) < 0.3)
+
+
+@pytest.mark.parametrize("waiter_deadline, waiter_status", [(None, "found"), (0.2, "pending")])
+def test_waiter_does_not_inherit_a_deadline_cut_miss(make_processor, slow_upstream, waiter_deadline, waiter_status):
+    # The owner gives up after 0.15 s while the upstream takes 0.4 s; a caller that joined its
+    # lookup must not report that as not_found
+    processor = make_processor(slow_upstream, LOOKUP_STRATEGY="sequential")
+    barcode = found_barcode()
+    owner_records = []
+    owner = threading.Thread(target=lambda: owner_records.extend(
+        processor.iter_process_barcodes([barcode], barcode_deadline=0.15)))
+    owner.start()
+    time.sleep(0.05)
+    waiter_records = list(processor.iter_process_barcodes([barcode], barcode_deadline=waiter_deadline))
+    owner.join()
+
+    assert processor.metrics.snapshot()["counters"]["coalesced_lookups"] == {"all": 1}
+    assert owner_records[0]["status"] == "pending"
+    assert waiter_records[0]["status"] == waiter_status
+
+
+def test_async_lookups_run_concurrently_on_one_thread(make_processor, slow_upstream):
+    # 200 lookups of two to four 0.4 s upstream calls each would take minutes one at a time; in
+    # flight together they take seconds, without a thread per call: all of them run on the
+    # processor's event loop
+    processor = make_processor(slow_upstream, LOOKUP_STRATEGY="sequential", HTTP_POOL_SIZE=200)
+    barcodes = [gs1_barcode(sequence, prefix="894") for sequence in range(200)]
+    threads_before = threading.active_count()
+
+    async def look_up_all():
+        return await asyncio.gather(*(processor.process_barcode_async(barcode) for barcode in barcodes))
+
+    started = time.monotonic()
+    records = asyncio.run(look_up_all())
+
+    assert time.monotonic() - started < 8.0
+    assert [record["barcode"] for record in records] == barcodes
+    assert {record["status"] for record in records} <= {"found", "not_found"}
+    assert threading.active_count() <= threads_before + 1